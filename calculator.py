@@ -1,3 +1,5 @@
+import os
+
 MAX_TRANSCODE_DURATION_SECONDS = 181
 TRANSCODE_DATA_BUDGET_KILOBITS = (7 * 1024 * 1024 * 8) / 1000
 MIN_VIDEO_BITRATE_KBPS = 150
@@ -6,6 +8,15 @@ MAX_VIDEO_BITRATE_KBPS = 800
 MAX_AUDIO_BITRATE_KBPS = 320
 MIN_DURATION_LIMITED_VIDEO_BITRATE_KBPS = 256
 MIN_DURATION_LIMITED_AUDIO_BITRATE_KBPS = 64
+# Video codecs Discord plays inline, as reported by ffprobe.
+PLAYABLE_VIDEO_CODECS = ("h264", "hevc")
+
+def get_file_size_limit():
+    try:
+        size_mb = float(os.getenv('TIKBOT_FILE_SIZE_LIMIT', '8'))
+        return size_mb * 1_000_000
+    except ValueError:
+        return 8_000_000
 
 class CalculationResult:
     videoBitrate: int
@@ -1,34 +1,284 @@
-import psycopg2
-from dotenv import load_dotenv 
+import logging
 import os
+import sqlite3
+import threading
+import weakref
 from datetime import datetime
 
-try:
-	load_dotenv()
-	host = os.getenv('DB_HOST')
-	dbUser = os.getenv('DB_USER')
-	dbPass = os.getenv('DB_PASS')
-	dbName = os.getenv('DB_NAME')
-	conn = psycopg2.connect(f"host={host} dbname={dbName} user={dbUser} password={dbPass}")
-except Exception as e:
-    print("Cannot load DB details, repost detection will not be available: " + str(e))
+from dotenv import load_dotenv
 
-def savePost(userId, postId, platform, messageId):
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+_FIND_POST_PREPARED_PREFIX = "tikbot_find_latest_post"
+
+
+def get_db_backend():
+    configured = (os.getenv('TIKBOT_DB_BACKEND') or '').strip().lower()
+    if configured:
+        return configured
+    # Postgres when credentials are supplied, otherwise an in-process SQLite store.
+    return 'postgres' if os.getenv('DB_HOST') else 'sqlite'
+
+
+def get_db_pool_size():
+    try:
+        return max(1, int(os.getenv('TIKBOT_DB_POOL_SIZE', '4')))
+    except ValueError:
+        return 4
+
+
+def _get_float_env(name, default):
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return float(default)
+
+
+class RecentPostCache(TTLCache):
+    """Bounded LRU of recent repost lookups keyed by (videoId, platform), with expiry.
+
+    Entries hold the latest post row, or None for a cached miss. Misses expire sooner than hits
+    so a video that is posted elsewhere (e.g. by another bot instance) is picked up quickly.
+    """
+
+    def get(self, videoId, platform):
+        """Return (hit, row) for a cached lookup."""
+        return super().get((str(videoId), platform))
+
+    def put(self, videoId, platform, row):
+        super().put((str(videoId), platform), row)
+
+
+recent_posts = RecentPostCache(
+    max_entries=int(_get_float_env('TIKBOT_REPOST_CACHE_SIZE', 10000)),
+    ttl_seconds=_get_float_env('TIKBOT_REPOST_CACHE_TTL', 3600),
+    negative_ttl_seconds=_get_float_env('TIKBOT_REPOST_CACHE_NEGATIVE_TTL', 30),
+)
+
+
+class PostgresPostStore:
+    """Posts table access through a lazily created, thread-safe psycopg2 connection pool."""
+
+    def __init__(self, dsn: str, max_connections: int, table: str = 'posts'):
+        self._dsn = dsn
+        self._table = table
+        self._prepared_name = f"{_FIND_POST_PREPARED_PREFIX}_{table}"
+        self._max_connections = max_connections
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool raises instead of waiting when exhausted, so gate access.
+        self._available = threading.BoundedSemaphore(max_connections)
+        self._prepared_connections = weakref.WeakSet()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                # minconn == maxconn so idle connections are kept rather than closed on return.
+                self._pool = ThreadedConnectionPool(self._max_connections, self._max_connections, self._dsn)
+                logger.info("Connected to Postgres for repost detection (pool size %s)", self._max_connections)
+            return self._pool
+
+    @staticmethod
+    def _run_on(conn, operation):
+        result = operation(conn)
+        conn.commit()
+        return result
+
+    def _run(self, operation, idempotent=False):
+        """Run `operation(conn)` in a transaction on a pooled connection.
+
+        After a lost connection, an `idempotent` operation is retried once on a brand new
+        connection. Writes are not: the commit may have gone through before the connection dropped.
+        """
+        import psycopg2
 
-	cur = conn.cursor()
+        with self._available:
+            pool = self._get_pool()
+            conn = pool.getconn()
+            discard = False
+            try:
+                return self._run_on(conn, operation)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # The server went away (restart, network blip). The pool's other idle connections
+                # are probably dead too, so drop this one and retry reads on a brand new connection.
+                discard = True
+                if not idempotent:
+                    raise
+                logger.warning("Postgres connection lost; retrying on a new connection", exc_info=True)
+            except Exception:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+                raise
+            finally:
+                if discard:
+                    self._prepared_connections.discard(conn)
+                pool.putconn(conn, close=discard)
 
-	cur.execute("INSERT INTO posts (\"userId\", \"videoId\", \"platform\", \"postDateTime\", \"discordMessageId\") VALUES (%s, %s, %s, %s, %s)", (userId, postId, platform, datetime.now(tz=None), messageId))
+            # Runs outside the pool, in the slot the dropped connection freed.
+            conn = psycopg2.connect(self._dsn)
+            try:
+                return self._run_on(conn, operation)
+            finally:
+                conn.close()
 
-	conn.commit()
+    def _prepare(self, cur, conn):
+        if conn in self._prepared_connections:
+            return
+        cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name=%s", (self._prepared_name,))
+        if cur.fetchone() is None:
+            # Earlier platforms in $2 win; within a platform the newest post wins.
+            cur.execute(
+                f"PREPARE {self._prepared_name} (text, text[]) AS "
+                f"SELECT \"userId\", \"postDateTime\", \"discordMessageId\", \"platform\" FROM {self._table} "
+                "WHERE \"videoId\"=$1 AND \"platform\"=ANY($2) "
+                "ORDER BY array_position($2, \"platform\"::text), \"postId\" DESC LIMIT 1"
+            )
+        self._prepared_connections.add(conn)
+
+    def save_post(self, userId, videoId, platform, postDateTime, messageId):
+        def operation(conn):
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"INSERT INTO {self._table} (\"userId\", \"videoId\", \"platform\", \"postDateTime\", \"discordMessageId\") VALUES (%s, %s, %s, %s, %s)",
+                    (userId, videoId, platform, postDateTime, messageId),
+                )
+        self._run(operation)
+
+    def find_latest_post(self, videoId, platforms):
+        def operation(conn):
+            with conn.cursor() as cur:
+                self._prepare(cur, conn)
+                cur.execute(f"EXECUTE {self._prepared_name} (%s, %s)", (videoId, list(platforms)))
+                return cur.fetchone()
+        return self._run(operation, idempotent=True)
+
+
+class SqlitePostStore:
+    """Posts table in SQLite, for running without Postgres. Defaults to an in-memory database."""
+
+    def __init__(self, path: str, table: str = 'posts', create_index: bool = True):
+        self._path = path
+        self._table = table
+        self._create_index = create_index
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _get_connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} ("
+                "\"postId\" INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "\"userId\" TEXT, \"videoId\" TEXT, \"platform\" TEXT, "
+                "\"postDateTime\" TEXT, \"discordMessageId\" TEXT)"
+            )
+            if self._create_index:
+                self.create_lookup_index()
+            self._conn.commit()
+            logger.info("Using SQLite repost detection store at %s", self._path)
+        return self._conn
+
+    def create_lookup_index(self):
+        self._get_connection().execute(
+            f"CREATE INDEX IF NOT EXISTS {self._table}_video_platform_post_idx "
+            f"ON {self._table} (\"videoId\", \"platform\", \"postId\" DESC)"
+        )
+        self._conn.commit()
+
+    def save_post(self, userId, videoId, platform, postDateTime, messageId):
+        with self._lock:
+            conn = self._get_connection()
+            conn.execute(
+                f"INSERT INTO {self._table} (\"userId\", \"videoId\", \"platform\", \"postDateTime\", \"discordMessageId\") VALUES (?, ?, ?, ?, ?)",
+                (userId, videoId, platform, postDateTime.isoformat(), None if messageId is None else str(messageId)),
+            )
+            conn.commit()
+
+    def find_latest_post(self, videoId, platforms):
+        platforms = list(platforms)
+        placeholders = ", ".join("?" for _ in platforms)
+        priority = " ".join(f"WHEN ? THEN {index}" for index in range(len(platforms)))
+        with self._lock:
+            row = self._get_connection().execute(
+                f"SELECT \"userId\", \"postDateTime\", \"discordMessageId\", \"platform\" FROM {self._table} "
+                f"WHERE \"videoId\"=? AND \"platform\" IN ({placeholders}) "
+                f"ORDER BY CASE \"platform\" {priority} END, \"postId\" DESC LIMIT 1",
+                (videoId, *platforms, *platforms),
+            ).fetchone()
+        if row is None:
+            return None
+        return (row[0], datetime.fromisoformat(row[1]), row[2], row[3])
+
+
+_post_store = None
+_post_store_lock = threading.Lock()
+
+
+def _create_post_store():
+    backend = get_db_backend()
+    if backend == 'postgres':
+        host = os.getenv('DB_HOST')
+        dbUser = os.getenv('DB_USER')
+        dbPass = os.getenv('DB_PASS')
+        dbName = os.getenv('DB_NAME')
+        return PostgresPostStore(f"host={host} dbname={dbName} user={dbUser} password={dbPass}", get_db_pool_size())
+    if backend in ('sqlite', 'memory'):
+        return SqlitePostStore(os.getenv('TIKBOT_DB_PATH') or ':memory:')
+    raise ValueError(f"Unknown TIKBOT_DB_BACKEND '{backend}'")
+
+
+def get_post_store():
+    global _post_store
+    with _post_store_lock:
+        if _post_store is None:
+            _post_store = _create_post_store()
+        return _post_store
+
+
+def savePost(userId, postId, platform, messageId):
+    postDateTime = datetime.now(tz=None)
+    get_post_store().save_post(userId, postId, platform, postDateTime, messageId)
+    recent_posts.put(postId, platform, (userId, postDateTime, None if messageId is None else str(messageId)))
 
-	cur.close()
 
 def doesPostExist(videoId, platform):
-	cur = conn.cursor()
-	cur.execute("SELECT \"userId\", \"postDateTime\", \"discordMessageId\" FROM posts WHERE \"videoId\"=(%s) AND \"platform\"=(%s) ORDER BY \"postId\" DESC LIMIT 1", (videoId, platform))
-	result = cur.fetchone()
-	print("Heres the result:")
-	print(result)
-
-	cur.close()
-	return result
\ No newline at end of file
+    return findLatestPost(videoId, [platform])
+
+
+def findLatestPost(videoId, platforms):
+    """Look up a video across several platforms in one query, preferring earlier platforms.
+
+    Answers from the recent-posts cache when every platform up to the first hit is cached.
+    """
+    platforms = list(platforms)
+    for platform in platforms:
+        hit, row = recent_posts.get(videoId, platform)
+        if not hit:
+            break
+        if row is not None:
+            logger.debug("Repost lookup for %s/%s answered from cache", platform, videoId)
+            return row
+    else:
+        logger.debug("Repost lookup for %s/%s answered from cache (no post)", platforms, videoId)
+        return None
+
+    result = get_post_store().find_latest_post(videoId, platforms)
+    logger.debug("Repost lookup for %s/%s returned %s", platforms, videoId, result)
+    if result is None:
+        for platform in platforms:
+            recent_posts.put(videoId, platform, None)
+        return None
+
+    row, matchedPlatform = tuple(result[:3]), result[3]
+    # Platforms ahead of the match had no posts; ones after it weren't checked.
+    for platform in platforms[:platforms.index(matchedPlatform)]:
+        recent_posts.put(videoId, platform, None)
+    recent_posts.put(videoId, matchedPlatform, row)
+    return row
@@ -0,0 +1,182 @@
+import logging
+import os
+import random
+import re
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# The video itself is gone or hidden (private, removed, taken down), so no fallback can fetch it.
+UNAVAILABLE = 'unavailable'
+# Retrying the same stage won't help, but another stage or source might still work.
+PERMANENT = 'permanent'
+RATE_LIMITED = 'rate-limited'
+TRANSIENT = 'transient'
+# Errors that say nothing about whether trying again could help, e.g. an extractor that
+# could not parse the page. The next fallback stage is a better bet than a retry.
+UNKNOWN = 'unknown'
+
+_HTTP_STATUS_RE = re.compile(r"HTTP Error (?P<status>\d{3})")
+_PERMANENT_STATUSES = (401, 404, 410, 451)
+_PERMANENT_ERROR_TYPES = ('GeoRestrictedError', 'UnsupportedError')
+_UNAVAILABLE_MESSAGES = (
+    'private video',
+    'video is private',
+    'account is private',
+    'video unavailable',
+    'video is unavailable',
+    'video is not available',
+    'has been removed',
+    'no longer available',
+    'has been terminated',
+    'copyright',
+)
+_PERMANENT_MESSAGES = (
+    'not available in your country',
+    'not made this video available in your country',
+    'geo restrict',
+    'geo-restrict',
+    'unsupported url',
+    'login required',
+    'sign in to confirm your age',
+    'members-only',
+)
+_RATE_LIMITED_MESSAGES = ('too many requests', 'rate limit', 'rate-limit')
+_TRANSIENT_ERROR_TYPES = (
+    'YtdlpAttemptTimeout',
+    'TimeoutError',
+    'ConnectionError',
+    'ConnectionResetError',
+    'IncompleteRead',
+    'TransportError',
+    'WorkerExited',
+)
+_TRANSIENT_MESSAGES = (
+    'timed out',
+    'connection reset',
+    'connection refused',
+    'connection aborted',
+    'remote end closed',
+    'temporarily unavailable',
+    'temporary failure',
+    'network is unreachable',
+    'incomplete read',
+    'bytes read',
+)
+# Waiting less than this after a 429 with no Retry-After rarely gets a different answer.
+_RATE_LIMITED_MIN_DELAY = 5.0
+
+
+def get_retry_max_delay() -> float:
+    try:
+        return max(0.0, float(os.getenv('TIKBOT_RETRY_MAX_DELAY', '60')))
+    except ValueError:
+        return 60.0
+
+
+def _iter_error_chain(error: BaseException | None):
+    """Yield `error` and what it wraps: yt-dlp's exc_info/cause, then __cause__/__context__."""
+    pending = [error]
+    seen = set()
+    while pending:
+        exc = pending.pop(0)
+        if not isinstance(exc, BaseException) or id(exc) in seen:
+            continue
+        seen.add(id(exc))
+        yield exc
+        exc_info = getattr(exc, 'exc_info', None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1:
+            pending.append(exc_info[1])
+        pending.extend((getattr(exc, 'cause', None), exc.__cause__, exc.__context__))
+
+
+def get_http_status(error: BaseException | None) -> int | None:
+    for exc in _iter_error_chain(error):
+        for attr in ('status', 'code'):
+            status = getattr(exc, attr, None)
+            if isinstance(status, int) and 100 <= status < 600:
+                return status
+    for exc in _iter_error_chain(error):
+        match = _HTTP_STATUS_RE.search(str(exc))
+        if match:
+            return int(match.group('status'))
+    return None
+
+
+def parse_retry_after(value: str | None, now: datetime | None = None) -> float | None:
+    """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - (now or datetime.now(timezone.utc))).total_seconds())
+
+
+def get_retry_after(error: BaseException | None) -> float | None:
+    for exc in _iter_error_chain(error):
+        retry_after = getattr(exc, 'retry_after', None)
+        if isinstance(retry_after, (int, float)):
+            return float(retry_after)
+        response = getattr(exc, 'response', None)
+        headers = getattr(response, 'headers', None) or getattr(exc, 'headers', None)
+        if headers is not None and hasattr(headers, 'get'):
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+    return None
+
+
+def classify_error(error: BaseException | None) -> str:
+    """Classify a download error as UNAVAILABLE, PERMANENT, RATE_LIMITED, TRANSIENT or UNKNOWN.
+
+    Looks at HTTP status codes, exception type names (including those carried back from worker
+    processes) and yt-dlp's error messages, through the errors yt-dlp wraps.
+    """
+    chain = list(_iter_error_chain(error))
+    if not chain:
+        return UNKNOWN
+    status = get_http_status(error)
+    names = {type(exc).__name__ for exc in chain} | {getattr(exc, 'error_type', None) for exc in chain}
+    message = ' '.join(str(exc) for exc in chain).lower()
+
+    if status == 429 or any(marker in message for marker in _RATE_LIMITED_MESSAGES):
+        return RATE_LIMITED
+    if any(marker in message for marker in _UNAVAILABLE_MESSAGES):
+        return UNAVAILABLE
+    if (
+        status in _PERMANENT_STATUSES
+        or names.intersection(_PERMANENT_ERROR_TYPES)
+        or any(marker in message for marker in _PERMANENT_MESSAGES)
+    ):
+        return PERMANENT
+    if (
+        (status is not None and status >= 500)
+        or names.intersection(_TRANSIENT_ERROR_TYPES)
+        or any(marker in message for marker in _TRANSIENT_MESSAGES)
+    ):
+        return TRANSIENT
+    return UNKNOWN
+
+
+def get_retry_delay(attempt: int, base_delay: float, kind: str = TRANSIENT, retry_after: float | None = None) -> float:
+    """Exponential backoff with jitter before retry number `attempt` (1 for the first retry).
+
+    The delay doubles from `base_delay` up to TIKBOT_RETRY_MAX_DELAY, and a random half of it is
+    taken off so concurrent downloads spread out. A rate-limited retry waits at least as long
+    as the server's Retry-After.
+    """
+    if kind == RATE_LIMITED and base_delay > 0:
+        base_delay = max(base_delay, _RATE_LIMITED_MIN_DELAY)
+    delay = min(get_retry_max_delay(), base_delay * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
@@ -1,25 +1,44 @@
+import asyncio
+import contextlib
+import copy
 import logging
 import os
 import re
 import shutil
-import time
+import threading
 from datetime import datetime
 from urllib.parse import urlparse
 from zoneinfo import ZoneInfo
 
-import ffmpeg
 import requests
 import yt_dlp
+from yt_dlp.downloader.external import FFmpegFD
 from yt_dlp.networking.impersonate import ImpersonateTarget
-from yt_dlp.utils import DownloadError
-
-from dbInteraction import doesPostExist
+from yt_dlp.utils import DownloadCancelled, DownloadError, ExtractorError, download_range_func
+
+from calculator import PLAYABLE_VIDEO_CODECS, calculateBitrate, calculateBitrateAudioOnly, get_file_size_limit
+from dbInteraction import findLatestPost
+from download_errors import PERMANENT, RATE_LIMITED, UNAVAILABLE, UNKNOWN, classify_error, get_retry_after, get_retry_delay, get_retry_max_delay
+from fragment_downloads import get_connection_budget, get_fragment_concurrency, get_fragment_ydl_opts
+from media_info import MediaInfo, normalize_vcodec
+from partial_downloads import PartialDownloads
 from validator import normalize_platform
-from tiktok_embed_fallback import download_tiktok_embed_video_playwright, get_tiktok_embed_url
+from tiktok_embed_fallback import (
+    download_tiktok_embed_video_playwright,
+    get_resolve_cache_ttl,
+    get_tiktok_embed_url,
+    get_tiktok_video_page_url,
+)
+from ttl_cache import TTLCache
+from ytdlp_worker import YtdlpAttemptTimeout, get_ytdlp_attempt_timeout, get_ytdlp_worker_pool
 
 logger = logging.getLogger(__name__)
 
 _KKCLIP_REEL_RE = re.compile(r"/(?:reel|p|tv)/(?P<shortcode>[^/?#]+)", re.IGNORECASE)
+_INSTAGRAM_SHORTCODE_RE = re.compile(r"/(?:reels?|p|tv)/(?P<shortcode>[^/?#&]+)", re.IGNORECASE)
+_TIKTOK_VIDEO_ID_RE = re.compile(r"/(?:video|photo)/(?P<id>\d+)")
+_YOUTUBE_VIDEO_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)(?P<id>[A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])")
+_REDDIT_VIDEO_ID_RE = re.compile(r"^(?:[^/]+\.)?v\.redd\.it/(?P<id>[A-Za-z0-9]+)", re.IGNORECASE)
 _META_MEDIA_RE = re.compile(
     r'<meta[^>]+(?:property|name)=["\'](?:og:video(?::secure_url)?|twitter:player:stream)["\'][^>]+content=["\'](?P<url>[^"\']+)["\']',
     re.IGNORECASE,
@@ -46,20 +65,34 @@ class _YtdlpLogger:
 _YTDLP_LOGGER = _YtdlpLogger(logger)
 
 
-def _get_format_candidates(video_url: str) -> list[str]:
+def _format_filesize_filter(size_bytes: float) -> str:
+    """Express a byte count the way yt-dlp's filesize filters expect (decimal units)."""
+    if size_bytes % 1_000_000 == 0:
+        return f"{int(size_bytes // 1_000_000)}M"
+    return f"{int(size_bytes // 1000)}K"
+
+
+def _get_format_candidates(video_url: str, size_limit: float | None = None) -> list[str]:
     """Return an ordered list of format strings to try for the given URL."""
     lowered_url = video_url.lower()
     candidates: list[str] = []
+    if size_limit is None:
+        size_limit = get_file_size_limit()
+    total_limit = _format_filesize_filter(size_limit)
+    video_limit = _format_filesize_filter(max(size_limit - 1_000_000, size_limit / 2))
 
     if 'youtube.com' in lowered_url or 'youtu.be' in lowered_url:
         # Prefer a higher-quality MP4/M4A pair that still fits under Discord's upload budget.
-        candidates.append('bestvideo[ext=mp4][filesize<7M]+bestaudio[ext=m4a][filesize<1050K]/b[ext=mp4][filesize<8M]/best[filesize<8M]')
+        candidates.append(
+            f'bestvideo[ext=mp4][filesize<{video_limit}]+bestaudio[ext=m4a][filesize<1050K]'
+            f'/b[ext=mp4][filesize<{total_limit}]/best[filesize<{total_limit}]'
+        )
     elif 'tiktok.com' in lowered_url:
-        candidates.append('best[filesize<8M][vcodec!=none]/worst[vcodec!=none]')
+        candidates.append(f'best[filesize<{total_limit}][vcodec!=none]/worst[vcodec!=none]')
     elif 'twitch.tv' in lowered_url:
-        candidates.append('best[filesize<8M][format_id!*=portrait]/worst[format_id!*=portrait]')
+        candidates.append(f'best[filesize<{total_limit}][format_id!*=portrait]/worst[format_id!*=portrait]')
     else:
-        candidates.append('best[filesize<8M][vcodec!=none]/worst[vcodec!=none]')
+        candidates.append(f'best[filesize<{total_limit}][vcodec!=none]/worst[vcodec!=none]')
 
     if 'reddit.com' in lowered_url:
         # Reddit often provides separate audio/video streams. Fallback to merging them.
@@ -71,6 +104,14 @@ def _get_format_candidates(video_url: str) -> list[str]:
     return candidates
 
 
+def _get_audio_format_candidates(size_limit: float | None = None) -> list[str]:
+    """Format strings for an audio-only download, falling back to muxed formats for sites without one."""
+    if size_limit is None:
+        size_limit = get_file_size_limit()
+    total_limit = _format_filesize_filter(size_limit)
+    return [f'bestaudio[filesize<{total_limit}]/bestaudio/best', 'best']
+
+
 def _get_alternate_urls(video_url: str, platform: str) -> list[tuple[str, str]]:
     """Return equivalent URLs that yt-dlp is more likely to understand."""
     parsed = urlparse(video_url if '://' in video_url else f"https://{video_url}")
@@ -95,6 +136,146 @@ def _is_kkclip_host(host: str) -> bool:
     )
 
 
+# IDs that needed a network round-trip (short links, metadata extraction), keyed by URL.
+_video_id_cache = TTLCache(max_entries=2048, ttl_seconds=get_resolve_cache_ttl(), negative_ttl_seconds=0)
+
+
+class _PrefetchedInfo:
+    """Metadata extracted in-process, with the YoutubeDL that extracted it.
+
+    The first direct attempt downloads through that same YoutubeDL, so cookies the extractor set
+    are still there when the media is fetched.
+    """
+
+    def __init__(self, ydl, info: dict):
+        self.ydl = ydl
+        self.info = info
+
+    def close(self):
+        ydl, self.ydl = self.ydl, None
+        if ydl is not None:
+            ydl.close()
+
+
+def resolve_video_id(video_url: str, allow_network: bool = False) -> str | None:
+    """Return the yt-dlp video ID for a URL without downloading any media.
+
+    IDs are parsed from known URL patterns first. With `allow_network`, TikTok short links are
+    followed and other URLs fall back to a metadata-only yt-dlp extraction.
+    """
+    video_id, prefetched = _resolve_video(video_url, allow_network)
+    if prefetched is not None:
+        prefetched.close()
+    return video_id
+
+
+def _resolve_video(video_url: str, allow_network: bool = False) -> tuple[str | None, _PrefetchedInfo | None]:
+    """resolve_video_id(), also returning what an in-process yt-dlp extraction found.
+
+    The download can then start from that metadata instead of extracting it a second time.
+    The caller closes it.
+    """
+    platform = normalize_platform(video_url)
+    parsed = urlparse(video_url if '://' in video_url else f"https://{video_url}")
+
+    if platform == 'tiktok':
+        match = _TIKTOK_VIDEO_ID_RE.search(parsed.path)
+    elif platform == 'youtube':
+        match = _YOUTUBE_VIDEO_ID_RE.search(f"{parsed.netloc}{parsed.path}?{parsed.query}")
+    elif platform == 'instagram':
+        match = _INSTAGRAM_SHORTCODE_RE.search(parsed.path)
+        if match:
+            return match.group('shortcode'), None
+    elif platform == 'reddit':
+        match = _REDDIT_VIDEO_ID_RE.search(f"{parsed.netloc}{parsed.path}")
+    else:
+        match = None
+
+    if match:
+        return match.group('id'), None
+    if not allow_network:
+        return None, None
+
+    hit, video_id = _video_id_cache.get(video_url)
+    if hit:
+        return video_id, None
+
+    prefetched = None
+    if platform == 'tiktok':
+        page_url = get_tiktok_video_page_url(video_url)
+        video_id = resolve_video_id(page_url) if page_url and page_url != video_url else None
+    else:
+        info, prefetched = _run_extract_video_info(video_url)
+        video_id = info.get('id') or None if info else None
+    _video_id_cache.put(video_url, video_id)
+    return video_id, prefetched
+
+
+def _extract_video_info(video_url: str, ydl=None) -> dict | None:
+    """Extract the metadata of a single video without processing formats or downloading.
+
+    Uses `ydl` and leaves it open when given, otherwise a YoutubeDL of its own.
+    """
+    if ydl is None:
+        with yt_dlp.YoutubeDL(_create_ydl_opts(_get_format_candidates(video_url)[0])) as ydl:
+            return _extract_video_info(video_url, ydl)
+    try:
+        info = ydl.extract_info(video_url, download=False, process=False)
+    except Exception as exc:
+        logger.info("Could not resolve video id for %s before download: %s", video_url, _compact_error_message(exc))
+        return None
+
+    # Redirects and playlists don't carry the ID of the video that will be downloaded.
+    if not isinstance(info, dict) or info.get('_type', 'video') != 'video':
+        return None
+    return info
+
+
+def _run_extract_video_info(video_url: str) -> tuple[dict | None, _PrefetchedInfo | None]:
+    """Run `_extract_video_info` in a yt-dlp worker process under the attempt time limit.
+
+    Falls back to running in-process when TIKBOT_YTDLP_WORKERS=0, and only then returns the
+    extraction for the download to reuse. A worker's metadata isn't: the download may land on
+    another worker, whose YoutubeDL hasn't seen the extractor's cookies, so it extracts again.
+    """
+    pool = get_ytdlp_worker_pool()
+    if pool is not None:
+        return pool.extract(video_url, get_ytdlp_attempt_timeout()), None
+    ydl = yt_dlp.YoutubeDL(_create_ydl_opts(_get_format_candidates(video_url)[0]))
+    info = _extract_video_info(video_url, ydl)
+    if info is None:
+        ydl.close()
+        return None, None
+    return info, _PrefetchedInfo(ydl, info)
+
+
+def _portable_info(info: dict) -> dict:
+    """A copy of extracted metadata that can be sent back from a yt-dlp worker process."""
+    info = {key: value for key, value in info.items() if not callable(value)}
+    return yt_dlp.YoutubeDL.sanitize_info(info)
+
+
+def find_repost(video_id: str, platform: str) -> dict | None:
+    """Return repost details if the video has been posted before, otherwise None."""
+    # Older posts were saved under the legacy 'MattIsLazy' platform; check both in one round-trip.
+    platforms = [platform] if platform == 'unknown' else [platform, 'MattIsLazy']
+    reposted = findLatestPost(video_id, platforms)
+    if reposted is None:
+        return None
+
+    logger.debug("Trying repost detection with response %s", reposted)
+    repostUserId = reposted[0]
+    logger.debug("Got repost user id %s", repostUserId)
+    if repostUserId == '':
+        return None
+
+    repostTimeTimezone = datetime_from_utc_to_local(reposted[1])
+    return {
+        'messages': f'This is a repost! Originally posted at {repostTimeTimezone.strftime("%d/%m/%Y %H:%M:%S")}',
+        'repostOriginalMesssageId': reposted[2],
+    }
+
+
 def _looks_like_direct_video_url(url: str, content_type: str | None = None) -> bool:
     parsed = urlparse(url)
     lowered_path = parsed.path.lower()
@@ -151,16 +332,28 @@ def _resolve_kkclip_embed_media_url(video_url: str) -> str | None:
     return None
 
 
+def get_ytdlp_socket_timeout() -> float:
+    try:
+        return max(1.0, float(os.getenv('TIKBOT_YTDLP_SOCKET_TIMEOUT', '20')))
+    except ValueError:
+        return 20.0
+
+
 def _create_ydl_opts(format_selection: str) -> dict:
     """Create yt-dlp options for a download attempt."""
     opts: dict[str, object] = {
         'format': format_selection,
-        'outtmpl': '%(id)s.%(ext)s',
+        # Streams kept apart for the transcoder are named <id>.video.<ext> and <id>.audio.<ext>.
+        'outtmpl': '%(id)s%(split_stream&.{}|)s.%(ext)s',
         'merge_output_format': 'mp4',
         'noplaylist': True,
         'quiet': True,
         'no_warnings': True,
         'logger': _YTDLP_LOGGER,
+        # Without this a stalled connection blocks a read forever.
+        'socket_timeout': get_ytdlp_socket_timeout(),
+        # A retry picks up the .part file an earlier attempt left instead of starting over.
+        'continuedl': True,
     }
 
     # Preserve existing sorting preference where it makes sense.
@@ -206,39 +399,415 @@ def _compact_error_message(error: Exception) -> str:
     return message.splitlines()[0] if message else "unknown error"
 
 
-def _attempt_download(video_url: str, attempted_formats: list[str], label: str | None = None):
+def _estimate_format_size(fmt: dict, duration: float | None) -> float | None:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return float(size)
+    bitrate_kbps = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if bitrate_kbps and duration:
+        return bitrate_kbps * 1000 / 8 * duration
+    return None
+
+
+def _is_plannable_format(fmt: dict) -> bool:
+    protocol = str(fmt.get('protocol') or '')
+    # HLS output is MPEG-TS, which Discord won't play inline without remuxing.
+    return bool(fmt.get('format_id')) and not fmt.get('has_drm') and not protocol.startswith('m3u8')
+
+
+def _plan_playable_format(info: dict, size_limit: float) -> str | None:
+    """Pick the best format that Discord can play as-is and that fits in `size_limit`.
+
+    Uses the extracted metadata only, estimating sizes from filesize, filesize_approx or
+    bitrate * duration. Returns a yt-dlp format spec (an ID, or video+audio IDs), or None
+    when nothing is known to fit and the normal selectors (and a transcode) should be used.
+    """
+    formats = [fmt for fmt in info.get('formats') or [] if _is_plannable_format(fmt)]
+    duration = info.get('duration')
+    # Leave headroom for container overhead and estimate error.
+    budget = size_limit * 0.95
+
+    audio_formats = []
+    for fmt in formats:
+        if fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none'):
+            acodec = str(fmt.get('acodec')).lower()
+            size = _estimate_format_size(fmt, duration)
+            if size and (acodec.startswith('mp4a') or acodec == 'aac'):
+                audio_formats.append((size, fmt))
+    audio_formats.sort(key=lambda item: item[0], reverse=True)
+
+    plans = []
+    for fmt in formats:
+        if normalize_vcodec(fmt.get('vcodec')) not in PLAYABLE_VIDEO_CODECS:
+            continue
+        if fmt.get('ext') not in ('mp4', 'mov', 'm4v'):
+            continue
+        size = _estimate_format_size(fmt, duration)
+        if not size or size > budget:
+            continue
+        quality = (fmt.get('height') or 0, fmt.get('tbr') or 0)
+        if fmt.get('acodec') != 'none':
+            plans.append((quality, size, str(fmt['format_id'])))
+            continue
+        # Video-only: pair with the best AAC track that still fits.
+        for audio_size, audio in audio_formats:
+            if size + audio_size <= budget:
+                plans.append((quality, size + audio_size, f"{fmt['format_id']}+{audio['format_id']}"))
+                break
+
+    if not plans:
+        return None
+    quality, size, format_spec = max(plans, key=lambda plan: (plan[0], -plan[1]))
+    logger.info(
+        "Planned format %s (%sp, ~%.1fMB) to post without transcoding",
+        format_spec,
+        quality[0] or '?',
+        size / 1_000_000,
+    )
+    return format_spec
+
+
+def _plan_audio_format(info: dict, size_limit: float) -> str | None:
+    """Pick the audio-only format to fetch for an MP3 conversion, from the extracted metadata.
+
+    MP3/AAC audio that fits in `size_limit` can be posted after a stream copy, so the best of
+    those wins. Otherwise the audio is re-encoded at calculateBitrateAudioOnly's bitrate, so
+    the smallest format at or above that bitrate is enough. Returns a format ID, or None.
+    """
+    formats = [
+        fmt for fmt in info.get('formats') or []
+        if _is_plannable_format(fmt) and fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+    ]
+    if not formats:
+        return None
+    duration = info.get('duration')
+    budget = size_limit * 0.95
+
+    def bitrate(fmt):
+        return fmt.get('abr') or fmt.get('tbr') or 0
+
+    copyable = []
+    for fmt in formats:
+        acodec = str(fmt.get('acodec')).lower()
+        size = _estimate_format_size(fmt, duration)
+        if size and size <= budget and (acodec.startswith('mp4a') or acodec in ('aac', 'mp3')):
+            copyable.append(fmt)
+    if copyable:
+        chosen = max(copyable, key=bitrate)
+        logger.info(
+            "Planned audio format %s (%s, %skbps) to post without re-encoding",
+            chosen['format_id'],
+            chosen.get('acodec'),
+            bitrate(chosen) or '?',
+        )
+        return str(chosen['format_id'])
+
+    target_kbps = calculateBitrateAudioOnly(duration or 0).audioBitrate
+    enough = [fmt for fmt in formats if bitrate(fmt) >= target_kbps]
+    chosen = min(enough, key=bitrate) if enough else max(formats, key=bitrate)
+    logger.info(
+        "Planned audio format %s (%skbps) for a %skbps re-encode",
+        chosen['format_id'],
+        bitrate(chosen) or '?',
+        target_kbps,
+    )
+    return str(chosen['format_id'])
+
+
+def _get_download_window(info: dict) -> float | None:
+    """Return how many leading seconds are worth downloading, or None to download everything.
+
+    Long videos are cut to calculateBitrate's maxDuration when transcoded, so anything past
+    that window would be downloaded only to be thrown away.
+    """
+    duration = info.get('duration')
+    if not duration or info.get('is_live'):
+        return None
+    max_duration = calculateBitrate(duration).maxDuration
+    if not max_duration or max_duration >= duration:
+        return None
+    # Section downloads are done by ffmpeg (HTTP range seeks for progressive files).
+    if not FFmpegFD.available():
+        return None
+    # A little slack so the transcoder's cut isn't starved by keyframe alignment.
+    return min(duration, max_duration + 2)
+
+
+def is_split_stream_transcode_enabled() -> bool:
+    return os.getenv('TIKBOT_SPLIT_STREAM_TRANSCODE', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def _will_be_transcoded(stream_formats, duration: float | None, size_limit: float) -> bool:
+    """Whether a video+audio pair is certain to be re-encoded, judging by its metadata alone."""
+    video_format = next((fmt for fmt in stream_formats if fmt.get('vcodec') not in (None, 'none')), None)
+    if video_format is None:
+        return False
+    if normalize_vcodec(video_format.get('vcodec')) not in PLAYABLE_VIDEO_CODECS:
+        return True
+    sizes = [_estimate_format_size(fmt, duration) for fmt in stream_formats]
+    # Unknown sizes might fit, in which case the merged file is posted as-is.
+    return all(sizes) and sum(sizes) > size_limit
+
+
+def _split_streams_for_transcode(format_selector, duration: float | None, size_limit: float):
+    """Wrap a yt-dlp format selector so a video+audio pair that will be transcoded isn't merged.
+
+    The pair is downloaded as two files (tagged `split_stream`), and the transcoder maps both
+    into its single encode; merging them first would only write a file that is re-encoded.
+    """
+    def select(ctx):
+        for fmt in format_selector(ctx):
+            stream_formats = fmt.get('requested_formats') or ()
+            if len(stream_formats) != 2 or not _will_be_transcoded(stream_formats, duration, size_limit):
+                yield fmt
+                continue
+            video_format, audio_format = sorted(stream_formats, key=lambda part: part.get('vcodec') in (None, 'none'))
+            logger.info(
+                "Downloading %s and %s separately; they will be merged while transcoding",
+                video_format.get('format_id'),
+                audio_format.get('format_id'),
+            )
+            yield {**video_format, 'split_stream': 'video'}
+            yield {**audio_format, 'split_stream': 'audio'}
+
+    return select
+
+
+def _use_format_selection(ydl, format_selection: str):
+    """Point an existing YoutubeDL at another format selector and sort order."""
+    ydl.params['format'] = format_selection
+    ydl.params['format_sort'] = _create_ydl_opts(format_selection)['format_sort']
+    ydl.format_selector = ydl.build_format_selector(format_selection)
+
+
+def _copy_info_for_processing(raw_info: dict) -> dict | None:
+    """Return a copy of extracted metadata that can be processed, or None if it can't be reused."""
+    if raw_info.get('_type', 'video') != 'video':
+        # Playlists and URL redirects may hold lazy generators that processing consumes.
+        return None
+    try:
+        return copy.deepcopy(raw_info)
+    except Exception:
+        logger.debug("Extracted info for %s could not be copied; it will be re-extracted", raw_info.get('id'))
+        return None
+
+
+def _report_format(format_selection: str, label: str | None) -> str:
+    return f"{format_selection} ({label})" if label else format_selection
+
+
+def _attempt_download(
+    video_url: str,
+    attempted_formats: list[str],
+    label: str | None = None,
+    size_limit: float | None = None,
+    progress_hooks: list | None = None,
+    audio_only: bool = False,
+    concurrent_fragments: int | None = None,
+    raw_info: dict | None = None,
+    ydl=None,
+):
+    """Download `video_url` with the first format candidate that works.
+
+    `raw_info` is metadata already extracted (process=False) for this URL by `ydl`, e.g. for the
+    repost check; the download then goes through that YoutubeDL, which the caller closes.
+    Without them the metadata is extracted here.
+    """
     result = None
     last_exception: Exception | None = None
     selected_format: str | None = None
-
-    for format_selection in _get_format_candidates(video_url):
-        reported_format = f"{format_selection} ({label})" if label else format_selection
-        attempted_formats.append(reported_format)
-        ydl_opts = _create_ydl_opts(format_selection)
-        logger.debug("Attempting download with format '%s' for url %s", format_selection, video_url)
-
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(video_url, download=True)
+    if size_limit is None:
+        size_limit = get_file_size_limit()
+    if audio_only:
+        format_candidates = _get_audio_format_candidates(size_limit)
+    else:
+        format_candidates = _get_format_candidates(video_url, size_limit)
+
+    # Extract once and try each format candidate against the same metadata. The same YoutubeDL
+    # is reused so any cookies the extractor set are still there when the media is fetched.
+    fragment_opts = get_fragment_ydl_opts(normalize_platform(video_url), concurrent_fragments)
+    if ydl is None:
+        ydl_opts = _create_ydl_opts(format_candidates[0])
+        ydl_opts.update(fragment_opts)
+        if progress_hooks:
+            ydl_opts['progress_hooks'] = progress_hooks
+        ydl_context = yt_dlp.YoutubeDL(ydl_opts)
+    else:
+        # The extraction didn't need the download settings.
+        ydl.params.update(fragment_opts)
+        for hook in progress_hooks or []:
+            ydl.add_progress_hook(hook)
+        ydl_context = contextlib.nullcontext(ydl)
+    with ydl_context as ydl:
+        planned = False
+        split_streams = False
+        duration = None
+        while format_candidates:
+            if raw_info is None:
+                try:
+                    raw_info = ydl.extract_info(video_url, download=False, process=False)
+                except DownloadError as ex:
+                    # Extraction doesn't depend on the format, so the other candidates would fail too.
+                    attempted_formats.append(_report_format(format_candidates[0], label))
+                    logger.warning(
+                        "Metadata extraction failed (label=%s): %s",
+                        label or "direct",
+                        _compact_error_message(ex),
+                    )
+                    last_exception = ex
+                    break
+                except Exception as ex:
+                    attempted_formats.append(_report_format(format_candidates[0], label))
+                    logger.error("Unexpected error extracting metadata for url %s: %s", video_url, ex)
+                    last_exception = ex
+                    break
+
+            if not planned and audio_only:
+                planned = True
+                planned_format = _plan_audio_format(raw_info, size_limit)
+                if planned_format:
+                    format_candidates.insert(0, planned_format)
+            elif not planned:
+                planned = True
+                # A format that can be posted without transcoding goes ahead of the generic selectors.
+                planned_format = _plan_playable_format(raw_info, size_limit)
+                duration = raw_info.get('duration')
+                if planned_format:
+                    format_candidates.insert(0, planned_format)
+                else:
+                    split_streams = is_split_stream_transcode_enabled()
+                    # This will be transcoded, so only fetch the part that survives truncation.
+                    download_window = _get_download_window(raw_info)
+                    if download_window:
+                        logger.info(
+                            "Downloading only the first %.0fs of %.0fs for url %s",
+                            download_window,
+                            raw_info['duration'],
+                            video_url,
+                        )
+                        ydl.params['download_ranges'] = download_range_func(None, [(0, download_window)])
+
+            format_selection = format_candidates.pop(0)
+            reported_format = _report_format(format_selection, label)
+            attempted_formats.append(reported_format)
+            logger.debug("Attempting download with format '%s' for url %s", format_selection, video_url)
+
+            info = _copy_info_for_processing(raw_info)
+            if info is None:
+                info, raw_info = raw_info, None
+
+            try:
+                _use_format_selection(ydl, format_selection)
+                if split_streams:
+                    ydl.format_selector = _split_streams_for_transcode(ydl.format_selector, duration, size_limit)
+                result = ydl.process_ie_result(info, download=True)
                 logger.info("Download succeeded with format '%s' for url %s", format_selection, video_url)
                 selected_format = reported_format
                 last_exception = None
                 break
-        except DownloadError as ex:
-            logger.warning(
-                "Download attempt failed (format=%s, label=%s): %s",
-                format_selection,
-                label or "direct",
-                _compact_error_message(ex),
-            )
-            last_exception = ex
-        except Exception as ex:  # Catch-all to ensure retries on unexpected errors.
-            logger.error("Unexpected error during download with format '%s' for url %s: %s", format_selection, video_url, ex)
-            last_exception = ex
+            except DownloadCancelled as ex:
+                logger.info("Download of url %s was cancelled", video_url)
+                last_exception = ex
+                break
+            except (DownloadError, ExtractorError) as ex:
+                logger.warning(
+                    "Download attempt failed (format=%s, label=%s): %s",
+                    format_selection,
+                    label or "direct",
+                    _compact_error_message(ex),
+                )
+                last_exception = ex
+                if ydl.params.pop('download_ranges', None) is not None:
+                    # Some formats can't be partially downloaded; retry this one in full.
+                    logger.info("Retrying format '%s' without a time range", format_selection)
+                    format_candidates.insert(0, format_selection)
+            except Exception as ex:  # Catch-all to ensure retries on unexpected errors.
+                logger.error("Unexpected error during download with format '%s' for url %s: %s", format_selection, video_url, ex)
+                last_exception = ex
 
     return result, selected_format, last_exception
 
 
+def _record_download_paths(paths: list):
+    """A yt-dlp progress hook that notes every file the download writes to."""
+    def hook(status):
+        for key in ('tmpfilename', 'filename'):
+            path = status.get(key)
+            if path and path not in paths:
+                paths.append(path)
+
+    return hook
+
+
+def _abort_when_cancelled(cancelled):
+    """A yt-dlp progress hook that stops the download once `cancelled()` returns true."""
+    def hook(_status):
+        if cancelled():
+            raise DownloadCancelled()
+
+    return hook
+
+
+def _run_download_attempt(
+    video_url: str,
+    attempted_formats: list[str],
+    label: str | None = None,
+    size_limit: float | None = None,
+    audio_only: bool = False,
+    partials: PartialDownloads | None = None,
+    prefetched: _PrefetchedInfo | None = None,
+    cancelled=None,
+):
+    """Run `_attempt_download` in a yt-dlp worker process with a wall-clock limit.
+
+    Falls back to running in-process when TIKBOT_YTDLP_WORKERS=0, where `prefetched` metadata
+    is downloaded through the YoutubeDL that extracted it. The attempt's fragment connections
+    come out of the budget shared by all downloads. With `partials`, the files the attempt
+    wrote to are handed to the job, and a killed attempt's are kept for resuming. The attempt
+    is stopped (its worker killed) once `cancelled()` returns true.
+    """
+    pool = get_ytdlp_worker_pool()
+    if prefetched is not None and pool is not None:
+        prefetched = None
+    with get_connection_budget().reserve(get_fragment_concurrency(normalize_platform(video_url))) as connections:
+        if pool is None:
+            written = []
+            progress_hooks = [_record_download_paths(written)] if partials is not None else []
+            if cancelled is not None:
+                progress_hooks.append(_abort_when_cancelled(cancelled))
+            result = _attempt_download(
+                video_url,
+                attempted_formats,
+                label=label,
+                size_limit=size_limit,
+                progress_hooks=progress_hooks,
+                audio_only=audio_only,
+                concurrent_fragments=connections,
+                raw_info=prefetched.info if prefetched else None,
+                ydl=prefetched.ydl if prefetched else None,
+            )
+            if partials is not None:
+                partials.add(*written)
+            return result
+        outcome = pool.run(
+            video_url,
+            label,
+            size_limit,
+            get_ytdlp_attempt_timeout(),
+            audio_only=audio_only,
+            concurrent_fragments=connections,
+            keep_partials=partials is not None,
+            cancelled=cancelled,
+        )
+
+    if partials is not None:
+        partials.add(*outcome['partial_paths'])
+    attempted_formats.extend(outcome['attempted_formats'])
+    if isinstance(outcome['error'], YtdlpAttemptTimeout):
+        attempted_formats.append(_report_format('timeout', label))
+    return outcome['result'], outcome['selected_format'], outcome['error']
+
+
 def _resolve_downloaded_filepath(video: dict) -> str | None:
     requested_downloads = video.get('requested_downloads') or []
     if requested_downloads:
@@ -253,6 +822,17 @@ def _resolve_downloaded_filepath(video: dict) -> str | None:
     return None
 
 
+def _get_split_stream_paths(video: dict) -> tuple[str, str] | None:
+    """(video, audio) file paths when the streams were downloaded unmerged for the transcoder."""
+    paths = {
+        download.get('split_stream'): download.get('filepath') or download.get('filename')
+        for download in video.get('requested_downloads') or []
+    }
+    if paths.get('video') and paths.get('audio'):
+        return paths['video'], paths['audio']
+    return None
+
+
 def _normalize_downloaded_extension(video: dict, filepath: str) -> str:
     ext = None
     requested_downloads = video.get('requested_downloads') or []
@@ -273,37 +853,71 @@ def _normalize_downloaded_extension(video: dict, filepath: str) -> str:
     return filepath
 
 
-def _metadata_value_has_video(value) -> bool | None:
-    if value is None:
-        return None
-    return str(value).lower() not in ('', 'none', 'unknown')
-
-
-def _downloaded_file_has_video(video: dict, filepath: str) -> bool:
-    requested_formats = video.get('requested_formats') or []
-    if requested_formats:
-        return any(_metadata_value_has_video(fmt.get('vcodec')) for fmt in requested_formats)
-
-    requested_downloads = video.get('requested_downloads') or []
-    for requested_download in requested_downloads:
-        has_video = _metadata_value_has_video(requested_download.get('vcodec'))
-        if has_video is not None:
-            return has_video
-
-    has_video = _metadata_value_has_video(video.get('vcodec'))
-    if has_video is not None:
-        return has_video
-
+def _downloaded_file_has_video(video: dict, filepath: str, media_info: MediaInfo | None = None) -> bool:
+    """Answer from yt-dlp metadata when it knows, probing the file (once, via `media_info`) otherwise."""
+    media_info = media_info or MediaInfo.from_ytdlp(filepath, video)
+    if media_info.has_video is not None:
+        return media_info.has_video
     try:
-        probe = ffmpeg.probe(filepath)
-        return any(stream.get('codec_type') == 'video' for stream in probe.get('streams', []))
+        media_info.load()
     except Exception as exc:
         logger.warning("Failed to probe downloaded file for video streams (%s): %s", filepath, exc)
         return False
-
-
-def download(videoUrl: str, detect_repost: bool = True):
-    response = {
+    return bool(media_info.has_video)
+
+
+class _DownloadState:
+    """Progress through the download fallback chain for one URL."""
+
+    def __init__(
+        self,
+        video_url: str,
+        platform: str,
+        size_limit: float | None = None,
+        audio_only: bool = False,
+        partials: PartialDownloads | None = None,
+    ):
+        self.video_url = video_url
+        self.platform = platform
+        self.size_limit = size_limit
+        self.audio_only = audio_only
+        self.partials = partials
+        # What the repost check already extracted in-process, used by the first direct attempt.
+        self.prefetched: _PrefetchedInfo | None = None
+        self.attempted_formats: list[str] = []
+        self.result = None
+        self.selected_format: str | None = None
+        self.last_exception: Exception | None = None
+        # How the latest stage failure was classified (see download_errors).
+        self.error_kind: str | None = None
+        self.download_method = "yt-dlp"
+        self.media_info: MediaInfo | None = None
+        # Set to stop a stage that overran its timeout or whose job was cancelled. Copies get their own.
+        self.cancelled = threading.Event()
+
+    def copy(self):
+        clone = _DownloadState(self.video_url, self.platform, self.size_limit, self.audio_only, self.partials)
+        clone.prefetched = self.prefetched
+        clone.attempted_formats = list(self.attempted_formats)
+        clone.result = self.result
+        clone.selected_format = self.selected_format
+        clone.last_exception = self.last_exception
+        clone.download_method = self.download_method
+        clone.media_info = self.media_info
+        return clone
+
+    def update_from(self, other):
+        self.prefetched = other.prefetched
+        self.attempted_formats = other.attempted_formats
+        self.result = other.result
+        self.selected_format = other.selected_format
+        self.last_exception = other.last_exception
+        self.download_method = other.download_method
+        self.media_info = other.media_info
+
+
+def _new_download_response(videoUrl: str) -> dict:
+    return {
         'fileName': '',
         'duration': 0,
         'messages': '',
@@ -314,8 +928,21 @@ def download(videoUrl: str, detect_repost: bool = True):
         'attemptedFormats': [],
         'selectedFormat': None,
         'lastError': None,
+        'downloadedDuration': None,
+        'mediaInfo': None,
+        # Set when the audio was downloaded as its own file, to be merged while transcoding.
+        'audioFileName': None,
+        # download_errors classification of a failed download's last error.
+        'errorKind': None,
     }
 
+
+def _start_download(response: dict, videoUrl: str, detect_repost: bool) -> tuple[str | None, _PrefetchedInfo | None]:
+    """Run the pre-download repost check.
+
+    Returns the video ID it checked (if any) and the in-process extraction that found it, if
+    that took one and the video still needs downloading.
+    """
     logger.info("Starting download for url %s", videoUrl)
     if response['platform'] == 'tiktok' and not os.getenv('TIKBOT_IMPERSONATE'):
         logger.info(
@@ -323,82 +950,175 @@ def download(videoUrl: str, detect_repost: bool = True):
             "(see `python -m yt_dlp --list-impersonate-targets`)"
         )
 
-    attempted_formats = []
-    download_method = "yt-dlp"
-    result, selected_format, last_exception = _attempt_download(videoUrl, attempted_formats)
-
-    if response['platform'] == 'tiktok' and result is not None:
-        video = result['entries'][0] if 'entries' in result else result
-        downloaded_filepath = _resolve_downloaded_filepath(video) if isinstance(video, dict) else None
-        duration = video.get('duration') if isinstance(video, dict) else None
-        file_missing = not downloaded_filepath or not os.path.exists(downloaded_filepath)
-        file_empty = bool(downloaded_filepath) and os.path.exists(downloaded_filepath) and os.path.getsize(downloaded_filepath) == 0
-        lacks_video = not file_missing and not file_empty and not _downloaded_file_has_video(video, downloaded_filepath)
-        if file_missing or file_empty or lacks_video or not duration:
-            logger.warning(
-                "TikTok direct download produced no usable video (missing=%s, empty=%s, lacks_video=%s, duration=%s); retrying fallbacks",
-                file_missing,
-                file_empty,
-                lacks_video,
-                duration,
-            )
-            if downloaded_filepath and os.path.exists(downloaded_filepath):
-                try:
-                    os.remove(downloaded_filepath)
-                except OSError:
-                    logger.warning("Failed to remove unusable TikTok download %s", downloaded_filepath, exc_info=True)
-            result = None
-            selected_format = None
-            last_exception = last_exception or Exception("TikTok direct download produced no usable video")
-
-    if result is None and response['platform'] == 'instagram':
-        embed_media_url = _resolve_kkclip_embed_media_url(videoUrl)
-        if embed_media_url:
-            result, selected_format, last_exception = _attempt_download(
-                embed_media_url,
-                attempted_formats,
-                label='kkclip-embed-media'
-            )
-            if result is not None:
-                download_method = "yt-dlp-kkclip-embed-media"
+    repost_checked_id = None
+    prefetched = None
+    if detect_repost:
+        try:
+            repost_checked_id, prefetched = _resolve_video(videoUrl, allow_network=True)
+            if repost_checked_id:
+                repost = find_repost(repost_checked_id, response['platform'])
+                if repost is not None:
+                    logger.info("Detected repost of %s before downloading", repost_checked_id)
+                    response['videoId'] = repost_checked_id
+                    response['messages'] = repost['messages']
+                    response['repost'] = True
+                    response['repostOriginalMesssageId'] = repost['repostOriginalMesssageId']
+        except Exception as e:
+            # Don't die for repost detection
+            logger.error("Exception trying to do repost detection", exc_info=(type(e), e, e.__traceback__))
+    if prefetched is not None and response['repost']:
+        prefetched.close()
+        prefetched = None
+    return repost_checked_id, prefetched
+
+
+def _discard_unusable_tiktok_result(state: _DownloadState):
+    video = state.result['entries'][0] if 'entries' in state.result else state.result
+    downloaded_filepath = _resolve_downloaded_filepath(video) if isinstance(video, dict) else None
+    duration = video.get('duration') if isinstance(video, dict) else None
+    file_missing = not downloaded_filepath or not os.path.exists(downloaded_filepath)
+    file_empty = bool(downloaded_filepath) and os.path.exists(downloaded_filepath) and os.path.getsize(downloaded_filepath) == 0
+    lacks_video = False
+    if not file_missing and not file_empty:
+        # Kept on the state so a probe made here isn't repeated when the file is processed.
+        state.media_info = MediaInfo.from_ytdlp(downloaded_filepath, video)
+        lacks_video = not _downloaded_file_has_video(video, downloaded_filepath, state.media_info)
+    if file_missing or file_empty or lacks_video or not duration:
+        logger.warning(
+            "TikTok direct download produced no usable video (missing=%s, empty=%s, lacks_video=%s, duration=%s); retrying fallbacks",
+            file_missing,
+            file_empty,
+            lacks_video,
+            duration,
+        )
+        if downloaded_filepath and os.path.exists(downloaded_filepath):
+            try:
+                os.remove(downloaded_filepath)
+            except OSError:
+                logger.warning("Failed to remove unusable TikTok download %s", downloaded_filepath, exc_info=True)
+        state.result = None
+        state.selected_format = None
+        state.media_info = None
+        state.last_exception = state.last_exception or Exception("TikTok direct download produced no usable video")
+
+
+def _direct_stage(state: _DownloadState):
+    # Prefetched format URLs may have gone stale by the time a retry comes round, so use them once.
+    prefetched, state.prefetched = state.prefetched, None
+    state.result, state.selected_format, state.last_exception = _run_download_attempt(
+        state.video_url,
+        state.attempted_formats,
+        size_limit=state.size_limit,
+        audio_only=state.audio_only,
+        partials=state.partials,
+        prefetched=prefetched,
+        cancelled=state.cancelled.is_set,
+    )
+    # An audio-only download is meant to lack video.
+    if state.platform == 'tiktok' and state.result is not None and not state.audio_only:
+        _discard_unusable_tiktok_result(state)
+
+
+def _kkclip_embed_stage(state: _DownloadState):
+    embed_media_url = _resolve_kkclip_embed_media_url(state.video_url)
+    if embed_media_url:
+        state.result, state.selected_format, state.last_exception = _run_download_attempt(
+            embed_media_url,
+            state.attempted_formats,
+            label='kkclip-embed-media',
+            size_limit=state.size_limit,
+            audio_only=state.audio_only,
+            partials=state.partials,
+            cancelled=state.cancelled.is_set,
+        )
+        if state.result is not None:
+            state.download_method = "yt-dlp-kkclip-embed-media"
+
+
+def _alternate_url_stage(state: _DownloadState):
+    for alternate_url, alternate_label in _get_alternate_urls(state.video_url, state.platform):
+        logger.info("Direct download failed; retrying with alternate URL %s", alternate_url)
+        state.result, state.selected_format, state.last_exception = _run_download_attempt(
+            alternate_url,
+            state.attempted_formats,
+            label=alternate_label,
+            size_limit=state.size_limit,
+            audio_only=state.audio_only,
+            partials=state.partials,
+            cancelled=state.cancelled.is_set,
+        )
+        if state.result is not None:
+            state.download_method = f"yt-dlp-{alternate_label}"
+            break
+
+
+def _tiktok_embed_stage(state: _DownloadState):
+    embed_url = get_tiktok_embed_url(state.video_url)
+    if embed_url:
+        logger.info("Direct TikTok download failed; retrying with embed URL %s", embed_url)
+        state.result, state.selected_format, state.last_exception = _run_download_attempt(
+            embed_url,
+            state.attempted_formats,
+            label='embed',
+            size_limit=state.size_limit,
+            audio_only=state.audio_only,
+            partials=state.partials,
+            cancelled=state.cancelled.is_set,
+        )
+        if state.result is not None:
+            state.download_method = "yt-dlp-embed"
 
-    if result is None:
-        for alternate_url, alternate_label in _get_alternate_urls(videoUrl, response['platform']):
-            logger.info("Direct download failed; retrying with alternate URL %s", alternate_url)
-            result, selected_format, last_exception = _attempt_download(
-                alternate_url,
-                attempted_formats,
-                label=alternate_label
-            )
-            if result is not None:
-                download_method = f"yt-dlp-{alternate_label}"
-                break
 
-    if result is None and response['platform'] == 'tiktok':
-        embed_url = get_tiktok_embed_url(videoUrl)
-        if embed_url:
-            logger.info("Direct TikTok download failed; retrying with embed URL %s", embed_url)
-            download_method = "yt-dlp-embed"
-            result, selected_format, last_exception = _attempt_download(
-                embed_url,
-                attempted_formats,
-                label='embed'
-            )
-        if result is None:
-            attempted_formats.append("embed-playwright")
-            logger.info("Attempting TikTok download via Playwright fallback")
-            download_result = download_tiktok_embed_video_playwright(videoUrl)
-            if download_result:
-                result = {
-                    "id": download_result.get("video_id") or "",
-                    "_filename": download_result["file_path"],
-                }
-                selected_format = "embed-playwright"
-                download_method = "playwright"
-                last_exception = None
-            else:
-                logger.warning("Playwright fallback did not produce a downloadable media response")
-                last_exception = last_exception or Exception("Playwright embed download failed")
+def _playwright_stage(state: _DownloadState):
+    state.attempted_formats.append("embed-playwright")
+    logger.info("Attempting TikTok download via Playwright fallback")
+    download_result = download_tiktok_embed_video_playwright(
+        state.video_url, partials=state.partials, cancelled=state.cancelled.is_set
+    )
+    if download_result:
+        state.result = {
+            "id": download_result.get("video_id") or "",
+            "_filename": download_result["file_path"],
+        }
+        state.selected_format = "embed-playwright"
+        state.download_method = "playwright"
+        state.last_exception = None
+    else:
+        logger.warning("Playwright fallback did not produce a downloadable media response")
+        # Always a new error, so the failure counts as this stage's own when deciding on a retry.
+        # The earlier stage's error is kept for the report only: it isn't chained as the cause,
+        # so classify_error() judges this stage by its own failure.
+        error = Exception("Playwright embed download failed")
+        error.earlier_error = getattr(state.last_exception, 'earlier_error', None) or state.last_exception
+        state.last_exception = error
+
+
+def _get_download_stages(platform: str) -> list[tuple[str, object]]:
+    """Return the ordered (name, stage) fallback chain for a platform."""
+    stages = [('direct', _direct_stage)]
+    if platform == 'instagram':
+        stages.append(('kkclip-embed', _kkclip_embed_stage))
+    stages.append(('alternate-urls', _alternate_url_stage))
+    if platform == 'tiktok':
+        stages.append(('tiktok-embed', _tiktok_embed_stage))
+        stages.append(('playwright', _playwright_stage))
+    return stages
+
+
+def _describe_error(error: Exception) -> str:
+    earlier_error = getattr(error, 'earlier_error', None)
+    if earlier_error is None:
+        return str(error)
+    return f"{error} (after: {earlier_error})"
+
+
+def _finish_download(response: dict, state: _DownloadState, detect_repost: bool, repost_checked_id: str | None) -> dict:
+    videoUrl = state.video_url
+    attempted_formats = state.attempted_formats
+    result = state.result
+    selected_format = state.selected_format
+    last_exception = state.last_exception
+    download_method = state.download_method
 
     if result is None:
         if last_exception:
@@ -408,7 +1128,8 @@ def download(videoUrl: str, detect_repost: bool = True):
                 attempted_formats,
                 exc_info=(type(last_exception), last_exception, last_exception.__traceback__)
             )
-            response['lastError'] = str(last_exception)
+            response['lastError'] = _describe_error(last_exception)
+        response['errorKind'] = state.error_kind
         response['messages'] = 'Error: Download Failed'
         response['attemptedFormats'] = attempted_formats
         return response
@@ -430,8 +1151,15 @@ def download(videoUrl: str, detect_repost: bool = True):
     if('duration' in video):
         response['duration'] = video['duration']
     response['videoId'] = video['id']
+    downloaded = (video.get('requested_downloads') or [{}])[0]
+    if downloaded.get('section_end'):
+        # Only a leading window was fetched; `duration` stays the source duration.
+        response['downloadedDuration'] = downloaded['section_end'] - (downloaded.get('section_start') or 0)
 
     downloaded_filepath = _resolve_downloaded_filepath(video)
+    split_stream_paths = _get_split_stream_paths(video)
+    if split_stream_paths:
+        downloaded_filepath, response['audioFileName'] = split_stream_paths
     if not downloaded_filepath or not os.path.exists(downloaded_filepath):
         response['messages'] = 'Error: Download Failed'
         response['attemptedFormats'] = attempted_formats
@@ -440,22 +1168,18 @@ def download(videoUrl: str, detect_repost: bool = True):
         return response
 
     response['fileName'] = _normalize_downloaded_extension(video, downloaded_filepath)
+    media_info = state.media_info or MediaInfo.from_ytdlp(response['fileName'], video)
+    media_info.path = response['fileName']
+    media_info.audio_path = response['audioFileName']
+    response['mediaInfo'] = media_info
 
-    if detect_repost:
+    if detect_repost and video['id'] != repost_checked_id:
         try:
-            reposted = doesPostExist(video['id'], response['platform'])
-            if reposted is None and response['platform'] != 'unknown':
-                reposted = doesPostExist(video['id'], 'MattIsLazy')
-            if reposted is not None:
-                logger.debug("Trying repost detection with response %s", reposted)
-                repostUserId = reposted[0]
-                logger.debug("Got repost user id %s", repostUserId)
-                repostTime = reposted[1]
-                repostTimeTimezone = datetime_from_utc_to_local(repostTime)
-                if repostUserId != '':
-                    response['messages'] = f'This is a repost! Originally posted at {repostTimeTimezone.strftime("%d/%m/%Y %H:%M:%S")}'
-                    response['repost'] = True
-                    response['repostOriginalMesssageId'] = reposted[2]
+            repost = find_repost(video['id'], response['platform'])
+            if repost is not None:
+                response['messages'] = repost['messages']
+                response['repost'] = True
+                response['repostOriginalMesssageId'] = repost['repostOriginalMesssageId']
         except Exception as e:
             # Don't die for repost detection
             logger.error("Exception trying to do repost detection", exc_info=(type(e), e, e.__traceback__))
@@ -473,37 +1197,294 @@ def download(videoUrl: str, detect_repost: bool = True):
     return response
 
 
+def _plan_stage_retry(
+    stage_name: str,
+    state: _DownloadState,
+    attempt: int,
+    retries: int,
+    retry_multiplier: float,
+    retry_unknown: bool,
+) -> float | None:
+    """Classify the stage's failure and return the seconds to wait before running it again.
+
+    Returns None to move on: the error is permanent or the video is unavailable, or `retries`
+    attempts are used up. Unclassified errors are only retried with `retry_unknown`, once no
+    fallback stage is left to try. A Retry-After longer than TIKBOT_RETRY_MAX_DELAY also gives
+    up on the stage.
+    """
+    error = state.last_exception
+    state.error_kind = classify_error(error)
+    if state.error_kind in (UNAVAILABLE, PERMANENT):
+        logger.warning("Download stage %s failed permanently for %s: %s", stage_name, state.video_url, error)
+        return None
+    if attempt >= retries or (state.error_kind == UNKNOWN and not retry_unknown):
+        return None
+    retry_after = get_retry_after(error) if state.error_kind == RATE_LIMITED else None
+    if retry_after is not None and retry_after > get_retry_max_delay():
+        logger.warning("Download stage %s is rate limited for %.0fs; not retrying", stage_name, retry_after)
+        return None
+    delay = get_retry_delay(attempt, retry_multiplier, state.error_kind, retry_after)
+    logger.warning(
+        "Retrying download stage %s (attempt %s/%s) in %.1fs after %s error: %s",
+        stage_name,
+        attempt,
+        retries,
+        delay,
+        state.error_kind,
+        error,
+    )
+    return delay
+
+
+def _stage_failed(state: _DownloadState, previous_exception: Exception | None) -> bool:
+    """Whether the stage that just ran failed with an error of its own, rather than not applying."""
+    return state.result is None and state.last_exception is not previous_exception
+
+
+def download(
+    videoUrl: str,
+    detect_repost: bool = True,
+    size_limit: float | None = None,
+    audio_only: bool = False,
+    partials: PartialDownloads | None = None,
+    retries: int = 1,
+    retry_multiplier: float | None = None,
+    on_retry=None,
+):
+    """Blocking download_async() for callers without an event loop; stages run on a thread."""
+    return asyncio.run(
+        download_async(
+            videoUrl,
+            detect_repost=detect_repost,
+            size_limit=size_limit,
+            audio_only=audio_only,
+            partials=partials,
+            retries=retries,
+            retry_multiplier=retry_multiplier,
+            on_retry=on_retry,
+        )
+    )
+
+
+def get_download_stage_timeout() -> float:
+    try:
+        return max(1.0, float(os.getenv('TIKBOT_DOWNLOAD_STAGE_TIMEOUT', '180')))
+    except ValueError:
+        return 180.0
+
+
+async def _stop_stage(stage_name: str, stage_state: _DownloadState, stage_task: asyncio.Future):
+    """Stop a stage and wait for it to exit, so a retry can't race it for the same output files."""
+    stage_state.cancelled.set()
+    try:
+        await asyncio.shield(stage_task)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.warning("Stopped download stage %s raised", stage_name, exc_info=True)
+
+
+async def _run_stage_async(stage_name: str, stage, state: _DownloadState, run_blocking):
+    # Stages run on a copy so one that is being stopped can't clobber the state mid-update.
+    stage_state = state.copy()
+    stage_task = asyncio.ensure_future(run_blocking(stage, stage_state))
+    timeout = get_download_stage_timeout()
+    try:
+        await asyncio.wait_for(asyncio.shield(stage_task), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Download stage %s exceeded %.0fs for %s; stopping it", stage_name, timeout, state.video_url)
+        await _stop_stage(stage_name, stage_state, stage_task)
+        # It may have finished before it noticed; a download it delivered is still good.
+        if stage_state.result is None:
+            stage_state.last_exception = TimeoutError(f"Download stage {stage_name} timed out after {timeout:.0f}s")
+    except asyncio.CancelledError:
+        await _stop_stage(stage_name, stage_state, stage_task)
+        raise
+    state.update_from(stage_state)
+
+
+async def _retry_stage_async(
+    stage_name: str,
+    stage,
+    state: _DownloadState,
+    attempt: int,
+    retries: int,
+    retry_multiplier: float,
+    on_retry,
+    retry_unknown: bool,
+    run_blocking,
+) -> int:
+    """Run a failed stage again while _plan_stage_retry allows it; returns the last attempt made."""
+    while True:
+        delay = _plan_stage_retry(stage_name, state, attempt, retries, retry_multiplier, retry_unknown)
+        if delay is None:
+            break
+        if on_retry:
+            retry_notice = on_retry(attempt, state.last_exception)
+            if asyncio.iscoroutine(retry_notice):
+                await retry_notice
+        await asyncio.sleep(delay)
+        attempt += 1
+        previous_exception = state.last_exception
+        await _run_stage_async(stage_name, stage, state, run_blocking)
+        if not _stage_failed(state, previous_exception):
+            break
+    return attempt
+
+
+async def download_async(
+    videoUrl: str,
+    detect_repost: bool = True,
+    run_blocking=None,
+    size_limit: float | None = None,
+    audio_only: bool = False,
+    partials: PartialDownloads | None = None,
+    retries: int = 1,
+    retry_multiplier: float | None = None,
+    on_retry=None,
+):
+    """Download `videoUrl`, working through the platform's fallback stages until one succeeds.
+
+    `run_blocking` is an awaitable runner such as asyncio.to_thread for the blocking parts of
+    each stage. Each fallback stage gets TIKBOT_DOWNLOAD_STAGE_TIMEOUT seconds, and cancelling
+    the caller abandons the chain. With `audio_only`, yt-dlp fetches audio formats sized for an
+    MP3 conversion instead of video. With `partials`, unfinished files are kept there for a
+    later attempt to resume.
+
+    A stage that fails with a transient or rate-limited error is run again, up to `retries` times,
+    with exponential backoff from `retry_multiplier` seconds. `on_retry(attempt, error)` is
+    called (and awaited, if it is a coroutine function) before each retry. A permanent error only
+    ends retries of its stage; the download stops early when the video itself is unavailable
+    (private, removed, taken down). Unclassified errors are retried on the last stage that
+    actually ran, once the fallbacks are exhausted.
+    """
+    if retry_multiplier is None:
+        retry_multiplier = get_retry_multiplier()
+    run_blocking = run_blocking or asyncio.to_thread
+    response = _new_download_response(videoUrl)
+    repost_checked_id, prefetched = await run_blocking(_start_download, response, videoUrl, detect_repost)
+    if response['repost']:
+        return response
+
+    state = _DownloadState(videoUrl, response['platform'], size_limit, audio_only, partials)
+    state.prefetched = prefetched
+    try:
+        # The stage that most recently failed with its own error, and the attempts it has used.
+        last_failure = None
+        for stage_name, stage in _get_download_stages(state.platform):
+            if state.result is not None or state.error_kind == UNAVAILABLE:
+                break
+            previous_exception = state.last_exception
+            await _run_stage_async(stage_name, stage, state, run_blocking)
+            if _stage_failed(state, previous_exception):
+                attempt = await _retry_stage_async(
+                    stage_name, stage, state, 1, retries, retry_multiplier, on_retry, False, run_blocking
+                )
+                last_failure = (stage_name, stage, attempt)
+        # Stages that don't apply to the URL are no-ops, so the last one in the list may never run.
+        if state.result is None and last_failure is not None and state.error_kind == UNKNOWN:
+            stage_name, stage, attempt = last_failure
+            await _retry_stage_async(
+                stage_name, stage, state, attempt, retries, retry_multiplier, on_retry, True, run_blocking
+            )
+    finally:
+        # The direct stage downloads through it at most once.
+        if prefetched is not None:
+            prefetched.close()
+
+    return await run_blocking(_finish_download, response, state, detect_repost, repost_checked_id)
+
+
+def _get_downloaded_files(response: dict | None) -> list[str]:
+    if not response:
+        return []
+    return [response[key] for key in ('fileName', 'audioFileName') if response.get(key)]
+
+
+def get_retry_multiplier() -> float:
+    """Base delay in seconds for retry backoff (TIKBOT_RETRY_MULTI, default 1)."""
+    try:
+        return max(0.0, float(os.getenv('TIKBOT_RETRY_MULTI') or '1'))
+    except ValueError:
+        return 1.0
+
+
+def _plan_download_retry(exc: Exception, attempt: int, retries: int, retry_multiplier: float) -> float | None:
+    """Seconds to wait before calling download() again after it raised, or None to re-raise."""
+    logger.exception("Download attempt %s/%s raised an exception", attempt, retries)
+    kind = classify_error(exc)
+    if attempt >= retries or kind in (UNAVAILABLE, PERMANENT):
+        return None
+    return get_retry_delay(attempt, retry_multiplier, kind, get_retry_after(exc))
+
+
 def download_with_retries(
     video_url: str,
     retries: int = 4,
-    retry_multiplier: int | None = None,
+    retry_multiplier: float | None = None,
+    on_retry=None,
+    detect_repost: bool = True,
+    size_limit: float | None = None,
+):
+    """Blocking download_with_retries_async() for callers without an event loop."""
+    return asyncio.run(
+        download_with_retries_async(
+            video_url,
+            retries=retries,
+            retry_multiplier=retry_multiplier,
+            on_retry=on_retry,
+            detect_repost=detect_repost,
+            size_limit=size_limit,
+        )
+    )
+
+
+async def download_with_retries_async(
+    video_url: str,
+    retries: int = 4,
+    retry_multiplier: float | None = None,
     on_retry=None,
     detect_repost: bool = True,
+    run_blocking=None,
+    size_limit: float | None = None,
+    run_io=None,
 ):
+    """download_async() with each failed stage retried up to `retries` times (see download_async()).
+
+    Unexpected exceptions out of download_async() start it over, up to `retries` times, backing
+    off with asyncio.sleep. Every attempt resumes the partial files of the one before, and they
+    are removed once the job is over, apart from the downloaded media. That happens through
+    `run_io` (default asyncio.to_thread), since it globs and unlinks files.
+    """
     if retry_multiplier is None:
-        retry_multiplier = int(os.getenv('TIKBOT_RETRY_MULTI') or '1')
+        retry_multiplier = get_retry_multiplier()
+    run_io = run_io or asyncio.to_thread
 
-    attempt = 1
+    partials = PartialDownloads()
     response = None
-    while attempt <= retries:
-        try:
-            response = download(video_url, detect_repost=detect_repost)
-            messages = response.get('messages', '')
-            if messages.startswith("Error") and attempt < retries:
-                if on_retry:
-                    on_retry(attempt, response)
-                logger.warning("Retrying download (attempt %s/%s) after error: %s", attempt, retries, messages)
-                time.sleep(retry_multiplier * attempt)
-                attempt += 1
-                continue
-            return response
-        except Exception as exc:
-            logger.exception("Download attempt %s/%s raised an exception", attempt, retries)
-            if attempt == retries:
-                raise
-            attempt += 1
+    try:
+        for attempt in range(1, retries + 1):
+            try:
+                response = await download_async(
+                    video_url,
+                    detect_repost=detect_repost,
+                    run_blocking=run_blocking,
+                    size_limit=size_limit,
+                    partials=partials,
+                    retries=retries,
+                    retry_multiplier=retry_multiplier,
+                    on_retry=on_retry,
+                )
+                return response
+            except Exception as exc:
+                delay = _plan_download_retry(exc, attempt, retries, retry_multiplier)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+        return response
+    finally:
+        await run_io(partials.cleanup, keep=_get_downloaded_files(response))
 
-    return response
 
 def _list_from_options_callback(option, value, parser, append=True, delim=',', process=str.strip):
     # append can be True, False or -1 (prepend)
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import time
+
+import ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# (encoder, preset) from smallest/best output to fastest, with rough speeds relative to
+# libx265/medium used until calibration or past jobs say otherwise.
+ENCODER_PROFILES = (
+    ('libx265', 'medium', 1.0),
+    ('libx265', 'fast', 1.6),
+    ('libx265', 'veryfast', 3.0),
+    ('libx264', 'medium', 4.0),
+    ('libx264', 'veryfast', 9.0),
+    ('libx264', 'ultrafast', 20.0),
+)
+# Pixels per second libx265/medium manages per thread on a typical host (about 720p30 at
+# 0.12x realtime), the starting point for the priors above.
+_BASE_PIXELS_PER_SECOND_PER_THREAD = 1280 * 720 * 30 * 0.12
+_CALIBRATION_SIZE = (1280, 720)
+_CALIBRATION_FPS = 30
+_CALIBRATION_SECONDS = 2
+# Weight of the newest observation when learning from finished encodes.
+_LEARNING_RATE = 0.3
+DEFAULT_FPS = 30
+
+
+def get_encode_target_seconds():
+    """Time-to-post target for one encode; 0 (the default) disables tuning (always libx265/medium)."""
+    # Off by default: the priors alone predict that a few minutes of 720p misses a 60s target
+    # with every libx265 preset, which would move routine jobs to libx264 at the same bitrate.
+    try:
+        return max(0.0, float(os.getenv('TIKBOT_ENCODE_TARGET_SECONDS', '0')))
+    except ValueError:
+        return 0.0
+
+
+def is_encoder_calibration_enabled():
+    return os.getenv('TIKBOT_ENCODER_CALIBRATION', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+def get_output_pixels(width, height, max_height, fps, duration):
+    """Pixels an encode will produce, after the scale filter caps the height at `max_height`."""
+    if width and height:
+        out_height = min(height, max_height)
+        out_width = width * out_height / height
+    else:
+        out_height = max_height
+        out_width = max_height * 16 / 9
+    return out_width * out_height * (fps or DEFAULT_FPS) * duration
+
+
+class EncoderChoice:
+    def __init__(self, encoder: str, preset: str, pixels: float, predicted_seconds: float, budget_seconds: float):
+        self.encoder = encoder
+        self.preset = preset
+        self.pixels = pixels
+        self.predicted_seconds = predicted_seconds
+        self.budget_seconds = budget_seconds
+
+    def __repr__(self):
+        return f"{self.encoder}/{self.preset}"
+
+
+class EncoderTuner:
+    """Predicts encode times per (encoder, preset) and picks the best one that meets a time budget.
+
+    Throughput is tracked in output pixels per second. It starts from fixed priors scaled by the
+    thread count, is replaced by a short synthetic encode at startup (`calibrate`), and is then
+    refined from every finished job (`record`), so segmented encodes and host load are learned too.
+    """
+
+    def __init__(self, threads: int):
+        self._lock = threading.Lock()
+        base = _BASE_PIXELS_PER_SECOND_PER_THREAD * max(1, threads)
+        self._throughput = {(encoder, preset): base * speed for encoder, preset, speed in ENCODER_PROFILES}
+        self._calibration_thread: threading.Thread | None = None
+        self._calibrating = threading.Event()
+
+    @property
+    def calibrating(self) -> bool:
+        return self._calibrating.is_set()
+
+    def throughput(self, encoder, preset):
+        with self._lock:
+            return self._throughput[(encoder, preset)]
+
+    def predict_seconds(self, encoder, preset, pixels):
+        return pixels / self.throughput(encoder, preset)
+
+    def choose(self, pixels, target_seconds, jobs_ahead=0):
+        """Pick the best profile predicted to finish within this job's share of the target.
+
+        Jobs already waiting for the transcode lane come out of the same time-to-post budget,
+        so a busy bot moves to faster presets and an idle one keeps the best compression.
+        """
+        budget = target_seconds / (1 + max(0, jobs_ahead))
+        if self.calibrating:
+            # The priors are about to be replaced; don't trade compression away on them meanwhile.
+            encoder, preset, _speed = ENCODER_PROFILES[0]
+            return EncoderChoice(encoder, preset, pixels, self.predict_seconds(encoder, preset, pixels), budget)
+        fastest = None
+        for encoder, preset, _speed in ENCODER_PROFILES:
+            predicted = self.predict_seconds(encoder, preset, pixels)
+            fastest = EncoderChoice(encoder, preset, pixels, predicted, budget)
+            if predicted <= budget:
+                return fastest
+        return fastest
+
+    def record(self, encoder, preset, pixels, elapsed_seconds):
+        if elapsed_seconds <= 0 or pixels <= 0:
+            return
+        observed = pixels / elapsed_seconds
+        with self._lock:
+            current = self._throughput[(encoder, preset)]
+            self._throughput[(encoder, preset)] = current + _LEARNING_RATE * (observed - current)
+
+    def start_calibration(self, threads) -> bool:
+        """Run `calibrate` once on a background thread, so no transcode waits for it.
+
+        `choose` picks the default profile until it has finished. Returns False if it was already started.
+        """
+        with self._lock:
+            if self._calibration_thread is not None:
+                return False
+            self._calibrating.set()
+            self._calibration_thread = threading.Thread(
+                target=self._run_calibration, args=(threads,), name="tikbot-encoder-calibration", daemon=True
+            )
+        self._calibration_thread.start()
+        return True
+
+    def _run_calibration(self, threads):
+        try:
+            self.calibrate(threads)
+        except Exception as e:
+            logger.warning("Encoder calibration failed, using default estimates: %s", e)
+        finally:
+            self._calibrating.clear()
+
+    def calibrate(self, threads):
+        """Time a short synthetic encode with every profile; profiles that fail keep their prior."""
+        width, height = _CALIBRATION_SIZE
+        pixels = width * height * _CALIBRATION_FPS * _CALIBRATION_SECONDS
+        source = f"testsrc2=size={width}x{height}:rate={_CALIBRATION_FPS}:duration={_CALIBRATION_SECONDS}"
+        for encoder, preset, _speed in ENCODER_PROFILES:
+            output_kwargs = {'c:v': encoder, 'preset': preset, 'b:v': '800k', 'threads': str(threads), 'f': 'null'}
+            if encoder == 'libx265':
+                output_kwargs['x265-params'] = f"pools={threads}:log-level=error"
+            started = time.perf_counter()
+            try:
+                ffmpeg.input(source, f='lavfi').output('-', **output_kwargs).run(quiet=True)
+            except Exception as e:
+                logger.warning("Encoder calibration for %s/%s failed: %s", encoder, preset, e)
+                continue
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._throughput[(encoder, preset)] = pixels / elapsed
+            logger.info(
+                "Calibrated %s/%s: %.2fx realtime at %sx%s",
+                encoder,
+                preset,
+                _CALIBRATION_SECONDS / elapsed,
+                width,
+                height,
+            )
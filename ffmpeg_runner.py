@@ -0,0 +1,164 @@
+import logging
+import os
+import queue
+import subprocess
+import threading
+import time
+from collections import deque
+
+import ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# How much of ffmpeg's stderr to keep for error reports and output stats.
+_STDERR_TAIL_BYTES = 256 * 1024
+_POLL_SECONDS = 0.5
+
+
+class TranscodeTimeoutError(Exception):
+    """ffmpeg ran past its wall-clock limit or stopped making progress, and was killed."""
+
+
+class TranscodeCancelledError(Exception):
+    """The job that started ffmpeg went away, and the process was killed."""
+
+
+def _get_float_env(name, default):
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return float(default)
+
+
+def get_transcode_timeout(duration):
+    """Hard wall-clock limit for one ffmpeg run over `duration` seconds of media; 0 disables it."""
+    base = _get_float_env('TIKBOT_TRANSCODE_TIMEOUT_BASE', 120)
+    per_second = _get_float_env('TIKBOT_TRANSCODE_TIMEOUT_PER_SECOND', 5)
+    if not base and not per_second:
+        return None
+    return base + per_second * (duration or 0)
+
+
+def get_transcode_stall_timeout():
+    """Seconds without output progress before ffmpeg is considered stuck; 0 disables it."""
+    return _get_float_env('TIKBOT_TRANSCODE_STALL_SECONDS', 60) or None
+
+
+def _parse_progress_time(value):
+    try:
+        return int(value) / 1_000_000
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_speed(value):
+    try:
+        return float(str(value).rstrip('x'))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_block(fields, expected_duration=None):
+    """Turn one `-progress` block (key=value pairs up to `progress=...`) into a progress dict."""
+    out_time = _parse_progress_time(fields.get('out_time_us') or fields.get('out_time_ms'))
+    speed = _parse_speed(fields.get('speed'))
+    progress = {
+        'out_time': out_time,
+        'speed': speed,
+        'fps': _parse_speed(fields.get('fps')),
+        'total_size': int(fields['total_size']) if str(fields.get('total_size', '')).isdigit() else None,
+        'done': fields.get('progress') == 'end',
+        'percent': None,
+        'eta': None,
+    }
+    if expected_duration and out_time is not None:
+        progress['percent'] = min(100.0, 100.0 * out_time / expected_duration)
+        if speed:
+            progress['eta'] = max(0.0, expected_duration - out_time) / speed
+    return progress
+
+
+def _read_lines(stream, lines):
+    for line in iter(stream.readline, b''):
+        lines.put(line)
+    lines.put(None)
+
+
+def _read_tail(stream, tail):
+    for chunk in iter(lambda: stream.read(4096), b''):
+        tail.append(chunk)
+        while sum(len(part) for part in tail) > _STDERR_TAIL_BYTES and len(tail) > 1:
+            tail.popleft()
+
+
+def _kill(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def run_ffmpeg(stream, expected_duration=None, timeout=None, stall_timeout=None, on_progress=None, cancelled=None):
+    """Run an ffmpeg-python stream as a managed subprocess, returning its stderr.
+
+    ffmpeg reports to us through `-progress pipe:1`. Each progress block goes to `on_progress`.
+    The process is killed when it runs longer than `timeout`, when its output time stops
+    advancing for `stall_timeout` seconds, or when `cancelled()` returns true.
+    Raises ffmpeg.Error on a non-zero exit, like `stream.run()`.
+    """
+    args = ffmpeg.compile(stream, overwrite_output=True)
+    args[1:1] = ['-nostdin', '-progress', 'pipe:1']
+    started = time.monotonic()
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = queue.Queue()
+    tail = deque()
+    readers = [
+        threading.Thread(target=_read_lines, args=(process.stdout, lines), daemon=True),
+        threading.Thread(target=_read_tail, args=(process.stderr, tail), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    fields = {}
+    last_out_time = None
+    last_advance = started
+    try:
+        while True:
+            try:
+                line = lines.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                line = b''
+            if line is None:
+                break
+
+            key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+            if key:
+                fields[key] = value
+            if key == 'progress':
+                progress = parse_progress_block(fields, expected_duration)
+                fields = {}
+                if progress['out_time'] is not None and progress['out_time'] != last_out_time:
+                    last_out_time = progress['out_time']
+                    last_advance = time.monotonic()
+                if on_progress is not None:
+                    on_progress(progress)
+
+            now = time.monotonic()
+            if cancelled is not None and cancelled():
+                _kill(process)
+                raise TranscodeCancelledError("Transcode cancelled")
+            if timeout and now - started > timeout:
+                _kill(process)
+                raise TranscodeTimeoutError(f"Transcode took longer than {timeout:.0f}s and was stopped")
+            if stall_timeout and now - last_advance > stall_timeout:
+                _kill(process)
+                raise TranscodeTimeoutError(f"Transcode made no progress for {stall_timeout:.0f}s and was stopped")
+        process.wait()
+    finally:
+        _kill(process)
+        for reader in readers:
+            reader.join(timeout=5)
+
+    stderr = b''.join(tail)
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', b'', stderr)
+    return stderr
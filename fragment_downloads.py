@@ -0,0 +1,108 @@
+import contextlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Fragments fetched in parallel per download. Segmented HLS/DASH sources gain the most:
+# Twitch clips/VODs are HLS with many short fragments, Reddit and YouTube serve DASH.
+_FRAGMENT_CONCURRENCY_DEFAULTS = {'twitch': 8, 'reddit': 4, 'youtube': 4}
+# YouTube throttles long single requests, so progressive downloads are fetched in ranged chunks.
+_HTTP_CHUNK_SIZE_DEFAULTS = {'youtube': 10 * 1024 * 1024}
+
+
+def _get_optional_int_env(name: str) -> int | None:
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        logger.warning("Ignoring invalid %s=%r", name, value)
+        return None
+
+
+def get_fragment_concurrency(platform: str) -> int:
+    """Parallel fragment requests for one download.
+
+    TIKBOT_FRAGMENT_CONCURRENCY_<PLATFORM> wins over TIKBOT_FRAGMENT_CONCURRENCY, which wins
+    over the per-platform default (1 for platforms without one).
+    """
+    for name in (f'TIKBOT_FRAGMENT_CONCURRENCY_{platform.upper()}', 'TIKBOT_FRAGMENT_CONCURRENCY'):
+        value = _get_optional_int_env(name)
+        if value is not None:
+            return max(1, value)
+    return _FRAGMENT_CONCURRENCY_DEFAULTS.get(platform, 1)
+
+
+def get_http_chunk_size(platform: str) -> int | None:
+    """Bytes per ranged request for non-fragmented downloads; None downloads in one request.
+
+    TIKBOT_HTTP_CHUNK_SIZE_MB overrides the per-platform default, and 0 turns chunking off.
+    """
+    size_mb = _get_optional_int_env('TIKBOT_HTTP_CHUNK_SIZE_MB')
+    if size_mb is not None:
+        return size_mb * 1024 * 1024 or None
+    return _HTTP_CHUNK_SIZE_DEFAULTS.get(platform)
+
+
+def get_max_download_connections() -> int:
+    value = _get_optional_int_env('TIKBOT_MAX_DOWNLOAD_CONNECTIONS')
+    return max(1, value) if value is not None else 16
+
+
+def get_fragment_ydl_opts(platform: str, concurrent_fragments: int | None = None) -> dict:
+    """yt-dlp options for fragment concurrency and chunked range requests on `platform`."""
+    opts = {'concurrent_fragment_downloads': concurrent_fragments or get_fragment_concurrency(platform)}
+    chunk_size = get_http_chunk_size(platform)
+    if chunk_size:
+        opts['http_chunk_size'] = chunk_size
+    return opts
+
+
+class ConnectionBudget:
+    """Caps the fragment connections open across all downloads at once.
+
+    A download asks for its platform's concurrency and gets what is left of the budget (at
+    least one connection), waiting only when the budget is used up entirely.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, wanted: int) -> int:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_use < self.limit)
+            granted = max(1, min(wanted, self.limit - self.in_use))
+            self.in_use += granted
+            return granted
+
+    def release(self, granted: int):
+        with self._condition:
+            self.in_use -= granted
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, wanted: int):
+        granted = self.acquire(wanted)
+        if granted < wanted:
+            logger.debug("Connection budget allows %s of %s fragment connections", granted, wanted)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+
+_connection_budget: ConnectionBudget | None = None
+_connection_budget_lock = threading.Lock()
+
+
+def get_connection_budget() -> ConnectionBudget:
+    global _connection_budget
+    with _connection_budget_lock:
+        if _connection_budget is None:
+            _connection_budget = ConnectionBudget(get_max_download_connections())
+        return _connection_budget
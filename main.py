@@ -1,18 +1,27 @@
-from calculator import calculateBitrate, calculateBitrateAudioOnly
-import functools
+from calculator import MIN_AUDIO_BITRATE_KBPS, PLAYABLE_VIDEO_CODECS, calculateBitrate, calculateBitrateAudioOnly, get_file_size_limit
 import discord
 import os
 import ffmpeg
 import traceback
 import asyncio
 import logging
+import threading
+import time
 from dotenv import load_dotenv 
-from downloader import download, download_with_retries
+from datetime import datetime, timezone
+from encoder_tuning import EncoderChoice, EncoderTuner, get_encode_target_seconds, get_output_pixels, is_encoder_calibration_enabled
+from downloader import datetime_from_utc_to_local, download_async, download_with_retries_async, find_repost, resolve_video_id
 from compressionMessages import getCompressionMessage
-from validator import extractUrl, isSupportedUrl
-from dbInteraction import savePost, doesPostExist
-from concurrent.futures import ThreadPoolExecutor
+from media_cache import get_media_cache, make_cache_key
+from ffmpeg_runner import TranscodeCancelledError, TranscodeTimeoutError, get_transcode_stall_timeout, get_transcode_timeout, run_ffmpeg
+from media_info import MediaInfo
+from segment_encode import encode_segmented, get_segment_count
+from single_flight import SingleFlight
+from transcode_settings import get_ffmpeg_thread_count, get_transcode_max_height, get_transcode_output_kwargs, get_transcode_worker_count
+from validator import extractUrl, isSupportedUrl, normalize_platform
+from dbInteraction import savePost
 from version import get_status_text, get_version_label
+from worker_pools import WorkerLane, get_env_worker_count
 
 SKIP_STRINGS = ['🙅‍♂️', '🙅‍♀️', '❌']
 REPOST_BYPASS_STRINGS = ['👾']
@@ -27,16 +36,17 @@ logger = logging.getLogger(__name__)
 
 
 def get_worker_thread_count():
-    try:
-        return max(1, int(os.getenv('TIKBOT_WORKER_THREADS', '2')))
-    except ValueError:
-        return 2
+    # TIKBOT_WORKER_THREADS predates the split lanes and still sizes the download lane.
+    return get_env_worker_count('TIKBOT_DOWNLOAD_THREADS', get_env_worker_count('TIKBOT_WORKER_THREADS', 2))
 
 
-blocking_executor = ThreadPoolExecutor(
-    max_workers=get_worker_thread_count(),
-    thread_name_prefix='tikbot-blocking',
-)
+download_lane = WorkerLane('download', get_worker_thread_count())
+transcode_lane = WorkerLane('transcode', get_transcode_worker_count())
+io_lane = WorkerLane('io', get_env_worker_count('TIKBOT_IO_THREADS', 4))
+in_flight_posts = SingleFlight()
+encoder_tuner = EncoderTuner(get_ffmpeg_thread_count())
+# Message ID -> task handling it, so a deleted message can cancel its download.
+active_jobs: dict[int, asyncio.Task] = {}
 
 if not logging.getLogger().handlers:
     logging.basicConfig(
@@ -44,25 +54,128 @@ if not logging.getLogger().handlers:
         format="%(asctime)s %(levelname)s %(name)s: %(message)s",
     )
 
-def get_file_size_limit():
-    try:
-        size_mb = float(os.getenv('TIKBOT_FILE_SIZE_LIMIT', '8'))
-        return size_mb * 1_000_000
-    except ValueError:
-        return 8_000_000
+def choose_encoder_settings(mediaInfo, calcResult, encodeDuration):
+    """Picks the encoder and preset for a job from the time-to-post target and transcode queue depth"""
+    pixels = get_output_pixels(
+        mediaInfo.width,
+        mediaInfo.height,
+        get_transcode_max_height(calcResult.videoBitrate),
+        mediaInfo.fps,
+        encodeDuration,
+    )
+    target_seconds = get_encode_target_seconds()
+    if not target_seconds:
+        return EncoderChoice('libx265', 'medium', pixels, encoder_tuner.predict_seconds('libx265', 'medium', pixels), 0)
+    stats = transcode_lane.stats()
+    jobs_ahead = max(0, stats['queued'] + stats['running'] - stats['maxWorkers'] + 1)
+    return encoder_tuner.choose(pixels, target_seconds, jobs_ahead)
+
+
+# Audio codecs that can be stream-copied into MP4 and still play inline.
+STREAM_COPY_AUDIO_CODECS = ('aac', 'mp3')
+FAST_PATH_MAX_AUDIO_BITRATE_KBPS = 128
+# Headroom under the upload limit for stream-copy outputs, whose size is estimated from bitrates.
+FAST_PATH_SIZE_HEADROOM = 0.95
+
+
+def get_stream_copy_plan(mediaInfo, fileSize, file_size_limit, duration):
+    """Picks the cheapest ffmpeg job that makes a playable, small enough MP4 without re-encoding video.
+
+    Tries, in order: remux, audio-only re-encode, keyframe trim. Returns
+    {'mode', 'output_kwargs', 'duration'} or None when only a full encode will do.
+    """
+    if mediaInfo.video_codec not in PLAYABLE_VIDEO_CODECS:
+        return None
+
+    has_audio = bool(mediaInfo.has_audio)
+    # Separately downloaded video and audio always need muxing into one file.
+    container_is_mp4 = not mediaInfo.audio_path and bool({'mp4', 'mov'} & set((mediaInfo.container or '').split(',')))
+    audio_copyable = not has_audio or mediaInfo.audio_codec in STREAM_COPY_AUDIO_CODECS
+    budget = file_size_limit * FAST_PATH_SIZE_HEADROOM
+    # Split streams can't be posted as they are, so try the mux right up to the limit; its
+    # output is checked against the limit before it is posted.
+    remux_budget = file_size_limit if mediaInfo.audio_path else budget
+    copy_kwargs = {'c:v': 'copy', 'movflags': '+faststart', 'f': 'mp4'}
+    if mediaInfo.video_codec == 'hevc':
+        copy_kwargs['tag:v'] = 'hvc1'
+
+    # 1. Remux: playable streams in a container Discord won't inline.
+    if fileSize < remux_budget and audio_copyable and not container_is_mp4:
+        return {'mode': 'remux', 'output_kwargs': {**copy_kwargs, 'c:a': 'copy'}, 'duration': duration}
+
+    media_duration = mediaInfo.duration or duration
+    if not media_duration:
+        return None
 
-def get_transcode_scale_filter(video_bitrate_kbps):
-    # Avoid upscaling, and drop long low-bitrate videos to 480p for better visual quality.
-    max_height = 480 if video_bitrate_kbps <= 320 else 720
-    return f"scale=-2:min({max_height}\\,ih)"
+    audio_bps = (mediaInfo.audio_bitrate or 0.0) if has_audio else 0.0
+    video_bps = mediaInfo.video_bitrate or 0.0
+    if not video_bps and (not has_audio or audio_bps):
+        video_bps = fileSize * 8 / media_duration - audio_bps
+    if video_bps <= 0:
+        return None
+
+    # 2. Audio-only re-encode: the video fits, the audio track is too big (or not MP4-friendly).
+    if has_audio:
+        audio_budget_kbps = (budget * 8 / media_duration - video_bps) / 1000
+        target_audio_kbps = int(min(FAST_PATH_MAX_AUDIO_BITRATE_KBPS, audio_budget_kbps))
+        if target_audio_kbps >= MIN_AUDIO_BITRATE_KBPS and (not audio_copyable or audio_bps / 1000 > target_audio_kbps):
+            return {
+                'mode': 'audio',
+                'output_kwargs': {**copy_kwargs, 'c:a': 'aac', 'b:a': f"{target_audio_kbps}k"},
+                'duration': duration,
+            }
+
+    # 3. Keyframe trim: the full encode would be truncated anyway, and copying keeps at least as much.
+    calcResult = calculateBitrate(duration or media_duration)
+    trimmed_bytes = (video_bps + audio_bps) / 8 * calcResult.maxDuration
+    if audio_copyable and calcResult.durationLimited and trimmed_bytes <= budget:
+        return {
+            'mode': 'trim',
+            'output_kwargs': {**copy_kwargs, 'c:a': 'copy', 't': calcResult.maxDuration},
+            'duration': calcResult.maxDuration,
+        }
+
+    return None
+
+
+def get_audio_copy_plan(mediaInfo, fileSize, file_size_limit):
+    """Picks a stream copy that posts downloaded audio without re-encoding it to MP3.
+
+    MP3 is copied as-is and AAC goes into an M4A. Returns {'extension', 'output_kwargs'}, or
+    None when the codec needs converting or the audio is too big to post.
+    """
+    if not mediaInfo.has_audio:
+        return None
+    audioSize = fileSize
+    if mediaInfo.has_video:
+        # Only the audio track is kept from a muxed download.
+        if not (mediaInfo.audio_bitrate and mediaInfo.duration):
+            return None
+        audioSize = mediaInfo.audio_bitrate / 8 * mediaInfo.duration
+    if audioSize >= file_size_limit * FAST_PATH_SIZE_HEADROOM:
+        return None
+    if mediaInfo.audio_codec == 'mp3':
+        return {'extension': 'mp3', 'output_kwargs': {'c:a': 'copy', 'vn': None, 'f': 'mp3'}}
+    if mediaInfo.audio_codec == 'aac':
+        return {'extension': 'm4a', 'output_kwargs': {'c:a': 'copy', 'vn': None, 'movflags': '+faststart', 'f': 'ipod'}}
+    return None
 
 
 async def run_blocking(func, *args, **kwargs):
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(
-        blocking_executor,
-        functools.partial(func, *args, **kwargs),
-    )
+    """Runs short blocking I/O (probes, stat, DB writes, cleanup) off the event loop"""
+    return await io_lane.run(func, *args, **kwargs)
+
+
+async def run_download(func, *args, **kwargs):
+    return await download_lane.run(func, *args, **kwargs)
+
+
+async def run_transcode(func, *args, **kwargs):
+    return await transcode_lane.run(func, *args, **kwargs)
+
+
+def get_worker_pool_stats():
+    return [lane.stats() for lane in (download_lane, transcode_lane, io_lane)]
 
 
 def get_compressed_filename(fileName):
@@ -72,29 +185,183 @@ def get_compressed_filename(fileName):
     )
 
 
-def get_cleanup_file_candidates(fileName):
-    return list(dict.fromkeys([fileName, get_compressed_filename(fileName)]))
+def get_cleanup_file_candidates(fileName, audioFileName=None):
+    candidates = [fileName, get_compressed_filename(fileName)]
+    if audioFileName:
+        candidates.append(audioFileName)
+    return list(dict.fromkeys(candidates))
 
 
-def _transcode_audio(fileName, audioFilename, audio_bitrate):
-    ffmpeg.input(fileName).output(audioFilename, **{
+def get_encode_progress_edit_interval():
+    """Seconds between ETA edits of the "compressing" message; 0 disables them"""
+    try:
+        return max(0.0, float(os.getenv('TIKBOT_ENCODE_PROGRESS_EDIT_SECONDS', '10')))
+    except ValueError:
+        return 10.0
+
+
+def _run_managed_ffmpeg(fileName, stream, duration, on_progress=None, cancelled=None):
+    """Runs ffmpeg with a duration-scaled wall-clock limit and stall detection"""
+    try:
+        return run_ffmpeg(
+            stream,
+            expected_duration=duration,
+            timeout=get_transcode_timeout(duration),
+            stall_timeout=get_transcode_stall_timeout(),
+            on_progress=on_progress,
+            cancelled=cancelled,
+        )
+    except ffmpeg.Error as e:
+        logger.warning("ffmpeg failed for %s: %s", fileName, (e.stderr or b'').decode('utf-8', errors='replace')[-2000:])
+        raise
+    except TranscodeTimeoutError as e:
+        logger.warning("Killed ffmpeg for %s: %s", fileName, e)
+        raise
+
+
+def _transcode_audio(fileName, audioFilename, audio_bitrate, duration=None, on_progress=None, cancelled=None):
+    stream = ffmpeg.input(fileName).output(audioFilename, **{
         'b:a': f"{audio_bitrate}k",
         'threads': '1'
-    }).run()
+    })
+    _run_managed_ffmpeg(fileName, stream, duration, on_progress, cancelled)
+
 
+def _copy_audio(fileName, audioFilename, output_kwargs, duration=None, on_progress=None, cancelled=None):
+    stream = ffmpeg.input(fileName).output(audioFilename, **output_kwargs)
+    _run_managed_ffmpeg(fileName, stream, duration, on_progress, cancelled)
 
-def _transcode_video(fileName, compressed_filename, output_kwargs):
-    ffmpeg.input(fileName).output(
+
+def _transcode_inputs(fileName, audioFileName=None):
+    """The ffmpeg inputs for a download, mapping the video and audio files together when they're separate"""
+    if not audioFileName:
+        return [ffmpeg.input(fileName)]
+    return [ffmpeg.input(fileName)['v:0'], ffmpeg.input(audioFileName)['a:0']]
+
+
+def _transcode_video(
+    fileName, compressed_filename, output_kwargs, duration=None, on_progress=None, cancelled=None, audioFileName=None
+):
+    """Runs ffmpeg, describing the output from its own stats so it needn't be probed"""
+    stream = ffmpeg.output(
+        *_transcode_inputs(fileName, audioFileName),
         compressed_filename,
         **output_kwargs
-    ).run(overwrite_output=True)
+    )
+    stderr = _run_managed_ffmpeg(fileName, stream, output_kwargs.get('t') or duration, on_progress, cancelled)
+    return MediaInfo.from_encoder_output(compressed_filename, output_kwargs, stderr)
+
+
+def _transcode_video_segmented(
+    fileName,
+    compressed_filename,
+    output_kwargs,
+    duration,
+    segments,
+    has_audio,
+    on_progress=None,
+    cancelled=None,
+    audioFileName=None,
+):
+    try:
+        return encode_segmented(
+            fileName,
+            compressed_filename,
+            output_kwargs,
+            duration,
+            segments,
+            get_ffmpeg_thread_count(),
+            has_audio,
+            on_progress=on_progress,
+            cancelled=cancelled,
+            audio_file=audioFileName,
+        )
+    except (TranscodeTimeoutError, TranscodeCancelledError):
+        raise
+    except Exception as e:
+        logger.warning("Segmented encode of %s failed, encoding in one pass: %s", fileName, e)
+        return _transcode_video(
+            fileName,
+            compressed_filename,
+            output_kwargs,
+            duration,
+            on_progress=on_progress,
+            cancelled=cancelled,
+            audioFileName=audioFileName,
+        )
+
+
+async def _edit_status_message(statusMessage, content):
+    try:
+        await statusMessage.edit(content=content)
+    except Exception as e:
+        logger.debug("Failed to update encode progress message: %s", e)
+
+
+async def run_monitored_transcode(func, *args, statusMessage=None, statusText=None, **kwargs):
+    """Runs an ffmpeg job on the transcode lane, reporting progress and killing it if this task is cancelled"""
+    loop = asyncio.get_running_loop()
+    cancelEvent = threading.Event()
+    editInterval = get_encode_progress_edit_interval()
+    state = {'started': None, 'lastEdit': 0.0}
+
+    def on_progress(progress):
+        now = time.monotonic()
+        if state['started'] is None:
+            state['started'] = now
+        if progress['done']:
+            logger.info(
+                "ffmpeg finished %.1fs of output at %sx (%s fps)",
+                progress['out_time'] or 0,
+                progress['speed'],
+                progress['fps'],
+            )
+        else:
+            logger.debug(
+                "ffmpeg progress: %.1fs encoded (%s%%) at %sx",
+                progress['out_time'] or 0,
+                None if progress['percent'] is None else round(progress['percent']),
+                progress['speed'],
+            )
+        percent = progress['percent']
+        if statusMessage is None or not editInterval or not percent or progress['done']:
+            return
+        if now - state['lastEdit'] < editInterval:
+            return
+        state['lastEdit'] = now
+        eta = progress['eta'] or (now - state['started']) * (100 - percent) / percent
+        asyncio.run_coroutine_threadsafe(
+            _edit_status_message(statusMessage, f"{statusText} ({percent:.0f}% done, about {eta:.0f}s left)"),
+            loop,
+        )
+
+    try:
+        return await run_transcode(func, *args, on_progress=on_progress, cancelled=cancelEvent.is_set, **kwargs)
+    except asyncio.CancelledError:
+        # The worker thread keeps going after the await is cancelled; this stops its ffmpeg.
+        cancelEvent.set()
+        raise
 
 
-def _log_background_send_result(future):
+async def save_post_details(message, downloadResponse):
     try:
-        future.result()
+        await run_blocking(
+            savePost,
+            message.author.name,
+            downloadResponse['videoId'],
+            downloadResponse.get('platform', 'unknown'),
+            message.id,
+        )
     except Exception as e:
-        logger.warning("Failed to send background Discord message: %s", e)
+        logger.warning("Failed to save post details: %s", e)
+
+
+async def send_repost_reply(message, messages, repostOriginalMesssageId):
+    try:
+        originalPost = await message.channel.fetch_message(repostOriginalMesssageId)
+        await message.channel.send(messages, reference=originalPost)
+    except Exception:
+        await message.channel.send(f'{messages} (Failed to find original post to reply to)')
 
 
 async def update_presence():
@@ -118,7 +385,7 @@ async def handle_audio_conversion(message, url):
     try:
         await message.author.send('Attempting to turn this into a MP3 for ya.')
         
-        downloadResponse = await run_blocking(download, url)
+        downloadResponse = await download_async(url, detect_repost=False, run_blocking=run_download, audio_only=True)
         fileName = downloadResponse['fileName']
         duration = downloadResponse['duration']
         messages = downloadResponse['messages']
@@ -129,11 +396,37 @@ async def handle_audio_conversion(message, url):
             await send_error_message(message.author, "Failed to download the audio.", messages)
             return
 
-        audioFilename = f"audio_{fileName}.mp3"
-        calcResult = calculateBitrateAudioOnly(duration)
+        mp3Filename = f"audio_{fileName}.mp3"
+        audioFilename = None
+        file_size_limit = get_file_size_limit()
+        outputFiles = [mp3Filename]
         
         try:
-            await run_blocking(_transcode_audio, fileName, audioFilename, calcResult.audioBitrate)
+            mediaInfo = downloadResponse.get('mediaInfo') or MediaInfo(fileName)
+            try:
+                await run_blocking(mediaInfo.load)
+            except Exception as e:
+                logger.warning("Failed to probe %s: %s", fileName, e)
+            duration = duration or mediaInfo.duration or 0
+            calcResult = calculateBitrateAudioOnly(duration)
+            fileSize = await run_blocking(lambda: os.stat(fileName).st_size)
+
+            copyPlan = get_audio_copy_plan(mediaInfo, fileSize, file_size_limit)
+            if copyPlan is not None:
+                copiedFilename = f"audio_{fileName}.{copyPlan['extension']}"
+                outputFiles.append(copiedFilename)
+                try:
+                    await run_monitored_transcode(_copy_audio, fileName, copiedFilename, copyPlan['output_kwargs'], duration=duration)
+                    if await run_blocking(lambda: os.stat(copiedFilename).st_size) < file_size_limit:
+                        logger.info("Sending %s audio from %s without re-encoding", mediaInfo.audio_codec, fileName)
+                        audioFilename = copiedFilename
+                    else:
+                        await run_blocking(os.remove, copiedFilename)
+                except Exception as e:
+                    logger.warning("Audio stream copy failed for %s, converting to MP3: %s", fileName, e)
+            if audioFilename is None:
+                audioFilename = mp3Filename
+                await run_monitored_transcode(_transcode_audio, fileName, audioFilename, calcResult.audioBitrate, duration=duration)
             
             with open(audioFilename, 'rb') as fp:
                 await message.author.send(file=discord.File(fp, str(audioFilename)))
@@ -145,7 +438,7 @@ async def handle_audio_conversion(message, url):
             )
         finally:
             # Clean up files if they exist
-            for file in [fileName, audioFilename]:
+            for file in dict.fromkeys([fileName] + outputFiles):
                 if os.path.exists(file):
                     os.remove(file)
                     
@@ -157,22 +450,28 @@ async def handle_audio_conversion(message, url):
         )
 
 async def process_video(message, fileName, duration, file_size_limit, downloadResponse):
-    """Processes and sends video files"""
+    """Processes and sends video files, returning details of the file that was posted"""
     try:
-        fileSize = await run_blocking(lambda: os.stat(fileName).st_size)
+        audioFileName = downloadResponse.get('audioFileName')
+        fileSize = await run_blocking(
+            lambda: sum(os.stat(path).st_size for path in (fileName, audioFileName) if path)
+        )
         
-        # Check for unsupported codec
-        probe = await run_blocking(ffmpeg.probe, fileName)
-        video_streams = [stream for stream in probe["streams"] if stream["codec_type"] == "video"]
+        # Probe once; the result travels with the file from here on
+        mediaInfo = downloadResponse.get('mediaInfo')
+        if mediaInfo is None or mediaInfo.path != fileName:
+            mediaInfo = MediaInfo(fileName, audioFileName)
+        if mediaInfo.probe is None:
+            await run_blocking(mediaInfo.load)
 
-        if not video_streams:
+        if not mediaInfo.has_video:
             await send_error_message(
                 message.channel,
                 "Downloaded media did not contain a video stream."
             )
             return
         
-        isUnsupportedCodec = not any(track["codec_name"] in ["h264", "hevc"] for track in video_streams)
+        isUnsupportedCodec = not any(codec in PLAYABLE_VIDEO_CODECS for codec in mediaInfo.video_codecs)
 
         if isUnsupportedCodec:
             await message.channel.send(
@@ -180,10 +479,25 @@ async def process_video(message, fileName, duration, file_size_limit, downloadRe
                 delete_after=180
             )
         
-        if fileSize < file_size_limit and not isUnsupportedCodec:
-            await send_original_video(message, fileName, downloadResponse)
-        else:
-            await send_compressed_video(message, fileName, duration, file_size_limit, downloadResponse, isUnsupportedCodec)
+        streamCopyPlan = None if isUnsupportedCodec else get_stream_copy_plan(mediaInfo, fileSize, file_size_limit, duration)
+        needsRemux = streamCopyPlan is not None and streamCopyPlan['mode'] == 'remux'
+
+        # Separately downloaded video and audio are never posted as-is; the video file has no sound.
+        if not audioFileName and fileSize < file_size_limit and not isUnsupportedCodec and not needsRemux:
+            sentMedia = await send_original_video(message, fileName, downloadResponse)
+            sentMedia['videoCodec'] = mediaInfo.video_codec
+            return sentMedia
+
+        sentMedia = None
+        if streamCopyPlan is not None:
+            sentMedia = await send_stream_copied_video(message, fileName, streamCopyPlan, file_size_limit, downloadResponse)
+            if sentMedia is not None:
+                sentMedia['videoCodec'] = mediaInfo.video_codec
+        if sentMedia is None:
+            sentMedia = await send_compressed_video(
+                message, fileName, duration, file_size_limit, downloadResponse, isUnsupportedCodec, mediaInfo=mediaInfo
+            )
+        return sentMedia
             
     except Exception as e:
         await send_error_message(
@@ -196,18 +510,19 @@ async def process_video(message, fileName, duration, file_size_limit, downloadRe
 async def send_original_video(message, fileName, downloadResponse):
     """Sends the original video file"""
     try:
+        # Long videos may have been downloaded only up to the transcode window.
+        downloadedDuration = downloadResponse.get('downloadedDuration')
+        durationLimited = bool(downloadedDuration) and downloadedDuration < (downloadResponse.get('duration') or 0)
         with open(fileName, 'rb') as fp:
             await message.channel.send(file=discord.File(fp, str(fileName)))
-            try:
-                await run_blocking(
-                    savePost,
-                    message.author.name,
-                    downloadResponse['videoId'],
-                    downloadResponse.get('platform', 'unknown'),
-                    message.id,
-                )
-            except Exception as e:
-                logger.warning("Failed to save post details: %s", e)
+            if durationLimited:
+                await message.channel.send(f"⚠️ Warning: Only the first {downloadedDuration:.0f}s of this video were downloaded.")
+            await save_post_details(message, downloadResponse)
+        return {
+            'fileName': fileName,
+            'duration': downloadedDuration if durationLimited else downloadResponse.get('duration') or 0,
+            'durationLimited': durationLimited,
+        }
     except Exception as e:
         await send_error_message(
             message.channel,
@@ -216,72 +531,139 @@ async def send_original_video(message, fileName, downloadResponse):
         )
         raise
 
-async def send_compressed_video(message, fileName, duration, file_size_limit, downloadResponse, isUnsupportedCodec):
+async def send_stream_copied_video(message, fileName, streamCopyPlan, file_size_limit, downloadResponse):
+    """Sends a remuxed/trimmed copy of the video, or returns None if a full encode is needed"""
+    compressed_filename = get_compressed_filename(fileName)
+    mode = streamCopyPlan['mode']
+    try:
+        outputInfo = await run_monitored_transcode(
+            _transcode_video,
+            fileName,
+            compressed_filename,
+            streamCopyPlan['output_kwargs'],
+            duration=streamCopyPlan['duration'],
+            audioFileName=downloadResponse.get('audioFileName'),
+        )
+        compressed_file_size = await run_blocking(lambda: os.stat(compressed_filename).st_size)
+    except Exception as e:
+        logger.warning("Stream-copy %s failed for %s, falling back to a full encode: %s", mode, fileName, e)
+        return None
+
+    if compressed_file_size >= file_size_limit:
+        logger.info(
+            "Stream-copy %s produced %.2fMB for %s, falling back to a full encode",
+            mode,
+            compressed_file_size / 1_000_000,
+            fileName,
+        )
+        return None
+
+    logger.info("Posting %s without re-encoding video (%s)", fileName, mode)
+    try:
+        with open(compressed_filename, 'rb') as fp:
+            await message.channel.send(file=discord.File(fp, str(compressed_filename)))
+            if mode == 'trim':
+                await message.channel.send(
+                    f"⚠️ Warning: Video was truncated to {streamCopyPlan['duration']:.0f}s to fit within file size limits."
+                )
+            await save_post_details(message, downloadResponse)
+        return {
+            'fileName': compressed_filename,
+            'duration': (outputInfo and outputInfo.duration) or streamCopyPlan['duration'] or 0,
+            'durationLimited': mode == 'trim',
+        }
+    except Exception as e:
+        await send_error_message(
+            message.channel,
+            "Failed to send the video.",
+            e
+        )
+        raise
+
+async def send_compressed_video(message, fileName, duration, file_size_limit, downloadResponse, isUnsupportedCodec, mediaInfo=None):
     """Compresses and sends the video file"""
     try:
+        statusMessage = None
+        statusText = getCompressionMessage()
         if not isUnsupportedCodec:
-            await message.channel.send(getCompressionMessage(), delete_after=180)
+            statusMessage = await message.channel.send(statusText, delete_after=180)
         
         logger.info("Duration = %s", duration)
-        if not duration:
+        audioFileName = downloadResponse.get('audioFileName')
+        if mediaInfo is None:
+            mediaInfo = MediaInfo(fileName, audioFileName)
+        if mediaInfo.probe is None:
             try:
-                probe = await run_blocking(ffmpeg.probe, fileName)
-                format_duration = float(probe.get('format', {}).get('duration') or 0)
-                stream_duration = 0.0
-                for stream in probe.get('streams', []):
-                    if stream.get('codec_type') == 'video' and stream.get('duration'):
-                        stream_duration = float(stream['duration'])
-                        break
-                duration = format_duration or stream_duration or 0
-                logger.info("Resolved duration via ffprobe: %s", duration)
+                await run_blocking(mediaInfo.load)
             except Exception as e:
-                logger.warning("Failed to probe duration for %s: %s", fileName, e)
+                logger.warning("Failed to probe %s: %s", fileName, e)
+        if not duration:
+            duration = mediaInfo.duration or 0
+            logger.info("Resolved duration via ffprobe: %s", duration)
         calcResult = calculateBitrate(duration)
         compressed_filename = get_compressed_filename(fileName)
 
         try:
-            # Target HEVC-in-MP4 for better compression while keeping Discord-friendly playback flags.
-            output_kwargs = {
-                'c:v': 'libx265',
-                'b:v': f"{calcResult.videoBitrate}k",
-                'maxrate': f"{calcResult.videoBitrate}k",
-                'c:a': 'aac',
-                'b:a': f"{calcResult.audioBitrate}k",
-                'bufsize': f"{2 * calcResult.videoBitrate}k",
-                'vf': get_transcode_scale_filter(calcResult.videoBitrate),
-                'pix_fmt': 'yuv420p',
-                'profile:v': 'main',
-                'tag:v': 'hvc1',
-                'preset': 'medium',
-                'fs': int(file_size_limit),
-                'movflags': '+faststart',
-                'f': 'mp4',
-            }
-            if calcResult.maxDuration:
-                output_kwargs['t'] = calcResult.maxDuration
+            encodeDuration = calcResult.maxDuration or duration
+            encoderChoice = choose_encoder_settings(mediaInfo, calcResult, encodeDuration)
+            logger.info(
+                "Encoding %s with %s: predicted %.1fs (budget %.1fs)",
+                fileName,
+                encoderChoice,
+                encoderChoice.predicted_seconds,
+                encoderChoice.budget_seconds,
+            )
+            output_kwargs = get_transcode_output_kwargs(
+                calcResult, file_size_limit, encoderChoice.encoder, encoderChoice.preset
+            )
 
-            await run_blocking(_transcode_video, fileName, compressed_filename, output_kwargs)
+            encodeStarted = time.perf_counter()
+            segments = get_segment_count(encodeDuration, get_ffmpeg_thread_count())
+            if segments > 1:
+                outputInfo = await run_monitored_transcode(
+                    _transcode_video_segmented,
+                    fileName,
+                    compressed_filename,
+                    output_kwargs,
+                    encodeDuration,
+                    segments,
+                    mediaInfo.has_audio is not False,
+                    statusMessage=statusMessage,
+                    statusText=statusText,
+                    audioFileName=audioFileName,
+                )
+            else:
+                outputInfo = await run_monitored_transcode(
+                    _transcode_video,
+                    fileName,
+                    compressed_filename,
+                    output_kwargs,
+                    duration=encodeDuration,
+                    statusMessage=statusMessage,
+                    statusText=statusText,
+                    audioFileName=audioFileName,
+                )
+            encodeSeconds = time.perf_counter() - encodeStarted
+            encoder_tuner.record(encoderChoice.encoder, encoderChoice.preset, encoderChoice.pixels, encodeSeconds)
+            logger.info(
+                "Encoded %s with %s in %.1fs (predicted %.1fs, %s segment(s))",
+                fileName,
+                encoderChoice,
+                encodeSeconds,
+                encoderChoice.predicted_seconds,
+                segments,
+            )
             
             # Check file size after compression
             compressed_file_size = await run_blocking(lambda: os.stat(compressed_filename).st_size)
             if compressed_file_size > file_size_limit:
                 await message.channel.send(
-                    f"⚠️ Error: Compressed file size is {compressed_file_size / 1_000_000:.2f}MB, exceeding the 8MB limit."
+                    f"⚠️ Error: Compressed file size is {compressed_file_size / 1_000_000:.2f}MB, exceeding the {file_size_limit / 1_000_000:g}MB limit."
                 )
                 return
             
-            original_probe, compressed_probe = await asyncio.gather(
-                run_blocking(ffmpeg.probe, fileName),
-                run_blocking(ffmpeg.probe, compressed_filename),
-            )
-
-            original_duration = float(original_probe.get('format', {}).get('duration') or 0)
-            if not original_duration:
-                original_duration = float(original_probe.get('streams', [{}])[0].get('duration', 0) or 0)
-
-            compressed_duration = float(compressed_probe.get('format', {}).get('duration') or 0)
-            if not compressed_duration:
-                compressed_duration = float(compressed_probe.get('streams', [{}])[0].get('duration', 0) or 0)
+            original_duration = mediaInfo.duration or duration
+            compressed_duration = (outputInfo and outputInfo.duration) or 0
             
             if compressed_duration < original_duration and compressed_duration > 1:
                 # Check if the difference is greater than 1 second or 5% of the original duration
@@ -300,16 +682,14 @@ async def send_compressed_video(message, fileName, duration, file_size_limit, do
                 if calcResult.durationLimited:
                     await message.channel.send('Video duration was limited to keep quality above total potato.')
                 
-                try:
-                    await run_blocking(
-                        savePost,
-                        message.author.name,
-                        downloadResponse['videoId'],
-                        downloadResponse.get('platform', 'unknown'),
-                        message.id,
-                    )
-                except Exception as e:
-                    logger.warning("Failed to save post details: %s", e)
+                await save_post_details(message, downloadResponse)
+
+            return {
+                'fileName': compressed_filename,
+                'duration': compressed_duration or calcResult.maxDuration,
+                'durationLimited': calcResult.durationLimited,
+                'videoCodec': (outputInfo and outputInfo.video_codec) or ('h264' if encoderChoice.encoder == 'libx264' else 'hevc'),
+            }
                     
         except Exception as e:
             await send_error_message(
@@ -327,6 +707,78 @@ async def send_compressed_video(message, fileName, duration, file_size_limit, do
         )
         raise
 
+async def send_cached_video(message, cachedMedia, downloadResponse):
+    """Sends a previously posted file straight from the media cache"""
+    with open(cachedMedia['fileName'], 'rb') as fp:
+        await message.channel.send(
+            file=discord.File(fp, cachedMedia.get('displayName') or os.path.basename(cachedMedia['fileName']))
+        )
+    if cachedMedia.get('durationLimited'):
+        await message.channel.send('Video duration was limited to keep quality above total potato.')
+    await save_post_details(message, downloadResponse)
+
+
+def get_posted_outcome(message):
+    return {'outcome': 'posted', 'message': message, 'postedAt': datetime.now(timezone.utc)}
+
+
+def get_repost_outcome(messages, repostOriginalMesssageId):
+    return {'outcome': 'repost', 'messages': messages, 'repostOriginalMesssageId': repostOriginalMesssageId}
+
+
+async def try_send_cached_video(message, url, detectRepost, file_size_limit):
+    """Answers from the media cache without downloading, returning the outcome or None on a cache miss"""
+    media_cache = get_media_cache()
+    if media_cache is None:
+        return None
+
+    videoId = resolve_video_id(url)
+    if not videoId:
+        return None
+
+    platform = normalize_platform(url)
+    cachedMedia = await run_blocking(media_cache.get, make_cache_key(platform, videoId, file_size_limit))
+    if cachedMedia is None:
+        return None
+
+    logger.info("Media cache hit for %s video %s", platform, videoId)
+    if detectRepost:
+        try:
+            repost = await run_blocking(find_repost, videoId, platform)
+        except Exception as e:
+            # Don't die for repost detection
+            logger.error("Exception trying to do repost detection", exc_info=(type(e), e, e.__traceback__))
+            repost = None
+        if repost is not None:
+            await send_repost_reply(message, repost['messages'], repost['repostOriginalMesssageId'])
+            return get_repost_outcome(repost['messages'], repost['repostOriginalMesssageId'])
+
+    try:
+        await send_cached_video(message, cachedMedia, {'videoId': videoId, 'platform': platform})
+    except Exception as e:
+        logger.warning("Failed to send cached media %s, downloading instead: %s", cachedMedia['fileName'], e)
+        return None
+    return get_posted_outcome(message)
+
+
+async def store_in_media_cache(sentMedia, downloadResponse, file_size_limit):
+    media_cache = get_media_cache()
+    if media_cache is None or not sentMedia or not downloadResponse.get('videoId'):
+        return
+
+    key = make_cache_key(downloadResponse.get('platform', 'unknown'), downloadResponse['videoId'], file_size_limit)
+    metadata = {
+        'displayName': os.path.basename(sentMedia['fileName']),
+        'duration': sentMedia.get('duration') or 0,
+        'durationLimited': bool(sentMedia.get('durationLimited')),
+        'videoCodec': sentMedia.get('videoCodec'),
+    }
+    try:
+        await run_blocking(media_cache.put, key, sentMedia['fileName'], metadata)
+    except Exception as e:
+        logger.warning("Failed to store posted media in cache: %s", e)
+
+
 async def handleMessage(message):
     """Main message handler with comprehensive error handling"""
     try:
@@ -405,96 +857,154 @@ async def handleMessage(message):
                 )
                 return
 
-        if not silentMode:
-            await message.channel.send('TikBot downloading video now!', delete_after=10)
-            if messages.startswith("Reddit"):
-                await message.channel.send(messages)
-
         detectRepost = not any(bypass_str in message.content for bypass_str in REPOST_BYPASS_STRINGS)
+        file_size_limit = get_file_size_limit()
 
-        # Download with retries
-        downloadResponse = {'fileName': '', 'duration': 0, 'messages': '', 'videoId': '', 'repost': False, 'repostOriginalMesssageId': ''}
-        message_loop = asyncio.get_running_loop()
-
-        def notify_retry(_attempt, _response):
-            if not silentMode:
-                retry_notice = asyncio.run_coroutine_threadsafe(
-                    message.channel.send('Download failed. Retrying!', delete_after=10),
-                    message_loop,
-                )
-                retry_notice.add_done_callback(_log_background_send_result)
-
+        # Deleting the message cancels its work (see on_raw_message_delete).
+        active_jobs[message.id] = asyncio.current_task()
         try:
-            downloadResponse = await run_blocking(
-                download_with_retries,
-                url,
-                retries=4,
-                on_retry=notify_retry,
-                detect_repost=detectRepost,
+            # Concurrent posts of the same video share one download and transcode.
+            outcome, isLeader = await in_flight_posts.run(
+                await get_flight_key(url),
+                lambda: download_and_post(message, url, messages, silentMode, detectRepost, file_size_limit),
             )
-        except Exception as e:
-            await send_error_message(
-                message.channel,
-                "Failed to download after multiple attempts.",
-                e
-            )
-            return
+            if not isLeader:
+                await handle_coalesced_post(message, url, messages, silentMode, detectRepost, file_size_limit, outcome)
+        finally:
+            if active_jobs.get(message.id) is asyncio.current_task():
+                del active_jobs[message.id]
 
-        fileName = downloadResponse['fileName']
-        duration = downloadResponse['duration']
-        messages = downloadResponse['messages']
-        repost = downloadResponse['repost']
-        repostOriginalMesssageId = downloadResponse['repostOriginalMesssageId']
+    except Exception as e:
+        error_traceback = traceback.format_exc()
+        logger.error("Unexpected error in handleMessage: %s", error_traceback)
+        await send_error_message(
+            message.channel or message.author,
+            "Something unexpected happened while processing your request.",
+            e
+        )
 
-        logger.info("Downloaded: %s For User: %s", fileName, message.author)
 
-        if messages.startswith("Error"):
-            if not silentMode:
-                await send_error_message(
-                    message.channel,
-                    "Failed to download the content.",
-                    messages
-                )
-            return
+async def get_flight_key(url):
+    """Keys a request by the video it is for, so links that resolve to one video share a download.
 
-        # Handle reposts
-        if repost:
-            try:
-                if os.path.exists(fileName):
-                    await run_blocking(os.remove, fileName)
-                    
-                originalPost = await message.channel.fetch_message(repostOriginalMesssageId)
-                await message.channel.send(messages, reference=originalPost)
-            except Exception as e:
-                await message.channel.send(f'{messages} (Failed to find original post to reply to)')
-            return
+    Short links are followed (and cached for the download's repost check); otherwise two jobs for
+    one video would download to the same file and one's cleanup could delete the other's.
+    """
+    videoId = await run_blocking(resolve_video_id, url, True)
+    if videoId:
+        return f"{normalize_platform(url)}:{videoId}"
+    return f"url:{url.strip()}"
 
-        # Post a temporary download method note for TikTok.
-        if (
-            not silentMode
-            and downloadResponse.get('platform') == 'tiktok'
-            and messages
-            and not messages.startswith("Error")
-        ):
-            await message.channel.send(messages, delete_after=10)
 
-        # Process the video
+async def handle_coalesced_post(message, url, messages, silentMode, detectRepost, file_size_limit, outcome):
+    """Answers a message that waited on an identical in-flight request"""
+    if detectRepost and outcome and outcome['outcome'] == 'posted':
+        postedAt = datetime_from_utc_to_local(outcome['postedAt'])
+        repostMessage = f'This is a repost! Originally posted at {postedAt.strftime("%d/%m/%Y %H:%M:%S")}'
         try:
-            await process_video(message, fileName, duration, get_file_size_limit(), downloadResponse)
-        finally:
-            # Clean up files
-            for file in get_cleanup_file_candidates(fileName):
-                if os.path.exists(file):
-                    await run_blocking(os.remove, file)
+            await message.channel.send(repostMessage, reference=outcome['message'])
+        except Exception:
+            await message.channel.send(repostMessage)
+        return
+
+    if detectRepost and outcome and outcome['outcome'] == 'repost':
+        await send_repost_reply(message, outcome['messages'], outcome['repostOriginalMesssageId'])
+        return
+
+    if outcome is None:
+        if not silentMode:
+            await send_error_message(message.channel, "Failed to download the content.")
+        return
+
+    # Repost detection was bypassed, so post our own copy (usually straight from the media cache).
+    await download_and_post(message, url, messages, silentMode, detectRepost, file_size_limit)
+
+
+async def download_and_post(message, url, messages, silentMode, detectRepost, file_size_limit):
+    """Downloads, processes and posts a video, returning the outcome shared with coalesced requests"""
+    cachedOutcome = await try_send_cached_video(message, url, detectRepost, file_size_limit)
+    if cachedOutcome is not None:
+        return cachedOutcome
+
+    if not silentMode:
+        await message.channel.send('TikBot downloading video now!', delete_after=10)
+        if messages.startswith("Reddit"):
+            await message.channel.send(messages)
 
+    # Download with retries
+    downloadResponse = {'fileName': '', 'duration': 0, 'messages': '', 'videoId': '', 'repost': False, 'repostOriginalMesssageId': ''}
+
+    async def notify_retry(_attempt, _error):
+        if not silentMode:
+            try:
+                await message.channel.send('Download failed. Retrying!', delete_after=10)
+            except Exception as e:
+                logger.warning("Failed to send retry notice: %s", e)
+
+    try:
+        downloadResponse = await download_with_retries_async(
+            url,
+            retries=4,
+            on_retry=notify_retry,
+            detect_repost=detectRepost,
+            run_blocking=run_download,
+            size_limit=file_size_limit,
+            run_io=run_blocking,
+        )
     except Exception as e:
-        error_traceback = traceback.format_exc()
-        logger.error("Unexpected error in handleMessage: %s", error_traceback)
         await send_error_message(
-            message.channel or message.author,
-            "Something unexpected happened while processing your request.",
+            message.channel,
+            "Failed to download after multiple attempts.",
             e
         )
+        return
+
+    fileName = downloadResponse['fileName']
+    duration = downloadResponse['duration']
+    messages = downloadResponse['messages']
+    repost = downloadResponse['repost']
+    repostOriginalMesssageId = downloadResponse['repostOriginalMesssageId']
+
+    logger.info("Downloaded: %s For User: %s", fileName, message.author)
+    logger.debug("Worker pools: %s", get_worker_pool_stats())
+
+    if messages.startswith("Error"):
+        if not silentMode:
+            await send_error_message(
+                message.channel,
+                "Failed to download the content.",
+                messages
+            )
+        return
+
+    # Handle reposts
+    if repost:
+        for file in (fileName, downloadResponse.get('audioFileName')):
+            if file and os.path.exists(file):
+                await run_blocking(os.remove, file)
+        await send_repost_reply(message, messages, repostOriginalMesssageId)
+        return get_repost_outcome(messages, repostOriginalMesssageId)
+
+    # Post a temporary download method note for TikTok.
+    if (
+        not silentMode
+        and downloadResponse.get('platform') == 'tiktok'
+        and messages
+        and not messages.startswith("Error")
+    ):
+        await message.channel.send(messages, delete_after=10)
+
+    # Process the video
+    try:
+        sentMedia = await process_video(message, fileName, duration, file_size_limit, downloadResponse)
+        await store_in_media_cache(sentMedia, downloadResponse, file_size_limit)
+    finally:
+        # Clean up files
+        for file in get_cleanup_file_candidates(fileName, downloadResponse.get('audioFileName')):
+            if os.path.exists(file):
+                await run_blocking(os.remove, file)
+
+    return get_posted_outcome(message) if sentMedia else None
 
 @client.event
 async def on_ready():
@@ -503,10 +1013,21 @@ async def on_ready():
         await update_presence()
     except Exception as e:
         logger.warning("Failed to update Discord presence: %s", e)
+    # Calibration runs beside the transcode lane rather than on it; on_ready fires again after
+    # reconnects, and start_calibration only runs it once.
+    if is_encoder_calibration_enabled() and get_encode_target_seconds():
+        encoder_tuner.start_calibration(get_ffmpeg_thread_count())
 
 @client.event
 async def on_message(message):
     await handleMessage(message)
 
+@client.event
+async def on_raw_message_delete(payload):
+    task = active_jobs.get(payload.message_id)
+    if task is not None and not task.done():
+        logger.info("Message %s was deleted; cancelling its download", payload.message_id)
+        task.cancel()
+
 if __name__ == "__main__":
     client.run(os.getenv('TOKEN'))
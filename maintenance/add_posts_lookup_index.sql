@@ -0,0 +1,5 @@
+-- Repost detection looks up the newest post for a video across one or more platforms.
+-- Without this index every lookup is a sequential scan of public.posts.
+-- CONCURRENTLY avoids locking out inserts while the index builds; run it outside a transaction.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_video_platform_post_idx
+    ON public.posts USING btree ("videoId", platform, "postId" DESC);
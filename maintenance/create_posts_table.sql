@@ -7,4 +7,7 @@ CREATE TABLE IF NOT EXISTS public.posts
     "postDateTime" timestamp without time zone,
     "discordMessageId" character varying(50) COLLATE pg_catalog."default",
     CONSTRAINT post_id PRIMARY KEY ("postId")
-)
+);
+
+CREATE INDEX IF NOT EXISTS posts_video_platform_post_idx
+    ON public.posts USING btree ("videoId", platform, "postId" DESC);
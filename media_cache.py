@@ -0,0 +1,174 @@
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEDIA_CACHE_DIR = "media_cache"
+_METADATA_SUFFIX = ".json"
+_UNSAFE_KEY_CHARS_RE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def get_media_cache_dir():
+    return os.getenv('TIKBOT_MEDIA_CACHE_DIR') or DEFAULT_MEDIA_CACHE_DIR
+
+
+def get_media_cache_max_bytes():
+    try:
+        return max(0, int(float(os.getenv('TIKBOT_MEDIA_CACHE_MB', '0')) * 1_000_000))
+    except ValueError:
+        return 0
+
+
+def make_cache_key(platform: str, video_id: str, size_limit) -> str:
+    """Build a filesystem-safe cache key for a Discord-ready file."""
+    safe_platform = _UNSAFE_KEY_CHARS_RE.sub("_", platform or "unknown")
+    safe_video_id = _UNSAFE_KEY_CHARS_RE.sub("_", str(video_id))
+    return f"{safe_platform}-{safe_video_id}-{int(size_limit)}"
+
+
+class MediaCache:
+    """Size-capped on-disk LRU cache of files that have already been posted."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+
+    def _media_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def _metadata_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{_METADATA_SUFFIX}")
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(_METADATA_SUFFIX):
+                continue
+            key = name[:-len(_METADATA_SUFFIX)]
+            media_path = self._media_path(key)
+            try:
+                stat = os.stat(media_path)
+            except OSError:
+                self._remove_files(key)
+                continue
+            found.append((stat.st_mtime, key, stat.st_size))
+
+        # Oldest access first so the OrderedDict head is the eviction candidate.
+        for _mtime, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _remove_files(self, key: str):
+        for path in (self._media_path(key), self._metadata_path(key)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                logger.warning("Failed to remove cached media file %s", path, exc_info=True)
+
+    def _drop(self, key: str):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+        self._remove_files(key)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            logger.info("Evicting cached media %s", key)
+            self._drop(key)
+
+    def get(self, key: str) -> dict | None:
+        """Return cached metadata with a `fileName` pointing at the cached file, or None."""
+        with self._lock:
+            self._load()
+            if key not in self._entries:
+                return None
+
+            media_path = self._media_path(key)
+            try:
+                with open(self._metadata_path(key), "r", encoding="utf-8") as handle:
+                    metadata = json.load(handle)
+                os.utime(media_path)
+            except (OSError, ValueError):
+                logger.warning("Dropping unreadable cache entry %s", key, exc_info=True)
+                self._drop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return {**metadata, 'fileName': media_path}
+
+    def put(self, key: str, source_path: str, metadata: dict) -> str | None:
+        """Copy a posted file into the cache and return its cached path."""
+        try:
+            size = os.path.getsize(source_path)
+        except OSError:
+            return None
+        if size <= 0 or size > self.max_bytes:
+            return None
+
+        with self._lock:
+            self._load()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            media_path = self._media_path(key)
+            metadata_path = self._metadata_path(key)
+            try:
+                shutil.copyfile(source_path, f"{media_path}.tmp")
+                os.replace(f"{media_path}.tmp", media_path)
+                with open(f"{metadata_path}.tmp", "w", encoding="utf-8") as handle:
+                    json.dump({**metadata, 'size': size}, handle)
+                os.replace(f"{metadata_path}.tmp", metadata_path)
+            except OSError:
+                logger.warning("Failed to store %s in media cache", source_path, exc_info=True)
+                self._drop(key)
+                return None
+
+            previous_size = self._entries.pop(key, None)
+            if previous_size is not None:
+                self._total_bytes -= previous_size
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+            return media_path if key in self._entries else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load()
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'maxBytes': self.max_bytes,
+            }
+
+
+_media_cache: MediaCache | None = None
+_media_cache_lock = threading.Lock()
+
+
+def get_media_cache() -> MediaCache | None:
+    """Return the shared media cache, or None when TIKBOT_MEDIA_CACHE_MB is unset."""
+    global _media_cache
+    max_bytes = get_media_cache_max_bytes()
+    if max_bytes <= 0:
+        return None
+    with _media_cache_lock:
+        cache_dir = get_media_cache_dir()
+        if _media_cache is None or _media_cache.cache_dir != cache_dir or _media_cache.max_bytes != max_bytes:
+            _media_cache = MediaCache(cache_dir, max_bytes)
+        return _media_cache
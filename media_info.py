@@ -0,0 +1,251 @@
+import logging
+import re
+
+import ffmpeg
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg's periodic stats line, e.g. "frame=  900 fps=... size=  2048kB time=00:00:30.03 bitrate=..."
+_FFMPEG_STATS_TIME_RE = re.compile(r"time=\s*(?P<hours>\d+):(?P<minutes>\d{2}):(?P<seconds>\d{2}(?:\.\d+)?)")
+_ENCODER_CODECS = {'libx264': 'h264', 'libx265': 'hevc', 'libopenh264': 'h264'}
+
+
+def normalize_vcodec(vcodec: str | None) -> str | None:
+    """Map a yt-dlp vcodec string (e.g. avc1.64001F, hvc1.1.6) to the ffprobe codec name."""
+    if not vcodec or vcodec == 'none':
+        return None
+    family = vcodec.split('.', 1)[0].lower()
+    if family in ('avc1', 'avc3', 'h264'):
+        return 'h264'
+    if family in ('hvc1', 'hev1', 'h265', 'hevc'):
+        return 'hevc'
+    return family
+
+
+def _metadata_value_has_video(value) -> bool | None:
+    if value is None:
+        return None
+    return str(value).lower() not in ('', 'none', 'unknown')
+
+
+def _to_float(value) -> float | None:
+    try:
+        return float(value) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_frame_rate(value) -> float | None:
+    """Parse ffprobe's "30000/1001"-style rates."""
+    if not value:
+        return None
+    numerator, _, denominator = str(value).partition('/')
+    try:
+        return float(numerator) / float(denominator or 1) or None
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def parse_ffmpeg_output_duration(stderr: bytes | str | None) -> float | None:
+    """Return the output duration from the last stats line ffmpeg printed, if any."""
+    if not stderr:
+        return None
+    if isinstance(stderr, bytes):
+        stderr = stderr.decode('utf-8', errors='replace')
+    matches = list(_FFMPEG_STATS_TIME_RE.finditer(stderr))
+    if not matches:
+        return None
+    last = matches[-1]
+    return int(last['hours']) * 3600 + int(last['minutes']) * 60 + float(last['seconds'])
+
+
+class MediaInfo:
+    """Codecs, duration and dimensions of one media file, probed at most once.
+
+    yt-dlp metadata fills in what is known without touching the file; `load()` runs ffprobe
+    the first time it is called and its answers take precedence, since they describe the file
+    actually on disk (e.g. a section download is shorter than the source's `duration`).
+    """
+
+    def __init__(self, path: str, audio_path: str | None = None):
+        self.path = path
+        # The audio stream, when it was downloaded as a separate file from the video.
+        self.audio_path = audio_path
+        self.probe = None
+        self._probe_error: Exception | None = None
+        self._metadata: dict = {}
+        self._probed: dict = {}
+
+    @classmethod
+    def from_ytdlp(cls, path: str, video: dict):
+        media_info = cls(path)
+        media_info.update_from_ytdlp(video)
+        return media_info
+
+    @classmethod
+    def from_encoder_output(cls, path: str, output_kwargs: dict, stderr):
+        """Describe a file ffmpeg just wrote, from the encoder's own output rather than a probe."""
+        media_info = cls(path)
+        video_codec = _ENCODER_CODECS.get(output_kwargs.get('c:v'))
+        media_info._metadata = {
+            'video_codec': video_codec,
+            'has_video': True if video_codec else None,
+            'duration': parse_ffmpeg_output_duration(stderr),
+            'container': output_kwargs.get('f'),
+        }
+        return media_info
+
+    def update_from_ytdlp(self, video: dict):
+        requested_formats = video.get('requested_formats') or []
+        requested_downloads = video.get('requested_downloads') or []
+        video_format = next(
+            (fmt for fmt in requested_formats if _metadata_value_has_video(fmt.get('vcodec'))),
+            None,
+        )
+        audio_format = next(
+            (
+                fmt for fmt in requested_formats or requested_downloads
+                if _metadata_value_has_video(fmt.get('acodec'))
+            ),
+            None,
+        )
+
+        if requested_formats:
+            has_video = video_format is not None
+        else:
+            has_video = next(
+                (
+                    answer for answer in (_metadata_value_has_video(download.get('vcodec')) for download in requested_downloads)
+                    if answer is not None
+                ),
+                _metadata_value_has_video(video.get('vcodec')),
+            )
+        source = video_format or (requested_downloads[0] if requested_downloads else video)
+        downloaded = requested_downloads[0] if requested_downloads else {}
+        duration = _to_float(video.get('duration'))
+        if downloaded.get('section_end'):
+            # Only a leading window was fetched.
+            duration = downloaded['section_end'] - (downloaded.get('section_start') or 0)
+
+        self._metadata = {
+            'has_video': has_video,
+            'video_codec': normalize_vcodec(source.get('vcodec') or video.get('vcodec')) if has_video else None,
+            'audio_codec': (audio_format or source).get('acodec') or video.get('acodec'),
+            'duration': duration,
+            'width': source.get('width') or video.get('width'),
+            'height': source.get('height') or video.get('height'),
+            'fps': _to_float(source.get('fps') or video.get('fps')),
+            'video_bitrate': (_to_float(source.get('vbr')) or 0) * 1000 or None,
+            'audio_bitrate': (_to_float((audio_format or source).get('abr')) or 0) * 1000 or None,
+        }
+
+    def load(self):
+        """Probe the file unless it has already been probed; re-raises a cached probe failure."""
+        if self.probe is not None:
+            return self
+        if self._probe_error is not None:
+            raise self._probe_error
+        try:
+            self.probe = ffmpeg.probe(self.path)
+        except Exception as exc:
+            self._probe_error = exc
+            raise
+        self._probed = self._fields_from_probe(self.probe)
+        if self.audio_path:
+            try:
+                audio_fields = self._fields_from_probe(ffmpeg.probe(self.audio_path))
+            except Exception as exc:
+                self.probe = None
+                self._probe_error = exc
+                raise
+            for name in ('has_audio', 'audio_codec', 'audio_bitrate'):
+                self._probed[name] = audio_fields[name]
+        return self
+
+    @staticmethod
+    def _fields_from_probe(probe: dict) -> dict:
+        streams = probe.get('streams', [])
+        video_streams = [stream for stream in streams if stream.get('codec_type') == 'video']
+        audio_streams = [stream for stream in streams if stream.get('codec_type') == 'audio']
+        video = video_streams[0] if video_streams else {}
+        audio = audio_streams[0] if audio_streams else {}
+        format_info = probe.get('format', {})
+        return {
+            'has_video': bool(video_streams),
+            'has_audio': bool(audio_streams),
+            'video_codecs': [stream.get('codec_name') for stream in video_streams],
+            'video_codec': video.get('codec_name'),
+            'audio_codec': audio.get('codec_name'),
+            'duration': _to_float(format_info.get('duration')) or _to_float(video.get('duration')),
+            'width': video.get('width'),
+            'height': video.get('height'),
+            'fps': _parse_frame_rate(video.get('avg_frame_rate')) or _parse_frame_rate(video.get('r_frame_rate')),
+            'container': format_info.get('format_name'),
+            'video_bitrate': _to_float(video.get('bit_rate')),
+            'audio_bitrate': _to_float(audio.get('bit_rate')),
+        }
+
+    def _get(self, name):
+        value = self._probed.get(name)
+        return value if value is not None else self._metadata.get(name)
+
+    @property
+    def has_video(self) -> bool | None:
+        return self._get('has_video')
+
+    @property
+    def has_audio(self) -> bool | None:
+        if 'has_audio' in self._probed:
+            return self._probed['has_audio']
+        return _metadata_value_has_video(self._metadata.get('audio_codec'))
+
+    @property
+    def video_codec(self) -> str | None:
+        if self._probed and not self._probed['has_video']:
+            return None
+        return self._get('video_codec')
+
+    @property
+    def video_codecs(self) -> list:
+        codecs = self._probed.get('video_codecs')
+        if codecs is not None:
+            return codecs
+        return [self.video_codec] if self.video_codec else []
+
+    @property
+    def audio_codec(self) -> str | None:
+        return self._get('audio_codec')
+
+    @property
+    def duration(self) -> float | None:
+        return self._get('duration')
+
+    @property
+    def width(self) -> int | None:
+        return self._get('width')
+
+    @property
+    def height(self) -> int | None:
+        return self._get('height')
+
+    @property
+    def fps(self) -> float | None:
+        return self._get('fps')
+
+    @property
+    def container(self) -> str | None:
+        return self._get('container')
+
+    @property
+    def video_bitrate(self) -> float | None:
+        return self._get('video_bitrate')
+
+    @property
+    def audio_bitrate(self) -> float | None:
+        return self._get('audio_bitrate')
+
+    def __repr__(self):
+        return (
+            f"MediaInfo({self.path!r}, video={self.video_codec}, audio={self.audio_codec}, "
+            f"duration={self.duration}, {self.width}x{self.height}, probed={self.probe is not None})"
+        )
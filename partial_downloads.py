@@ -0,0 +1,53 @@
+import glob
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Files an unfinished download leaves next to its target: yt-dlp's .part/.ytdl, and the
+# .part.json resume state written by the TikTok candidate downloader.
+_PARTIAL_SUFFIXES = ('', '.part', '.ytdl', '.part.json')
+
+
+def remove_partial_files(paths):
+    """Delete what an unfinished download left behind: the files themselves, .part/.ytdl and fragments."""
+    for path in paths:
+        candidates = {path + suffix for suffix in _PARTIAL_SUFFIXES}
+        candidates.update(glob.glob(glob.escape(path) + '.part-Frag*'))
+        candidates.update(glob.glob(glob.escape(path) + '-Frag*'))
+        for candidate in candidates:
+            try:
+                if os.path.isfile(candidate):
+                    os.remove(candidate)
+                    logger.info("Removed partial download %s", candidate)
+            except OSError:
+                logger.warning("Failed to remove partial download %s", candidate, exc_info=True)
+
+
+class PartialDownloads:
+    """Partial files one download job keeps between retries, so a retry resumes instead of restarting.
+
+    Download attempts register the files they were writing rather than deleting them when they
+    fail. The job calls `cleanup()` once it has finished, successfully or not, which removes
+    everything registered except the files it kept.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._paths: set[str] = set()
+
+    def add(self, *paths):
+        with self._lock:
+            self._paths.update(os.path.abspath(path) for path in paths if path)
+
+    @property
+    def paths(self) -> list[str]:
+        with self._lock:
+            return sorted(self._paths)
+
+    def cleanup(self, keep=()):
+        keep = {os.path.abspath(path) for path in keep if path}
+        with self._lock:
+            paths, self._paths = self._paths, set()
+        remove_partial_files(path for path in paths if path not in keep)
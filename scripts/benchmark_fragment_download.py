@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Benchmark fragment-parallel HLS downloads against a local fixture server.
+
+The fixture serves a media playlist of equal-sized fragments and delays each response by a
+fixed latency, the way a distant CDN does. The same download runs once per concurrency level
+with the options the bot gives yt-dlp, and the wall-clock time and throughput are reported.
+"""
+import argparse
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import yt_dlp  # noqa: E402
+
+from downloader import _create_ydl_opts  # noqa: E402
+from fragment_downloads import get_fragment_ydl_opts  # noqa: E402
+
+
+def start_hls_fixture(fragments, fragment_bytes, latency):
+    """Serve /stream.m3u8 with `fragments` fragments, each answered after `latency` seconds."""
+    playlist = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for index in range(fragments):
+        playlist += ["#EXTINF:2.0,", f"fragment{index}.ts"]
+    playlist.append("#EXT-X-ENDLIST")
+    playlist_body = ("\n".join(playlist) + "\n").encode()
+    # 0x47 is the MPEG-TS sync byte, so each fragment looks like a run of TS packets.
+    fragment_body = b"\x47" + b"\x00" * (fragment_bytes - 1)
+    stats = {"in_flight": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *_args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                stats["in_flight"] += 1
+                stats["peak"] = max(stats["peak"], stats["in_flight"])
+            try:
+                time.sleep(latency)
+                if self.path.endswith(".m3u8"):
+                    body, content_type = playlist_body, "application/vnd.apple.mpegurl"
+                else:
+                    body, content_type = fragment_body, "video/mp2t"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            finally:
+                with lock:
+                    stats["in_flight"] -= 1
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/stream.m3u8", stats
+
+
+def download(url, platform, concurrency, work_dir):
+    opts = _create_ydl_opts("best")
+    opts.update(get_fragment_ydl_opts(platform, concurrency))
+    opts.update({"paths": {"home": work_dir}, "fixup": "never"})
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.download([url])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fragments", type=int, default=60)
+    parser.add_argument("--fragment-kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds added to every response")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--platform", default="twitch", help="platform whose chunking defaults to use")
+    args = parser.parse_args()
+
+    server, url, stats = start_hls_fixture(args.fragments, args.fragment_kb * 1024, args.latency)
+    total_mb = args.fragments * args.fragment_kb / 1024
+    print(f"{args.fragments} fragments of {args.fragment_kb}KB ({total_mb:.1f}MB) at {args.latency * 1000:.0f}ms latency")
+    baseline = None
+    try:
+        for concurrency in args.concurrency:
+            stats["peak"] = 0
+            with tempfile.TemporaryDirectory() as work_dir:
+                started = time.perf_counter()
+                download(url, args.platform, concurrency, work_dir)
+                elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            print(
+                f"  concurrency {concurrency:<3} {elapsed:6.2f}s  {total_mb / elapsed:6.1f}MB/s  "
+                f"peak {stats['peak']} connection(s)  speedup {baseline / elapsed:.2f}x"
+            )
+    finally:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
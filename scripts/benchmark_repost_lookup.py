@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Benchmark repost lookups on a seeded posts table, before and after adding the lookup index.
+
+Rows are seeded into a scratch table (posts_benchmark by default), never into the live posts table.
+Postgres uses the DB_* settings from .env; pass --backend sqlite to run without a database server.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from dbInteraction import PostgresPostStore, SqlitePostStore  # noqa: E402
+
+PLATFORMS = ["tiktok", "youtube", "instagram", "reddit", "MattIsLazy"]
+CREATE_TABLE_SQL = """
+CREATE TABLE {table}
+(
+    "postId" bigint NOT NULL GENERATED ALWAYS AS IDENTITY,
+    "userId" character varying(50),
+    "videoId" character varying(50),
+    platform character varying(50),
+    "postDateTime" timestamp without time zone,
+    "discordMessageId" character varying(50),
+    CONSTRAINT {table}_post_id PRIMARY KEY ("postId")
+)
+"""
+
+
+def _get_postgres_dsn():
+    return (
+        f"host={os.getenv('DB_HOST')} dbname={os.getenv('DB_NAME')} "
+        f"user={os.getenv('DB_USER')} password={os.getenv('DB_PASS')}"
+    )
+
+
+def _seed_postgres(table, rows):
+    import psycopg2
+
+    conn = psycopg2.connect(_get_postgres_dsn())
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+        cur.execute(CREATE_TABLE_SQL.format(table=table))
+        cur.execute(
+            f"INSERT INTO {table} (\"userId\", \"videoId\", platform, \"postDateTime\", \"discordMessageId\") "
+            "SELECT 'user' || (n %% 500), 'video' || n, (%s::text[])[1 + n %% 5], "
+            "now() - n * interval '1 second', n::text FROM generate_series(1, %s) AS n",
+            (PLATFORMS, rows),
+        )
+        cur.execute(f"ANALYZE {table}")
+    return conn
+
+
+def _index_postgres(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE INDEX {table}_video_platform_post_idx "
+            f"ON {table} USING btree (\"videoId\", platform, \"postId\" DESC)"
+        )
+        cur.execute(f"ANALYZE {table}")
+
+
+def _seed_sqlite(store, rows):
+    started = datetime.now()
+    conn = store._get_connection()
+    conn.executemany(
+        f"INSERT INTO {store._table} (\"userId\", \"videoId\", \"platform\", \"postDateTime\", \"discordMessageId\") "
+        "VALUES (?, ?, ?, ?, ?)",
+        (
+            (f"user{n % 500}", f"video{n}", PLATFORMS[n % 5], (started - timedelta(seconds=n)).isoformat(), str(n))
+            for n in range(1, rows + 1)
+        ),
+    )
+    conn.commit()
+
+
+def _measure(store, rows, lookups):
+    rng = random.Random(1234)
+    timings = []
+    for _ in range(lookups):
+        # Half the lookups hit existing videos, half miss (the common case for new links).
+        video_number = rng.randint(1, rows) if rng.random() < 0.5 else rows + rng.randint(1, rows)
+        platforms = [rng.choice(PLATFORMS[:4]), "MattIsLazy"]
+        started = time.perf_counter()
+        store.find_latest_post(f"video{video_number}", platforms)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "mean": statistics.fmean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95)],
+        "p99": timings[int(len(timings) * 0.99)],
+    }
+
+
+def _report(label, result):
+    print(
+        f"{label:<14} mean={result['mean']:.3f}ms p50={result['p50']:.3f}ms "
+        f"p95={result['p95']:.3f}ms p99={result['p99']:.3f}ms"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backend", choices=("postgres", "sqlite"), default="postgres")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--unindexed-lookups", type=int, default=50,
+                        help="lookups to time without the index (each one is a full table scan)")
+    parser.add_argument("--table", default="posts_benchmark")
+    args = parser.parse_args()
+
+    print(f"Seeding {args.rows} rows into {args.table} ({args.backend})...")
+    started = time.perf_counter()
+    if args.backend == "postgres":
+        conn = _seed_postgres(args.table, args.rows)
+        store = PostgresPostStore(_get_postgres_dsn(), 1, table=args.table)
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), "benchmark.sqlite3")
+        store = SqlitePostStore(db_path, table=args.table, create_index=False)
+        _seed_sqlite(store, args.rows)
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    try:
+        _report("without index", _measure(store, args.rows, args.unindexed_lookups))
+        if args.backend == "postgres":
+            _index_postgres(conn, args.table)
+        else:
+            store.create_lookup_index()
+        _report("with index", _measure(store, args.rows, args.lookups))
+    finally:
+        if args.backend == "postgres":
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {args.table}")
+            conn.close()
+        else:
+            os.remove(db_path)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
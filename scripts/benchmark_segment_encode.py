@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Benchmark the segment-parallel encode against the single-process libx265 encode.
+
+Pass local sample files to encode; with no arguments a 3-minute 1080p test pattern is generated
+with ffmpeg's lavfi sources. Each file is encoded with the same settings the bot uses and the
+wall-clock time, output size and duration are reported for both paths.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import ffmpeg  # noqa: E402
+
+from calculator import calculateBitrate, get_file_size_limit  # noqa: E402
+from ffmpeg_runner import run_ffmpeg  # noqa: E402
+from media_info import MediaInfo  # noqa: E402
+from segment_encode import encode_segmented, get_segment_count  # noqa: E402
+from transcode_settings import get_ffmpeg_thread_count, get_transcode_output_kwargs  # noqa: E402
+
+
+def _generate_sample(path, duration):
+    video = ffmpeg.input(f"testsrc2=size=1920x1080:rate=30:duration={duration}", f='lavfi')
+    audio = ffmpeg.input(f"sine=frequency=440:duration={duration}", f='lavfi')
+    ffmpeg.output(video, audio, path, **{'c:v': 'libx264', 'preset': 'veryfast', 'c:a': 'aac'}).run(
+        overwrite_output=True, quiet=True
+    )
+
+
+def _encode_single(input_file, output_file, output_kwargs):
+    """The bot's single-process encode, without importing main (and its Discord client)."""
+    stream = ffmpeg.output(ffmpeg.input(input_file), output_file, **output_kwargs)
+    stderr = run_ffmpeg(stream, expected_duration=output_kwargs.get('t'))
+    return MediaInfo.from_encoder_output(output_file, output_kwargs, stderr)
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    output_info = func(*args)
+    return time.perf_counter() - started, output_info
+
+
+def _report(label, elapsed, output_file, output_info):
+    size_mb = os.path.getsize(output_file) / 1_000_000
+    duration = output_info.duration if output_info else 0
+    print(f"  {label:<22} {elapsed:7.1f}s  {size_mb:5.2f}MB  {duration or 0:6.1f}s of video")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", help="sample videos to encode")
+    parser.add_argument("--segments", type=int, default=None,
+                        help="segments to use (default: as TIKBOT_SEGMENT_ENCODE_SEGMENTS=auto would)")
+    parser.add_argument("--sample-duration", type=int, default=180)
+    args = parser.parse_args()
+    os.environ.setdefault("TIKBOT_SEGMENT_ENCODE_SEGMENTS", "auto")
+
+    threads = get_ffmpeg_thread_count()
+    with tempfile.TemporaryDirectory() as work_dir:
+        files = args.files
+        if not files:
+            sample = os.path.join(work_dir, "sample.mp4")
+            print(f"Generating a {args.sample_duration}s test pattern...")
+            _generate_sample(sample, args.sample_duration)
+            files = [sample]
+
+        for input_file in files:
+            media_info = MediaInfo(input_file).load()
+            calc_result = calculateBitrate(media_info.duration or 0)
+            output_kwargs = get_transcode_output_kwargs(calc_result, get_file_size_limit())
+            encode_duration = calc_result.maxDuration or media_info.duration
+            segments = args.segments or get_segment_count(encode_duration, threads)
+            print(f"{input_file}: {encode_duration:.0f}s at {calc_result.videoBitrate}k, {threads} threads")
+
+            single_output = os.path.join(work_dir, "single.mp4")
+            single_elapsed, single_info = _timed(_encode_single, input_file, single_output, output_kwargs)
+            _report("single process", single_elapsed, single_output, single_info)
+
+            if segments < 2:
+                print("  segmented encode skipped (clip too short or too few threads; try --segments)")
+                continue
+            segmented_output = os.path.join(work_dir, "segmented.mp4")
+            segmented_elapsed, segmented_info = _timed(
+                encode_segmented,
+                input_file,
+                segmented_output,
+                output_kwargs,
+                encode_duration,
+                segments,
+                threads,
+                media_info.has_audio is not False,
+            )
+            _report(f"{segments} segments", segmented_elapsed, segmented_output, segmented_info)
+            print(f"  speedup {single_elapsed / segmented_elapsed:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,170 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+from ffmpeg_runner import get_transcode_stall_timeout, get_transcode_timeout, run_ffmpeg
+from media_info import MediaInfo
+
+logger = logging.getLogger(__name__)
+
+# Output options that belong to the final mux rather than to each video segment.
+_MUX_ONLY_KWARGS = ('c:a', 'b:a', 't', 'fs', 'movflags', 'f')
+# Shorter segments spend too much of their budget on the opening keyframe.
+MIN_SEGMENT_SECONDS = 20
+
+
+class SegmentEncodeError(Exception):
+    pass
+
+
+def get_segment_encode_min_duration():
+    try:
+        return max(0.0, float(os.getenv('TIKBOT_SEGMENT_ENCODE_MIN_DURATION', '60')))
+    except ValueError:
+        return 60.0
+
+
+def get_segment_count(duration, ffmpeg_threads):
+    """How many segments to encode `duration` seconds in, or 1 for a single-process encode.
+
+    Off unless TIKBOT_SEGMENT_ENCODE_SEGMENTS is set: to a number of segments, or to "auto" for
+    one x265 process per two threads (capped at 8); at 480p/720p x265 keeps about two threads
+    busy, so more processes beat more threads.
+    """
+    configured = os.getenv('TIKBOT_SEGMENT_ENCODE_SEGMENTS', '1').strip().lower()
+    if configured == 'auto':
+        segments = min(8, max(1, ffmpeg_threads // 2))
+    else:
+        try:
+            segments = int(configured)
+        except ValueError:
+            segments = 1
+    if not duration or duration < get_segment_encode_min_duration():
+        return 1
+    return max(1, min(segments, int(duration // MIN_SEGMENT_SECONDS)))
+
+
+def plan_segments(duration, segments):
+    """Split [0, duration) into equal (start, length) pieces."""
+    length = duration / segments
+    return [(index * length, duration - index * length if index == segments - 1 else length) for index in range(segments)]
+
+
+def _get_segment_kwargs(output_kwargs, threads):
+    segment_kwargs = {key: value for key, value in output_kwargs.items() if key not in _MUX_ONLY_KWARGS}
+    segment_kwargs['threads'] = str(threads)
+    if 'x265-params' in segment_kwargs:
+        segment_kwargs['x265-params'] = f"pools={threads}"
+    return segment_kwargs
+
+
+def encode_segmented(
+    input_file,
+    output_file,
+    output_kwargs,
+    duration,
+    segments,
+    threads,
+    has_audio=True,
+    on_progress=None,
+    cancelled=None,
+    audio_file=None,
+):
+    """Encode the first `duration` seconds of a video as `segments` parallel ffmpeg processes.
+
+    Each segment is cut at its exact start time and encoded on its own, so it opens with a
+    keyframe and the video can be joined with the concat demuxer without re-encoding. Every
+    segment gets the same bitrate/maxrate/bufsize budget as the single-process encode. Audio
+    is encoded once over the whole duration (per-segment AAC would click at the joins).
+
+    Every ffmpeg run gets the whole job's wall-clock limit. If one of them fails, the others are
+    killed. `on_progress` gets the combined progress of the video segments.
+
+    `audio_file` is read for the audio instead of `input_file` when the streams were downloaded apart.
+
+    Raises SegmentEncodeError if the joined file is bigger than output_kwargs['fs'].
+    """
+    failed = threading.Event()
+    progress_lock = threading.Lock()
+    encoded = {}
+    timeout = get_transcode_timeout(duration)
+    stall_timeout = get_transcode_stall_timeout()
+
+    def is_cancelled():
+        return failed.is_set() or (cancelled is not None and cancelled())
+
+    def run(stream, index=None):
+        def segment_progress(progress):
+            if on_progress is None or index is None or progress['out_time'] is None:
+                return
+            with progress_lock:
+                encoded[index] = progress['out_time']
+                out_time = sum(encoded.values())
+            # Segments run side by side, so the overall speed is their combined speed.
+            on_progress({**progress, 'out_time': out_time, 'percent': min(100.0, 100.0 * out_time / duration)})
+
+        try:
+            return run_ffmpeg(
+                stream,
+                timeout=timeout,
+                stall_timeout=stall_timeout,
+                on_progress=segment_progress,
+                cancelled=is_cancelled,
+            )
+        except Exception:
+            failed.set()
+            raise
+
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        threads_per_segment = max(1, threads // segments)
+        segment_kwargs = _get_segment_kwargs(output_kwargs, threads_per_segment)
+        jobs = []
+        segment_files = []
+        for index, (start, length) in enumerate(plan_segments(duration, segments)):
+            segment_file = os.path.join(work_dir, f"segment_{index:03d}.mp4")
+            segment_files.append(segment_file)
+            jobs.append((ffmpeg.input(input_file, ss=start, t=length).output(segment_file, an=None, f='mp4', **segment_kwargs), index))
+
+        encoded_audio_file = None
+        if has_audio:
+            encoded_audio_file = os.path.join(work_dir, "audio.m4a")
+            audio_kwargs = {key: output_kwargs[key] for key in ('c:a', 'b:a') if key in output_kwargs}
+            audio_input = ffmpeg.input(audio_file or input_file, t=duration)['a:0']
+            jobs.append((audio_input.output(encoded_audio_file, vn=None, f='mp4', **audio_kwargs), None))
+
+        logger.info(
+            "Encoding %s in %s segments of %.1fs (%s thread(s) each)",
+            input_file,
+            segments,
+            duration / segments,
+            threads_per_segment,
+        )
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="tikbot-segment") as executor:
+            for future in [executor.submit(run, job, index) for job, index in jobs]:
+                future.result()
+
+        concat_list = os.path.join(work_dir, "segments.txt")
+        with open(concat_list, "w") as fp:
+            fp.writelines(f"file '{segment_file}'\n" for segment_file in segment_files)
+
+        streams = [ffmpeg.input(concat_list, f='concat', safe=0)['v']]
+        if encoded_audio_file:
+            streams.append(ffmpeg.input(encoded_audio_file)['a'])
+        mux_kwargs = {'c': 'copy', 'movflags': output_kwargs.get('movflags', '+faststart'), 'f': 'mp4'}
+        if 'tag:v' in output_kwargs:
+            mux_kwargs['tag:v'] = output_kwargs['tag:v']
+        stderr = run(ffmpeg.output(*streams, output_file, **mux_kwargs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    size_limit = output_kwargs.get('fs')
+    output_size = os.path.getsize(output_file)
+    if size_limit and output_size > size_limit:
+        raise SegmentEncodeError(f"Segmented encode produced {output_size} bytes, over the {size_limit} byte limit")
+    return MediaInfo.from_encoder_output(output_file, output_kwargs, stderr)
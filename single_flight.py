@@ -0,0 +1,49 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent async calls that share a key into a single execution."""
+
+    def __init__(self):
+        self._flights: dict[str, asyncio.Future] = {}
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: str, func):
+        """Run `func()` unless a call for `key` is already in flight.
+
+        Returns `(result, is_leader)`. Followers receive the leader's result, or None if the
+        leader raised; the leader's exception is only re-raised to the leader. If the leader is
+        cancelled, a waiting follower takes over and runs its own `func()`.
+        """
+        while True:
+            existing = self._flights.get(key)
+            if existing is None:
+                break
+            logger.info("Coalescing duplicate request for %s with the in-flight one", key)
+            try:
+                return await asyncio.shield(existing), False
+            except asyncio.CancelledError:
+                if not existing.cancelled():
+                    raise
+                logger.info("In-flight request for %s was cancelled; taking over", key)
+
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException:
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            self._flights.pop(key, None)
+        return result, True
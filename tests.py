@@ -78,19 +78,26 @@ class TestUrlParser(unittest.TestCase):
 
 IS_GITHUB_ACTIONS = os.getenv("GITHUB_ACTIONS") == "true"
 PLAYWRIGHT_TEST_ENABLED = os.getenv("TIKBOT_ENABLE_PLAYWRIGHT_TEST") == "1"
+POSTGRES_TEST_DSN = os.getenv("TIKBOT_TEST_POSTGRES_DSN")
 
 
 class DownloaderTestCase(unittest.TestCase):
 
     def setUp(self):
         super().setUp()
-        self._does_post_exist_patcher = mock.patch(
-            'downloader.doesPostExist', autospec=True, return_value=None
+        self._find_latest_post_patcher = mock.patch(
+            'downloader.findLatestPost', autospec=True, return_value=None
         )
-        self.mock_does_post_exist = self._does_post_exist_patcher.start()
+        self.mock_find_latest_post = self._find_latest_post_patcher.start()
+        # Run yt-dlp in-process so mocks apply; TestYtdlpWorker covers the worker processes.
+        self._env_patcher = mock.patch.dict(os.environ, {"TIKBOT_YTDLP_WORKERS": "0"})
+        self._env_patcher.start()
+        downloader_module._video_id_cache.clear()
+        tiktok_fallback_module._short_url_cache.clear()
 
     def tearDown(self):
-        self._does_post_exist_patcher.stop()
+        self._env_patcher.stop()
+        self._find_latest_post_patcher.stop()
         super().tearDown()
 
 
@@ -122,6 +129,13 @@ class _FakeMessage:
         self.content = content
 
 
+def _run_blocking_download(blocking_download):
+    """Fake download_with_retries_async that runs a blocking fake on the caller's runner."""
+    async def fake_download(*args, run_blocking=None, run_io=None, **kwargs):
+        return await run_blocking(blocking_download, *args, **kwargs)
+    return fake_download
+
+
 class TestMessageHandling(unittest.TestCase):
 
     def test_handleMessage_uses_repost_bypass_emoji(self):
@@ -140,15 +154,18 @@ class TestMessageHandling(unittest.TestCase):
 
         with mock.patch("main.extractUrl", return_value={"url": "https://www.tiktok.com/@test/video/123", "messages": ""}):
             with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
-                with mock.patch("main.download_with_retries", return_value=download_response) as mock_download:
+                with mock.patch("main.download_with_retries_async", return_value=download_response) as mock_download:
                     with mock.patch("main.process_video", new=mock.AsyncMock()) as mock_process_video:
                         asyncio.run(handleMessage(message))
 
-        mock_download.assert_called_once_with(
+        mock_download.assert_awaited_once_with(
             "https://www.tiktok.com/@test/video/123",
             retries=4,
             on_retry=mock.ANY,
             detect_repost=False,
+            run_blocking=mock.ANY,
+            size_limit=8_000_000,
+            run_io=mock.ANY,
         )
         mock_process_video.assert_awaited_once()
 
@@ -173,12 +190,12 @@ class TestMessageHandling(unittest.TestCase):
 
         with mock.patch("main.extractUrl", return_value={"url": "https://www.tiktok.com/@test/video/123", "messages": ""}):
             with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
-                with mock.patch("main.download_with_retries", side_effect=fake_download_with_retries):
+                with mock.patch("main.download_with_retries_async", side_effect=_run_blocking_download(fake_download_with_retries)):
                     with mock.patch("main.process_video", new=mock.AsyncMock()):
                         asyncio.run(handleMessage(message))
 
         self.assertTrue(
-            any(name.startswith("tikbot-blocking") for name in download_thread_names),
+            any(name.startswith("tikbot-download") for name in download_thread_names),
             f"Expected download to run in a worker thread, got {download_thread_names}",
         )
 
@@ -203,7 +220,7 @@ class TestMessageHandling(unittest.TestCase):
         async def run_scenario():
             with mock.patch("main.extractUrl", return_value={"url": "https://www.tiktok.com/@test/video/123", "messages": ""}):
                 with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
-                    with mock.patch("main.download_with_retries", side_effect=fake_download_with_retries):
+                    with mock.patch("main.download_with_retries_async", side_effect=_run_blocking_download(fake_download_with_retries)):
                         with mock.patch("main.process_video", new=mock.AsyncMock()):
                             task = asyncio.create_task(handleMessage(message))
                             started = time.perf_counter()
@@ -215,6 +232,195 @@ class TestMessageHandling(unittest.TestCase):
 
         asyncio.run(run_scenario())
 
+    def test_worker_lane_reports_queue_depth_and_in_flight_jobs(self):
+        from worker_pools import WorkerLane
+
+        lane = WorkerLane("test", 1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_job():
+            started.set()
+            release.wait(5)
+            return "done"
+
+        async def run_scenario():
+            first = asyncio.create_task(lane.run(blocking_job))
+            second = asyncio.create_task(lane.run(lambda: "second"))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            stats = lane.stats()
+            release.set()
+            return stats, await first, await second
+
+        stats, first_result, second_result = asyncio.run(run_scenario())
+
+        self.assertEqual(stats, {"name": "test", "maxWorkers": 1, "queued": 1, "running": 1})
+        self.assertEqual((first_result, second_result), ("done", "second"))
+        self.assertEqual(lane.stats()["queued"], 0)
+        self.assertEqual(lane.stats()["running"], 0)
+
+    def test_transcode_runs_on_transcode_lane(self):
+        import main
+
+        message = _FakeMessage()
+        transcode_thread_names = []
+
+        def fake_transcode(_input_file, compressed_filename, output_kwargs, **_kwargs):
+            transcode_thread_names.append(threading.current_thread().name)
+            self.assertIn("threads", output_kwargs)
+            with open(compressed_filename, "wb") as fp:
+                fp.write(b"compressed")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "video.mp4")
+            with open(input_file, "wb") as fp:
+                fp.write(b"source")
+            with mock.patch("main._transcode_video", side_effect=fake_transcode):
+                with mock.patch("main.ffmpeg.probe", return_value={"format": {"duration": "10"}, "streams": []}, create=True):
+                    with mock.patch("main.savePost", autospec=True, return_value=None):
+                        asyncio.run(
+                            main.send_compressed_video(
+                                message, input_file, 10, 8_000_000, {"videoId": "1", "platform": "tiktok"}, False
+                            )
+                        )
+
+        self.assertEqual(len(transcode_thread_names), 1)
+        self.assertTrue(transcode_thread_names[0].startswith("tikbot-transcode"))
+
+    def test_single_flight_shares_leader_result(self):
+        from single_flight import SingleFlight
+
+        flights = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def run_scenario():
+            return await asyncio.gather(flights.run("key", work), flights.run("key", work))
+
+        results = asyncio.run(run_scenario())
+
+        self.assertEqual(results, [("result", True), ("result", False)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_handleMessage_coalesces_concurrent_duplicate_links(self):
+        from main import handleMessage
+
+        first = _FakeMessage("https://www.tiktok.com/@test/video/123")
+        second = _FakeMessage("https://www.tiktok.com/@test/video/123?lang=en")
+        download_response = {
+            'fileName': '',
+            'duration': 10,
+            'messages': '',
+            'videoId': '123',
+            'platform': 'tiktok',
+            'repost': False,
+            'repostOriginalMesssageId': '',
+        }
+
+        def fake_download_with_retries(*_args, **_kwargs):
+            time.sleep(0.1)
+            return download_response
+
+        async def run_scenario():
+            with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
+                with mock.patch("main.download_with_retries_async", side_effect=_run_blocking_download(fake_download_with_retries)) as mock_download:
+                    with mock.patch("main.process_video", new=mock.AsyncMock(return_value={"fileName": "123.mp4"})):
+                        await asyncio.gather(handleMessage(first), handleMessage(second))
+            return mock_download
+
+        mock_download = asyncio.run(run_scenario())
+
+        mock_download.assert_called_once()
+        repost_replies = [item["content"] for item in second.channel.sent if item["content"]]
+        self.assertTrue(any(text.startswith("This is a repost!") for text in repost_replies), repost_replies)
+
+    def test_handleMessage_coalesces_a_short_link_with_the_full_link(self):
+        from main import handleMessage
+
+        for cache in (tiktok_fallback_module._short_url_cache, downloader_module._video_id_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        first = _FakeMessage("https://www.tiktok.com/@test/video/123")
+        second = _FakeMessage("https://vt.tiktok.com/ZSCDC8bDV/")
+        download_response = {
+            'fileName': '',
+            'duration': 10,
+            'messages': '',
+            'videoId': '123',
+            'platform': 'tiktok',
+            'repost': False,
+            'repostOriginalMesssageId': '',
+        }
+
+        def fake_download_with_retries(*_args, **_kwargs):
+            time.sleep(0.1)
+            return download_response
+
+        async def run_scenario():
+            with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
+                with mock.patch("main.download_with_retries_async", side_effect=_run_blocking_download(fake_download_with_retries)) as mock_download:
+                    with mock.patch("main.process_video", new=mock.AsyncMock(return_value={"fileName": "123.mp4"})):
+                        await asyncio.gather(handleMessage(first), handleMessage(second))
+            return mock_download
+
+        with mock.patch(
+            "tiktok_embed_fallback._fetch_tiktok_short_url", return_value="https://www.tiktok.com/@test/video/123"
+        ) as mock_fetch:
+            mock_download = asyncio.run(run_scenario())
+
+        # Both links are for video 123, so they share one download rather than racing for 123.mp4.
+        mock_download.assert_called_once()
+        mock_fetch.assert_called_once()
+
+    def test_single_flight_follower_takes_over_cancelled_leader(self):
+        from single_flight import SingleFlight
+
+        flights = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def fast():
+            return "follower"
+
+        async def run_scenario():
+            leader = asyncio.create_task(flights.run("key", slow))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(flights.run("key", fast))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(asyncio.run(run_scenario()), ("follower", True))
+        self.assertEqual(flights.in_flight(), 0)
+
+    def test_deleting_message_cancels_its_download(self):
+        import main
+        from types import SimpleNamespace
+
+        message = _FakeMessage("https://www.tiktok.com/@test/video/123")
+
+        async def slow_download(*_args, **_kwargs):
+            await asyncio.sleep(10)
+
+        async def run_scenario():
+            with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
+                with mock.patch("main.download_with_retries_async", side_effect=slow_download):
+                    task = asyncio.create_task(main.handleMessage(message))
+                    await asyncio.sleep(0.05)
+                    self.assertIn(message.id, main.active_jobs)
+                    await main.on_raw_message_delete(SimpleNamespace(message_id=message.id))
+                    with self.assertRaises(asyncio.CancelledError):
+                        await task
+
+        asyncio.run(run_scenario())
+        self.assertNotIn(message.id, main.active_jobs)
+
     def test_compressed_filename_uses_download_directory(self):
         from main import get_cleanup_file_candidates, get_compressed_filename
 
@@ -251,6 +457,363 @@ class TestMessageHandling(unittest.TestCase):
         sent_text = [item["content"] for item in message.channel.sent if item["content"]]
         self.assertTrue(any("did not contain a video stream" in text for text in sent_text))
 
+    def test_stream_copy_plan_prefers_remux_then_audio_then_trim(self):
+        from main import get_stream_copy_plan
+        from media_info import MediaInfo
+
+        def probe(container, video_codec, video_kbps, audio_codec, audio_kbps, duration):
+            mediaInfo = MediaInfo("video")
+            with mock.patch("media_info.ffmpeg.probe", return_value={
+                "format": {"format_name": container, "duration": str(duration)},
+                "streams": [
+                    {"codec_type": "video", "codec_name": video_codec, "bit_rate": str(video_kbps * 1000)},
+                    {"codec_type": "audio", "codec_name": audio_codec, "bit_rate": str(audio_kbps * 1000)},
+                ],
+            }):
+                return mediaInfo.load()
+
+        remux = get_stream_copy_plan(probe("matroska,webm", "h264", 500, "aac", 128, 60), 5_000_000, 8_000_000, 60)
+        self.assertEqual(remux["mode"], "remux")
+        self.assertEqual(remux["output_kwargs"]["c:v"], "copy")
+        self.assertEqual(remux["output_kwargs"]["c:a"], "copy")
+
+        # 60s of 600kbps video is 4.5MB; a 1.4Mbps FLAC track pushes it over.
+        audio = get_stream_copy_plan(probe("mov,mp4,m4a", "hevc", 600, "flac", 1400, 60), 15_000_000, 8_000_000, 60)
+        self.assertEqual(audio["mode"], "audio")
+        self.assertEqual(audio["output_kwargs"]["c:a"], "aac")
+        self.assertEqual(audio["output_kwargs"]["b:a"], "128k")
+        self.assertEqual(audio["output_kwargs"]["tag:v"], "hvc1")
+
+        # Ten minutes at 300kbps: the encode would keep 181s, and so does a copy-trim.
+        trim = get_stream_copy_plan(probe("mov,mp4,m4a", "h264", 250, "aac", 50, 600), 22_500_000, 8_000_000, 600)
+        self.assertEqual(trim["mode"], "trim")
+        self.assertEqual(trim["output_kwargs"]["t"], 181)
+
+        # Too dense to copy: the full encode is needed.
+        self.assertIsNone(get_stream_copy_plan(probe("mov,mp4,m4a", "h264", 4000, "aac", 128, 60), 31_000_000, 8_000_000, 60))
+        self.assertIsNone(get_stream_copy_plan(probe("matroska,webm", "vp9", 500, "opus", 128, 60), 5_000_000, 8_000_000, 60))
+
+    def test_process_video_posts_stream_copy_without_full_encode(self):
+        import main
+
+        message = _FakeMessage()
+        probe = {
+            "format": {"format_name": "matroska,webm", "duration": "10"},
+            "streams": [{"codec_type": "video", "codec_name": "h264"}, {"codec_type": "audio", "codec_name": "aac"}],
+        }
+
+        def fake_transcode(_input_file, compressed_filename, output_kwargs, **_kwargs):
+            self.assertEqual(output_kwargs["c:v"], "copy")
+            with open(compressed_filename, "wb") as fp:
+                fp.write(b"remuxed")
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "video.mkv")
+            with open(input_file, "wb") as fp:
+                fp.write(b"source")
+            with mock.patch("main.ffmpeg.probe", return_value=probe, create=True):
+                with mock.patch("main._transcode_video", side_effect=fake_transcode):
+                    with mock.patch("main.send_compressed_video", new=mock.AsyncMock()) as mock_compress:
+                        with mock.patch("main.savePost", autospec=True, return_value=None):
+                            sentMedia = asyncio.run(
+                                main.process_video(message, input_file, 10, 8_000_000, {"videoId": "1", "platform": "reddit"})
+                            )
+
+        mock_compress.assert_not_awaited()
+        self.assertEqual(os.path.basename(sentMedia["fileName"]), "small_video.mp4")
+        self.assertEqual(sentMedia["videoCodec"], "h264")
+
+    def test_process_video_probes_once_and_reads_output_from_encoder(self):
+        import main
+        from media_info import MediaInfo
+
+        message = _FakeMessage()
+        probe = {
+            "format": {"format_name": "matroska,webm", "duration": "300"},
+            "streams": [{"codec_type": "video", "codec_name": "vp9"}, {"codec_type": "audio", "codec_name": "opus"}],
+        }
+        encoder_stderr = b"frame= 10 size=  100kB time=00:01:00.00 bitrate=1.0kbits/s\rframe= 20 size=  900kB time=00:03:01.00 bitrate=1.0kbits/s\n"
+
+        def fake_run(stream_spec, **kwargs):
+            self.assertEqual(kwargs["expected_duration"], 181)
+            with open(stream_spec.node.kwargs["filename"], "wb") as fp:
+                fp.write(b"compressed")
+            return encoder_stderr
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "video.webm")
+            with open(input_file, "wb") as fp:
+                fp.write(b"source")
+            mediaInfo = MediaInfo.from_ytdlp(input_file, {"vcodec": "vp9", "acodec": "opus", "duration": 300})
+            download_response = {"videoId": "1", "platform": "youtube", "mediaInfo": mediaInfo}
+            with mock.patch.dict(os.environ, {"TIKBOT_SEGMENT_ENCODE_SEGMENTS": "1", "TIKBOT_ENCODE_TARGET_SECONDS": "0"}), \
+                    mock.patch("media_info.ffmpeg.probe", return_value=probe) as mock_probe:
+                with mock.patch("main.run_ffmpeg", side_effect=fake_run):
+                    with mock.patch("main.savePost", autospec=True, return_value=None):
+                        sentMedia = asyncio.run(main.process_video(message, input_file, 300, 8_000_000, download_response))
+
+        mock_probe.assert_called_once_with(input_file)
+        self.assertEqual(sentMedia["duration"], 181)
+        self.assertEqual(sentMedia["videoCodec"], "hevc")
+        sent_text = [item["content"] for item in message.channel.sent if item["content"]]
+        self.assertTrue(any("truncated from 300.0s to 181.0s" in text for text in sent_text))
+
+    def test_process_video_maps_split_streams_into_one_encode(self):
+        import ffmpeg
+        import main
+        from media_info import MediaInfo
+
+        message = _FakeMessage()
+        probes = {
+            "video.mp4": {
+                "format": {"format_name": "mov,mp4,m4a", "duration": "20"},
+                "streams": [{"codec_type": "video", "codec_name": "vp9"}],
+            },
+            "audio.m4a": {"format": {"format_name": "mov,mp4,m4a"}, "streams": [{"codec_type": "audio", "codec_name": "aac"}]},
+        }
+        encodes = []
+
+        def fake_run(stream_spec, **_kwargs):
+            args = ffmpeg.compile(stream_spec)
+            encodes.append(args)
+            with open(args[-1], "wb") as fp:
+                fp.write(b"compressed")
+            return b""
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            video_file = os.path.join(tmpdir, "video.mp4")
+            audio_file = os.path.join(tmpdir, "audio.m4a")
+            for path in (video_file, audio_file):
+                with open(path, "wb") as fp:
+                    fp.write(b"source")
+            download_response = {
+                "videoId": "1",
+                "platform": "reddit",
+                "audioFileName": audio_file,
+                "mediaInfo": MediaInfo(video_file, audio_file),
+            }
+            with mock.patch.dict(os.environ, {"TIKBOT_SEGMENT_ENCODE_SEGMENTS": "1", "TIKBOT_ENCODE_TARGET_SECONDS": "0"}), \
+                    mock.patch("media_info.ffmpeg.probe", side_effect=lambda path: probes[os.path.basename(path)]):
+                with mock.patch("main.run_ffmpeg", side_effect=fake_run):
+                    with mock.patch("main.savePost", autospec=True, return_value=None):
+                        sentMedia = asyncio.run(main.process_video(message, video_file, 20, 8_000_000, download_response))
+
+            self.assertEqual(len(encodes), 1)
+            args = encodes[0]
+            self.assertEqual([args[i + 1] for i, arg in enumerate(args) if arg == "-i"], [video_file, audio_file])
+            self.assertEqual([args[i + 1] for i, arg in enumerate(args) if arg == "-map"], ["0:v:0", "1:a:0"])
+            self.assertEqual(sentMedia["videoCodec"], "hevc")
+            self.assertIn(audio_file, main.get_cleanup_file_candidates(video_file, audio_file))
+
+    def test_process_video_never_posts_split_video_without_its_audio(self):
+        import ffmpeg
+        import main
+        from media_info import MediaInfo
+
+        probes = {
+            "video.mp4": {
+                "format": {"format_name": "mov,mp4,m4a", "duration": "20"},
+                "streams": [{"codec_type": "video", "codec_name": "h264", "bit_rate": "1000000"}],
+            },
+            "audio.webm": {"format": {"format_name": "webm"}, "streams": [{"codec_type": "audio", "codec_name": "opus", "bit_rate": "128000"}]},
+        }
+        encodes = []
+
+        def fake_run(stream_spec, **_kwargs):
+            args = ffmpeg.compile(stream_spec)
+            encodes.append(args)
+            with open(args[-1], "wb") as fp:
+                fp.write(b"muxed")
+            return b""
+
+        for source_size in (1000, 7_800_000):
+            with self.subTest(source_size=source_size), tempfile.TemporaryDirectory() as tmpdir:
+                message = _FakeMessage()
+                encodes.clear()
+                video_file = os.path.join(tmpdir, "video.mp4")
+                audio_file = os.path.join(tmpdir, "audio.webm")
+                with open(video_file, "wb") as fp:
+                    fp.write(b"v" * source_size)
+                with open(audio_file, "wb") as fp:
+                    fp.write(b"a" * 100)
+                download_response = {
+                    "videoId": "1",
+                    "platform": "youtube",
+                    "audioFileName": audio_file,
+                    "mediaInfo": MediaInfo(video_file, audio_file),
+                }
+                with mock.patch("media_info.ffmpeg.probe", side_effect=lambda path: probes[os.path.basename(path)]), \
+                        mock.patch("main.run_ffmpeg", side_effect=fake_run), \
+                        mock.patch("main.savePost", autospec=True, return_value=None):
+                    sentMedia = asyncio.run(main.process_video(message, video_file, 20, 8_000_000, download_response))
+
+                self.assertNotEqual(sentMedia["fileName"], video_file)
+                self.assertTrue(encodes)
+                self.assertEqual([encodes[0][i + 1] for i, arg in enumerate(encodes[0]) if arg == "-i"], [video_file, audio_file])
+
+    def test_audio_conversion_downloads_audio_only_and_copies_aac_that_fits(self):
+        import main
+        from media_info import MediaInfo
+
+        message = _FakeMessage("🎵https://youtu.be/abcdefghijk")
+        message.author = _FakeChannel()
+        probe = {
+            "format": {"format_name": "mov,mp4,m4a", "duration": "600"},
+            "streams": [{"codec_type": "audio", "codec_name": "aac", "bit_rate": "96000"}],
+        }
+        ffmpeg_jobs = []
+
+        def fake_run(stream_spec, **_kwargs):
+            output = stream_spec.node.kwargs["filename"]
+            ffmpeg_jobs.append(stream_spec.node.kwargs)
+            with open(output, "wb") as fp:
+                fp.write(b"audio")
+            return b""
+
+        with temporary_working_directory():
+            with open("abc.m4a", "wb") as fp:
+                fp.write(b"source")
+            download_response = {
+                "fileName": "abc.m4a",
+                "duration": 600,
+                "messages": "",
+                "mediaInfo": MediaInfo("abc.m4a"),
+            }
+            with mock.patch("main.download_async", new=mock.AsyncMock(return_value=download_response)) as mock_download, \
+                    mock.patch("media_info.ffmpeg.probe", return_value=probe), \
+                    mock.patch("main.run_ffmpeg", side_effect=fake_run):
+                asyncio.run(main.handle_audio_conversion(message, "https://youtu.be/abcdefghijk"))
+            leftovers = os.listdir(".")
+
+        self.assertTrue(mock_download.await_args.kwargs["audio_only"])
+        self.assertEqual(len(ffmpeg_jobs), 1)
+        self.assertEqual(ffmpeg_jobs[0]["c:a"], "copy")
+        sent_files = [item["file"].filename for item in message.author.sent if item["file"]]
+        self.assertEqual(sent_files, ["audio_abc.m4a.m4a"])
+        self.assertEqual(leftovers, [])
+
+        # A codec that can't be posted as-is, or audio over the limit, is converted to MP3.
+        self.assertIsNone(main.get_audio_copy_plan(MediaInfo.from_ytdlp("a.webm", {"acodec": "opus", "vcodec": "none"}), 1_000, 8_000_000))
+        self.assertIsNone(main.get_audio_copy_plan(MediaInfo.from_ytdlp("a.mp3", {"acodec": "mp3", "vcodec": "none"}), 9_000_000, 8_000_000))
+        self.assertEqual(main.get_audio_copy_plan(MediaInfo.from_ytdlp("a.mp3", {"acodec": "mp3", "vcodec": "none"}), 1_000, 8_000_000)["extension"], "mp3")
+
+    def test_segment_count_respects_threshold_and_minimum_length(self):
+        from segment_encode import get_segment_count, plan_segments
+
+        with mock.patch.dict(os.environ, {"TIKBOT_SEGMENT_ENCODE_MIN_DURATION": "60"}):
+            os.environ.pop("TIKBOT_SEGMENT_ENCODE_SEGMENTS", None)
+            # Off by default.
+            self.assertEqual(get_segment_count(181, 16), 1)
+        with mock.patch.dict(os.environ, {"TIKBOT_SEGMENT_ENCODE_MIN_DURATION": "60", "TIKBOT_SEGMENT_ENCODE_SEGMENTS": "auto"}):
+            self.assertEqual(get_segment_count(30, 16), 1)
+            self.assertEqual(get_segment_count(181, 16), 8)
+            self.assertEqual(get_segment_count(70, 16), 3)
+            self.assertEqual(get_segment_count(181, 2), 1)
+        self.assertEqual(plan_segments(90, 3), [(0.0, 30.0), (30.0, 30.0), (60.0, 30.0)])
+
+    def test_encode_segmented_encodes_in_parallel_and_joins_without_reencoding(self):
+        from segment_encode import SegmentEncodeError, encode_segmented
+
+        commands = []
+
+        def fake_run(stream_spec, **kwargs):
+            args = stream_spec.get_args()
+            commands.append(args)
+            with open(args[-1], "wb") as fp:
+                fp.write(b"x" * 100)
+            return b"time=00:02:00.00 bitrate=1kbits/s"
+
+        output_kwargs = {
+            "c:v": "libx265", "b:v": "300k", "c:a": "aac", "b:a": "64k", "t": 120, "fs": 8_000_000,
+            "tag:v": "hvc1", "threads": "8", "x265-params": "pools=8", "movflags": "+faststart", "f": "mp4",
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "small_video.mp4")
+            with mock.patch("segment_encode.run_ffmpeg", side_effect=fake_run):
+                outputInfo = encode_segmented("video.webm", output_file, output_kwargs, 120, 4, 8)
+                self.assertEqual(os.listdir(tmpdir), ["small_video.mp4"])
+                with self.assertRaises(SegmentEncodeError):
+                    encode_segmented("video.webm", output_file, {**output_kwargs, "fs": 50}, 120, 4, 8)
+
+        segment_commands = [args for args in commands[:6] if "-an" in args]
+        self.assertEqual(len(segment_commands), 4)
+        for args in segment_commands:
+            self.assertNotIn("-fs", args)
+            self.assertEqual(args[args.index("-threads") + 1], "2")
+            self.assertEqual(args[args.index("-b:v") + 1], "300k")
+        self.assertEqual(sorted(float(args[args.index("-ss") + 1]) for args in segment_commands), [0, 30, 60, 90])
+        concat_args = commands[5]
+        self.assertIn("concat", concat_args)
+        self.assertEqual(concat_args[concat_args.index("-c") + 1], "copy")
+        self.assertEqual(outputInfo.duration, 120)
+        self.assertEqual(outputInfo.video_codec, "hevc")
+
+    def test_encoder_tuner_trades_compression_for_speed_under_load(self):
+        from encoder_tuning import EncoderTuner
+
+        tuner = EncoderTuner(threads=4)
+        pixels = 854 * 480 * 30 * 60
+        idle = tuner.choose(pixels, target_seconds=60, jobs_ahead=0)
+        busy = tuner.choose(pixels, target_seconds=60, jobs_ahead=1)
+        self.assertEqual((idle.encoder, idle.preset), ("libx265", "medium"))
+        self.assertEqual(busy.encoder, "libx265")
+        self.assertNotEqual(busy.preset, "medium")
+        self.assertEqual(busy.budget_seconds, 30)
+        self.assertEqual(tuner.choose(pixels, target_seconds=60, jobs_ahead=5).encoder, "libx264")
+
+        # A slow finished job is learned, pushing the next similar job to a faster profile.
+        for _ in range(10):
+            tuner.record("libx265", "medium", pixels, 300)
+        self.assertGreater(tuner.predict_seconds("libx265", "medium", pixels), 60)
+        self.assertNotEqual(tuner.choose(pixels, target_seconds=60).preset, "medium")
+
+    def test_encoder_tuning_is_off_by_default(self):
+        import main
+        from calculator import calculateBitrate
+        from encoder_tuning import EncoderTuner
+
+        # The priors alone predict every libx265 preset missing a 60s target for this clip.
+        media_info = mock.Mock(width=1280, height=720, fps=30)
+        pixels = 1280 * 720 * 30 * 180
+        self.assertEqual(EncoderTuner(threads=8).choose(pixels, target_seconds=60).encoder, "libx264")
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            choice = main.choose_encoder_settings(media_info, calculateBitrate(180), 180)
+
+        self.assertEqual((choice.encoder, choice.preset), ("libx265", "medium"))
+        self.assertEqual(choice.budget_seconds, 0)
+
+    def test_encoder_calibration_runs_in_background_and_defaults_meanwhile(self):
+        from encoder_tuning import EncoderTuner
+
+        tuner = EncoderTuner(threads=4)
+        pixels = 854 * 480 * 30 * 60
+        release = threading.Event()
+        with mock.patch.object(tuner, "calibrate", side_effect=lambda _threads: release.wait(5)) as mock_calibrate:
+            self.assertTrue(tuner.start_calibration(4))
+            self.assertFalse(tuner.start_calibration(4))
+            self.assertTrue(tuner.calibrating)
+            # A busy lane would normally get a faster profile, but the priors aren't trusted yet.
+            choice = tuner.choose(pixels, target_seconds=60, jobs_ahead=5)
+            self.assertEqual((choice.encoder, choice.preset), ("libx265", "medium"))
+            release.set()
+            tuner._calibration_thread.join(5)
+
+        mock_calibrate.assert_called_once_with(4)
+        self.assertFalse(tuner.calibrating)
+        self.assertEqual(tuner.choose(pixels, target_seconds=60, jobs_ahead=5).encoder, "libx264")
+
+    def test_transcode_output_kwargs_for_h264_drop_hevc_options(self):
+        from calculator import calculateBitrate
+        from main import get_transcode_output_kwargs
+
+        output_kwargs = get_transcode_output_kwargs(calculateBitrate(60), 8_000_000, "libx264", "veryfast")
+        self.assertEqual(output_kwargs["c:v"], "libx264")
+        self.assertEqual(output_kwargs["preset"], "veryfast")
+        self.assertEqual(output_kwargs["profile:v"], "high")
+        self.assertNotIn("tag:v", output_kwargs)
+        self.assertNotIn("x265-params", output_kwargs)
+
     def test_send_compressed_video_keeps_event_loop_responsive_during_transcode(self):
         import main
 
@@ -265,7 +828,7 @@ class TestMessageHandling(unittest.TestCase):
             with open(input_file, "wb") as fp:
                 fp.write(b"source")
 
-            def fake_transcode(_input_file, compressed_filename, _output_kwargs):
+            def fake_transcode(_input_file, compressed_filename, _output_kwargs, **_kwargs):
                 time.sleep(0.2)
                 with open(compressed_filename, "wb") as fp:
                     fp.write(b"compressed")
@@ -302,6 +865,561 @@ class TestMessageHandling(unittest.TestCase):
         self.assertTrue(any(item["file"] for item in message.channel.sent))
 
 
+class TestFFmpegRunner(unittest.TestCase):
+    FAKE_FFMPEG = """#!{python}
+import sys, time
+blocks = {blocks}
+for out_time_us in blocks:
+    print(f"frame=1\\nfps=30.0\\nout_time_us={{out_time_us}}\\nspeed=2.00x\\nprogress=continue", flush=True)
+    time.sleep(0.05)
+sys.stderr.write("frame= 10 time=00:00:04.00 bitrate=1kbits/s\\n")
+time.sleep({hang})
+print("progress=end", flush=True)
+sys.exit({exit_code})
+"""
+
+    @contextlib.contextmanager
+    def fake_ffmpeg(self, blocks=(1_000_000, 2_000_000, 4_000_000), hang=0, exit_code=0):
+        import sys
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "ffmpeg")
+            with open(path, "w") as fp:
+                fp.write(self.FAKE_FFMPEG.format(python=sys.executable, blocks=list(blocks), hang=hang, exit_code=exit_code))
+            os.chmod(path, 0o755)
+            with mock.patch.dict(os.environ, {"PATH": tmpdir + os.pathsep + os.environ.get("PATH", "")}):
+                yield
+
+    def stream(self):
+        import ffmpeg
+
+        return ffmpeg.input("in.mp4").output("out.mp4")
+
+    def test_reports_progress_and_returns_stderr(self):
+        from ffmpeg_runner import run_ffmpeg
+
+        updates = []
+        with self.fake_ffmpeg():
+            stderr = run_ffmpeg(self.stream(), expected_duration=8, on_progress=updates.append)
+
+        self.assertIn(b"time=00:00:04.00", stderr)
+        self.assertEqual([update["out_time"] for update in updates[:3]], [1, 2, 4])
+        self.assertEqual(updates[2]["percent"], 50)
+        self.assertEqual(updates[2]["eta"], 2)
+        self.assertTrue(updates[-1]["done"])
+
+    def test_kills_stalled_and_cancelled_encodes(self):
+        from ffmpeg_runner import TranscodeCancelledError, TranscodeTimeoutError, run_ffmpeg
+
+        with self.fake_ffmpeg(hang=30):
+            started = time.monotonic()
+            with self.assertRaises(TranscodeTimeoutError):
+                run_ffmpeg(self.stream(), stall_timeout=1)
+            with self.assertRaises(TranscodeTimeoutError):
+                run_ffmpeg(self.stream(), timeout=1)
+            with self.assertRaises(TranscodeCancelledError):
+                run_ffmpeg(self.stream(), cancelled=lambda: True)
+        self.assertLess(time.monotonic() - started, 10)
+
+    def test_nonzero_exit_raises_ffmpeg_error(self):
+        import ffmpeg
+        from ffmpeg_runner import run_ffmpeg
+
+        with self.fake_ffmpeg(exit_code=1):
+            with self.assertRaises(ffmpeg.Error) as raised:
+                run_ffmpeg(self.stream())
+        self.assertIn(b"time=00:00:04.00", raised.exception.stderr)
+
+    def test_monitored_transcode_edits_eta_and_kills_on_cancel(self):
+        import main
+
+        edits = []
+        cancel_seen = threading.Event()
+
+        class StatusMessage:
+            async def edit(self, content=None):
+                edits.append(content)
+
+        def fake_job(on_progress=None, cancelled=None):
+            on_progress({"out_time": 5, "percent": 50.0, "eta": 12.0, "speed": 2.0, "fps": 60.0, "done": False})
+            while not cancelled():
+                time.sleep(0.01)
+            cancel_seen.set()
+
+        async def run_scenario():
+            task = asyncio.create_task(
+                main.run_monitored_transcode(fake_job, statusMessage=StatusMessage(), statusText="Squishing")
+            )
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.dict(os.environ, {"TIKBOT_ENCODE_PROGRESS_EDIT_SECONDS": "1"}):
+            asyncio.run(run_scenario())
+
+        self.assertTrue(cancel_seen.wait(2))
+        self.assertEqual(edits, ["Squishing (50% done, about 12s left)"])
+
+    def test_transcode_timeout_scales_with_duration(self):
+        from ffmpeg_runner import get_transcode_timeout
+
+        with mock.patch.dict(os.environ, {"TIKBOT_TRANSCODE_TIMEOUT_BASE": "100", "TIKBOT_TRANSCODE_TIMEOUT_PER_SECOND": "4"}):
+            self.assertEqual(get_transcode_timeout(60), 340)
+        with mock.patch.dict(os.environ, {"TIKBOT_TRANSCODE_TIMEOUT_BASE": "0", "TIKBOT_TRANSCODE_TIMEOUT_PER_SECOND": "0"}):
+            self.assertIsNone(get_transcode_timeout(60))
+
+
+class TestYtdlpWorker(unittest.TestCase):
+    """Runs real yt-dlp worker processes against a local HTTP server."""
+
+    def setUp(self):
+        import http.server
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *_args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(head_only=True)
+
+            def do_GET(self, head_only=False):
+                if self.path == "/hang":
+                    time.sleep(20)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(200_000 if self.path == "/clip.mp4" else 10_000_000))
+                self.end_headers()
+                if head_only:
+                    return
+                if self.path == "/clip.mp4":
+                    self.wfile.write(b"\0" * 200_000)
+                    return
+                self.wfile.write(b"\0" * 65_536)
+                self.wfile.flush()
+                time.sleep(20)
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_worker_downloads_and_kills_stalled_attempts(self):
+        from ytdlp_worker import YtdlpAttemptTimeout, YtdlpWorkerPool
+
+        pool = YtdlpWorkerPool(1, max_jobs=0)
+        try:
+            with temporary_working_directory() as tmpdir:
+                outcome = pool.run(f"{self.base_url}/clip.mp4", None, 8_000_000, timeout=60)
+                self.assertIsNone(outcome["error"])
+                self.assertEqual(os.path.getsize(os.path.join(tmpdir, "clip.mp4")), 200_000)
+                self.assertTrue(outcome["attempted_formats"])
+                self.assertEqual(outcome["result"]["id"], "clip")
+
+                started = time.monotonic()
+                outcome = pool.run(f"{self.base_url}/stall.mp4", None, 8_000_000, timeout=4)
+                self.assertIsInstance(outcome["error"], YtdlpAttemptTimeout)
+                self.assertLess(time.monotonic() - started, 15)
+                self.assertEqual(sorted(os.listdir(tmpdir)), ["clip.mp4"])
+        finally:
+            pool.close()
+
+    def test_worker_pool_counts_the_wait_for_a_worker_and_kills_cancelled_attempts(self):
+        from ytdlp_worker import YtdlpAttemptTimeout, YtdlpWorkerPool
+
+        pool = YtdlpWorkerPool(1, max_jobs=0)
+        cancel = threading.Event()
+        outcomes = []
+        try:
+            with temporary_working_directory() as tmpdir:
+                stalled = threading.Thread(
+                    target=lambda: outcomes.append(
+                        pool.run(f"{self.base_url}/stall.mp4", None, 8_000_000, timeout=60, cancelled=cancel.is_set)
+                    )
+                )
+                stalled.start()
+                time.sleep(0.5)
+
+                # The only worker is busy, so this attempt runs out of time while queued.
+                started = time.monotonic()
+                outcome = pool.run(f"{self.base_url}/clip.mp4", None, 8_000_000, timeout=1)
+                self.assertIsInstance(outcome["error"], YtdlpAttemptTimeout)
+                self.assertLess(time.monotonic() - started, 5)
+
+                started = time.monotonic()
+                cancel.set()
+                stalled.join(15)
+                self.assertLess(time.monotonic() - started, 10)
+                self.assertIsInstance(outcomes[0]["error"], YtdlpAttemptTimeout)
+                self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            pool.close()
+
+    def test_worker_extracts_metadata_and_spawns_without_the_bot_main_module(self):
+        import multiprocessing.spawn
+
+        from ytdlp_worker import YtdlpWorkerPool, _as_spawn_main
+
+        with _as_spawn_main():
+            preparation = multiprocessing.spawn.get_preparation_data("ytdlp-worker")
+        self.assertEqual(preparation.get("init_main_from_name"), "ytdlp_worker")
+        self.assertNotIn("init_main_from_path", preparation)
+
+        pool = YtdlpWorkerPool(1, max_jobs=0)
+        try:
+            info = pool.extract(f"{self.base_url}/clip.mp4", timeout=60)
+            self.assertEqual(info["id"], "clip")
+            started = time.monotonic()
+            self.assertIsNone(pool.extract(f"{self.base_url}/hang", timeout=4))
+            self.assertLess(time.monotonic() - started, 15)
+        finally:
+            pool.close()
+
+    def test_concurrent_worker_starts_each_spawn_from_the_worker_module(self):
+        import sys
+
+        import ytdlp_worker
+
+        seen_mains = []
+
+        class FakeProcess:
+            pid = 1
+
+            def __init__(self, **_kwargs):
+                pass
+
+            def start(self):
+                time.sleep(0.05)
+                seen_mains.append(sys.modules["__main__"].__name__)
+
+        context = mock.Mock(Process=FakeProcess)
+        original_main = sys.modules["__main__"]
+        workers = [ytdlp_worker.YtdlpWorker(max_jobs=0) for _ in range(2)]
+        with mock.patch("ytdlp_worker._get_multiprocessing_context", return_value=context):
+            threads = [threading.Thread(target=worker._start) for worker in workers]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.01)
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(seen_mains, ["ytdlp_worker", "ytdlp_worker"])
+        self.assertIs(sys.modules["__main__"], original_main)
+
+
+class TestDownloadErrors(unittest.TestCase):
+
+    def test_classifies_errors_by_status_type_and_message(self):
+        from yt_dlp.utils import DownloadError, GeoRestrictedError
+
+        from download_errors import PERMANENT, RATE_LIMITED, TRANSIENT, UNAVAILABLE, UNKNOWN, classify_error
+        from ytdlp_worker import YtdlpAttemptTimeout, YtdlpWorkerError
+
+        geo_error = GeoRestrictedError("This video is only available in Japan")
+        cases = [
+            (DownloadError("ERROR: [TikTok] 123: Video unavailable"), UNAVAILABLE),
+            (DownloadError("ERROR: Unsupported URL: https://kkclip.com/v/123"), PERMANENT),
+            (DownloadError("ERROR: blocked", exc_info=(type(geo_error), geo_error, None)), PERMANENT),
+            (YtdlpWorkerError("DownloadError", "ERROR: Unable to download webpage: HTTP Error 404: Not Found", 404), PERMANENT),
+            (YtdlpWorkerError("DownloadError", "ERROR: HTTP Error 429: Too Many Requests", 429, 30.0), RATE_LIMITED),
+            (DownloadError("ERROR: Unable to download webpage: HTTP Error 503: Service Unavailable"), TRANSIENT),
+            (YtdlpAttemptTimeout("yt-dlp attempt timed out after 150s"), TRANSIENT),
+            (DownloadError("ERROR: Unable to extract video data"), UNKNOWN),
+            (None, UNKNOWN),
+        ]
+        for error, expected in cases:
+            with self.subTest(error=str(error)):
+                self.assertEqual(classify_error(error), expected)
+
+    def test_retry_after_and_backoff(self):
+        from datetime import datetime, timezone
+
+        from download_errors import RATE_LIMITED, get_retry_after, get_retry_delay, parse_retry_after
+        from ytdlp_worker import YtdlpWorkerError
+
+        now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(parse_retry_after("12"), 12.0)
+        self.assertEqual(parse_retry_after("Thu, 01 Jan 2026 00:00:30 GMT", now=now), 30.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(get_retry_after(YtdlpWorkerError("DownloadError", "HTTP Error 429", 429, 9.0)), 9.0)
+
+        with mock.patch.dict(os.environ, {"TIKBOT_RETRY_MAX_DELAY": "60"}):
+            for attempt, low, high in ((1, 0.5, 1), (3, 2, 4), (10, 30, 60)):
+                delay = get_retry_delay(attempt, 1)
+                self.assertGreaterEqual(delay, low)
+                self.assertLessEqual(delay, high)
+            self.assertGreaterEqual(get_retry_delay(1, 1, RATE_LIMITED), 2.5)
+            self.assertEqual(get_retry_delay(1, 0, RATE_LIMITED, retry_after=20), 20)
+
+
+class TestMediaCache(unittest.TestCase):
+
+    def _write_file(self, path, size):
+        with open(path, "wb") as fp:
+            fp.write(b"x" * size)
+        return path
+
+    def test_put_and_get_round_trip(self):
+        from media_cache import MediaCache, make_cache_key
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = MediaCache(os.path.join(tmpdir, "cache"), 1000)
+            source = self._write_file(os.path.join(tmpdir, "small_123.mp4"), 100)
+            key = make_cache_key("tiktok", "123", 8_000_000)
+
+            cached_path = cache.put(key, source, {"displayName": "small_123.mp4", "durationLimited": True})
+            cached = cache.get(key)
+
+        self.assertEqual(key, "tiktok-123-8000000")
+        self.assertEqual(cached["fileName"], cached_path)
+        self.assertEqual(cached["displayName"], "small_123.mp4")
+        self.assertTrue(cached["durationLimited"])
+        self.assertEqual(cached["size"], 100)
+
+    def test_evicts_least_recently_used_entry(self):
+        from media_cache import MediaCache
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = MediaCache(os.path.join(tmpdir, "cache"), 250)
+            for name in ("a", "b"):
+                cache.put(name, self._write_file(os.path.join(tmpdir, f"{name}.mp4"), 100), {})
+            self.assertIsNotNone(cache.get("a"))
+            cache.put("c", self._write_file(os.path.join(tmpdir, "c.mp4"), 100), {})
+
+            self.assertIsNotNone(cache.get("a"))
+            self.assertIsNone(cache.get("b"))
+            self.assertIsNotNone(cache.get("c"))
+            self.assertEqual(cache.stats()["bytes"], 200)
+
+    def test_reloads_entries_from_disk(self):
+        from media_cache import MediaCache
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_dir = os.path.join(tmpdir, "cache")
+            MediaCache(cache_dir, 1000).put("a", self._write_file(os.path.join(tmpdir, "a.mp4"), 100), {})
+
+            reloaded = MediaCache(cache_dir, 1000)
+            self.assertIsNotNone(reloaded.get("a"))
+            self.assertEqual(reloaded.stats()["entries"], 1)
+
+    def test_handleMessage_sends_cached_media_without_downloading(self):
+        import main
+        from media_cache import MediaCache
+
+        message = _FakeMessage("https://www.tiktok.com/@test/video/123")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = MediaCache(tmpdir, 1000)
+            cache.put(
+                "tiktok-123-8000000",
+                self._write_file(os.path.join(tmpdir, "source.mp4"), 100),
+                {"displayName": "123.mp4"},
+            )
+
+            with mock.patch("main.get_media_cache", return_value=cache):
+                with mock.patch("main.isSupportedUrl", return_value={"supported": "true", "messages": "", "silentMode": False}):
+                    with mock.patch("main.find_repost", return_value=None):
+                        with mock.patch("main.savePost", autospec=True, return_value=None) as mock_save_post:
+                            with mock.patch("main.download_with_retries_async") as mock_download:
+                                asyncio.run(main.handleMessage(message))
+
+        mock_download.assert_not_called()
+        mock_save_post.assert_called_once()
+        self.assertTrue(any(item["file"] for item in message.channel.sent))
+
+
+class TestPostStore(unittest.TestCase):
+
+    def test_sqlite_store_round_trips_latest_post(self):
+        from dbInteraction import SqlitePostStore
+        from datetime import datetime
+
+        store = SqlitePostStore(":memory:")
+        store.save_post("first", "123", "tiktok", datetime(2024, 1, 1, 12, 0), 10)
+        store.save_post("second", "123", "tiktok", datetime(2024, 1, 2, 12, 0), 11)
+
+        self.assertEqual(
+            store.find_latest_post("123", ["tiktok"]),
+            ("second", datetime(2024, 1, 2, 12, 0), "11", "tiktok"),
+        )
+        self.assertIsNone(store.find_latest_post("123", ["youtube"]))
+
+    def test_sqlite_store_prefers_earlier_platforms_in_batched_lookup(self):
+        from dbInteraction import SqlitePostStore
+        from datetime import datetime
+
+        store = SqlitePostStore(":memory:")
+        store.save_post("current", "123", "tiktok", datetime(2024, 1, 1), 10)
+        store.save_post("legacy", "123", "MattIsLazy", datetime(2024, 1, 2), 11)
+
+        self.assertEqual(store.find_latest_post("123", ["tiktok", "MattIsLazy"])[0], "current")
+        self.assertEqual(store.find_latest_post("123", ["youtube", "MattIsLazy"])[0], "legacy")
+
+    def test_default_backend_is_sqlite_without_postgres_credentials(self):
+        from dbInteraction import get_db_backend
+
+        with mock.patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(get_db_backend(), "sqlite")
+        with mock.patch.dict(os.environ, {"DB_HOST": "db"}, clear=True):
+            self.assertEqual(get_db_backend(), "postgres")
+
+    def test_postgres_store_reconnects_after_connection_loss(self):
+        import psycopg2
+        from dbInteraction import PostgresPostStore
+
+        # After a database restart every idle pooled connection is dead.
+        stale = [mock.MagicMock(), mock.MagicMock()]
+        for conn in stale:
+            conn.cursor.side_effect = psycopg2.OperationalError("server closed the connection")
+        fresh = [mock.MagicMock(), mock.MagicMock()]
+        for conn in fresh:
+            cursor = conn.cursor.return_value.__enter__.return_value
+            cursor.fetchone.side_effect = [None, ("user", "when", "42", "tiktok")]
+        pool = mock.MagicMock()
+        pool.getconn.side_effect = stale
+
+        with mock.patch("psycopg2.pool.ThreadedConnectionPool", return_value=pool):
+            with mock.patch("psycopg2.connect", side_effect=fresh) as mock_connect:
+                store = PostgresPostStore("dbname=test", 2)
+                for _ in range(2):
+                    self.assertEqual(store.find_latest_post("123", ["tiktok", "MattIsLazy"]), ("user", "when", "42", "tiktok"))
+
+        mock_connect.assert_called_with("dbname=test")
+        for conn in stale:
+            pool.putconn.assert_any_call(conn, close=True)
+        for conn in fresh:
+            conn.close.assert_called_once_with()
+        fresh[1].cursor.return_value.__enter__.return_value.execute.assert_called_with(
+            "EXECUTE tikbot_find_latest_post_posts (%s, %s)", ("123", ["tiktok", "MattIsLazy"])
+        )
+
+    def test_postgres_store_does_not_retry_writes_after_connection_loss(self):
+        import psycopg2
+        from datetime import datetime
+        from dbInteraction import PostgresPostStore
+
+        # The INSERT may have committed before the connection dropped; retrying could save it twice.
+        dropped = mock.MagicMock()
+        dropped.commit.side_effect = psycopg2.OperationalError("server closed the connection")
+        pool = mock.MagicMock()
+        pool.getconn.return_value = dropped
+
+        with mock.patch("psycopg2.pool.ThreadedConnectionPool", return_value=pool):
+            with mock.patch("psycopg2.connect") as mock_connect:
+                store = PostgresPostStore("dbname=test", 2)
+                with self.assertRaises(psycopg2.OperationalError):
+                    store.save_post("user", "123", "tiktok", datetime(2024, 1, 1, 12, 0), 42)
+
+        mock_connect.assert_not_called()
+        self.assertEqual(dropped.cursor.return_value.__enter__.return_value.execute.call_count, 1)
+        pool.putconn.assert_called_once_with(dropped, close=True)
+
+    @unittest.skipUnless(POSTGRES_TEST_DSN, "Postgres test requires TIKBOT_TEST_POSTGRES_DSN")
+    def test_postgres_store_finds_latest_post_through_the_lookup_index(self):
+        import psycopg2
+        from datetime import datetime
+        from dbInteraction import PostgresPostStore
+
+        table = "posts_tikbot_test"
+        conn = psycopg2.connect(POSTGRES_TEST_DSN)
+        conn.autocommit = True
+        self.addCleanup(conn.close)
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute(
+                f"CREATE TABLE {table} (\"postId\" bigint GENERATED ALWAYS AS IDENTITY PRIMARY KEY, "
+                "\"userId\" varchar(50), \"videoId\" varchar(50), platform varchar(50), "
+                "\"postDateTime\" timestamp, \"discordMessageId\" varchar(50))"
+            )
+            # The same index as maintenance/add_posts_lookup_index.sql.
+            cur.execute(
+                f"CREATE INDEX {table}_video_platform_post_idx ON {table} USING btree (\"videoId\", platform, \"postId\" DESC)"
+            )
+        self.addCleanup(lambda: conn.cursor().execute(f"DROP TABLE IF EXISTS {table}"))
+
+        store = PostgresPostStore(POSTGRES_TEST_DSN, 2, table=table)
+        store.save_post("legacy", "123", "MattIsLazy", datetime(2024, 1, 1, 12, 0), 9)
+        store.save_post("first", "123", "tiktok", datetime(2024, 1, 1, 12, 0), 10)
+        store.save_post("second", "123", "tiktok", datetime(2024, 1, 2, 12, 0), 11)
+
+        self.assertEqual(
+            store.find_latest_post("123", ["tiktok", "MattIsLazy"]),
+            ("second", datetime(2024, 1, 2, 12, 0), "11", "tiktok"),
+        )
+        self.assertEqual(store.find_latest_post("123", ["MattIsLazy", "tiktok"])[0], "legacy")
+        self.assertIsNone(store.find_latest_post("456", ["tiktok", "MattIsLazy"]))
+
+        # A table this small is scanned anyway, so only check that the lookup can use the index.
+        with conn.cursor() as cur:
+            cur.execute("SET enable_seqscan = off")
+            cur.execute(
+                f"EXPLAIN SELECT \"userId\" FROM {table} WHERE \"videoId\"=%s AND platform=ANY(%s) "
+                "ORDER BY array_position(%s, platform::text), \"postId\" DESC LIMIT 1",
+                ("123", ["tiktok", "MattIsLazy"], ["tiktok", "MattIsLazy"]),
+            )
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        self.assertIn(f"{table}_video_platform_post_idx", plan)
+
+
+class TestRecentPostCache(unittest.TestCase):
+
+    def setUp(self):
+        import dbInteraction
+
+        self.store = mock.Mock()
+        self._store_patcher = mock.patch("dbInteraction.get_post_store", return_value=self.store)
+        self._store_patcher.start()
+        self.cache = dbInteraction.RecentPostCache(max_entries=100, ttl_seconds=60, negative_ttl_seconds=60)
+        self._cache_patcher = mock.patch("dbInteraction.recent_posts", self.cache)
+        self._cache_patcher.start()
+
+    def tearDown(self):
+        self._cache_patcher.stop()
+        self._store_patcher.stop()
+
+    def test_savePost_writes_through_to_cache(self):
+        from dbInteraction import findLatestPost, savePost
+
+        savePost("user", "123", "tiktok", 42)
+        row = findLatestPost("123", ["tiktok", "MattIsLazy"])
+
+        self.store.find_latest_post.assert_not_called()
+        self.assertEqual(row[0], "user")
+        self.assertEqual(row[2], "42")
+
+    def test_caches_misses_and_matched_platform(self):
+        from dbInteraction import findLatestPost
+
+        self.store.find_latest_post.return_value = ("user", "when", "42", "MattIsLazy")
+        self.assertEqual(findLatestPost("123", ["tiktok", "MattIsLazy"]), ("user", "when", "42"))
+        self.assertEqual(findLatestPost("123", ["tiktok", "MattIsLazy"]), ("user", "when", "42"))
+
+        self.store.find_latest_post.return_value = None
+        self.assertIsNone(findLatestPost("456", ["tiktok"]))
+        self.assertIsNone(findLatestPost("456", ["tiktok"]))
+
+        self.assertEqual(self.store.find_latest_post.call_count, 2)
+
+    def test_entries_expire_and_are_bounded(self):
+        from dbInteraction import RecentPostCache
+
+        cache = RecentPostCache(max_entries=3, ttl_seconds=60, negative_ttl_seconds=0.01)
+        cache.put("1", "tiktok", ("a",))
+        cache.put("2", "tiktok", ("b",))
+        cache.put("3", "tiktok", ("c",))
+        cache.get("1", "tiktok")
+        cache.put("4", "tiktok", None)
+
+        self.assertEqual(cache.get("1", "tiktok"), (True, ("a",)))
+        self.assertEqual(cache.get("2", "tiktok"), (False, None))
+        time.sleep(0.02)
+        self.assertEqual(cache.get("4", "tiktok"), (False, None))
+
+
 class TestVersioning(unittest.TestCase):
 
     def test_get_version_uses_default_when_env_missing(self):
@@ -376,7 +1494,7 @@ class TestDownloaderIntegration(DownloaderTestCase):
 
             assert_download_succeeded(self, download_response, file_path)
 
-        self.mock_does_post_exist.assert_not_called()
+        self.mock_find_latest_post.assert_not_called()
 
     def test_tiktok_download_records_formats_and_saves_file(self):
         with temporary_working_directory() as tmpdir:
@@ -403,7 +1521,7 @@ class TestDownloaderIntegration(DownloaderTestCase):
 
             assert_download_succeeded(self, download_response, file_path, allow_zero_duration=True)
 
-        self.mock_does_post_exist.assert_not_called()
+        self.mock_find_latest_post.assert_not_called()
 
     def test_tiktok_short_url_download_records_formats_and_saves_file(self):
         with temporary_working_directory() as tmpdir:
@@ -430,7 +1548,7 @@ class TestDownloaderIntegration(DownloaderTestCase):
 
             assert_download_succeeded(self, download_response, file_path, allow_zero_duration=True)
 
-        self.mock_does_post_exist.assert_not_called()
+        self.mock_find_latest_post.assert_not_called()
 
     def test_tiktok_short_url_end_to_end_processing(self):
         from main import process_video
@@ -532,14 +1650,17 @@ class TestDownloaderIntegration(DownloaderTestCase):
             )
 
         self.assertEqual(download_response["messages"], 'Error: Download Failed')
-        self.assertListEqual(
-            download_response["attemptedFormats"],
-            downloader_module._get_format_candidates(url)
+        # Metadata extraction fails before any format is tried, so each attempt reports only the
+        # first candidate instead of running through the rest against the same failure.
+        self.assertTrue(download_response["attemptedFormats"])
+        self.assertEqual(
+            set(download_response["attemptedFormats"]),
+            {downloader_module._get_format_candidates(url)[0]},
         )
         self.assertIsNone(download_response["selectedFormat"])
         self.assertIsNotNone(download_response["lastError"])
 
-        self.mock_does_post_exist.assert_not_called()
+        self.mock_find_latest_post.assert_not_called()
 
 class TestCalculator(unittest.TestCase):
 
@@ -655,6 +1776,33 @@ class TestDownloaderFormatSelection(DownloaderTestCase):
             ['bestvideo[ext=mp4][filesize<7M]+bestaudio[ext=m4a][filesize<1050K]/b[ext=mp4][filesize<8M]/best[filesize<8M]', 'best']
         )
 
+    def test_get_format_candidates_follow_configured_size_limit(self):
+        candidates = downloader_module._get_format_candidates("https://www.youtube.com/watch?v=abc", 25_000_000)
+        self.assertEqual(
+            candidates,
+            ['bestvideo[ext=mp4][filesize<24M]+bestaudio[ext=m4a][filesize<1050K]/b[ext=mp4][filesize<25M]/best[filesize<25M]', 'best']
+        )
+
+    def test_plan_playable_format_prefers_best_h264_that_fits(self):
+        info = {
+            "duration": 60,
+            "formats": [
+                {"format_id": "vp9-1080", "ext": "webm", "vcodec": "vp9", "acodec": "none", "height": 1080, "filesize": 4_000_000},
+                {"format_id": "av1-720", "ext": "mp4", "vcodec": "av01.0.05M.08", "acodec": "none", "height": 720, "filesize": 3_000_000},
+                {"format_id": "h264-1080", "ext": "mp4", "vcodec": "avc1.640028", "acodec": "none", "height": 1080, "filesize": 30_000_000},
+                {"format_id": "h264-720", "ext": "mp4", "vcodec": "avc1.4d401f", "acodec": "none", "height": 720, "tbr": 800},
+                {"format_id": "h264-360", "ext": "mp4", "vcodec": "avc1.42001E", "acodec": "mp4a.40.2", "height": 360, "filesize": 2_000_000},
+                {"format_id": "aac", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2", "filesize_approx": 1_000_000},
+                {"format_id": "opus", "ext": "webm", "vcodec": "none", "acodec": "opus", "filesize": 500_000},
+            ],
+        }
+
+        # 720p at 800kbps for 60s is ~6MB, plus 1MB of AAC.
+        self.assertEqual(downloader_module._plan_playable_format(info, 8_000_000), "h264-720+aac")
+        self.assertEqual(downloader_module._plan_playable_format(info, 50_000_000), "h264-1080+aac")
+        self.assertEqual(downloader_module._plan_playable_format(info, 3_000_000), "h264-360")
+        self.assertIsNone(downloader_module._plan_playable_format(info, 1_000_000))
+
     def test_get_format_candidates_for_youtube_watch_url(self):
         candidates = downloader_module._get_format_candidates(
             "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
@@ -686,6 +1834,529 @@ class TestDownloaderFormatSelection(DownloaderTestCase):
         self.assertEqual(opts['format'], 'bv*+ba/b')
         self.assertEqual(opts['format_sort'], ['+codec:h264'])
 
+    def test_resolve_video_id_parses_known_url_patterns(self):
+        cases = {
+            "https://www.tiktok.com/@test/video/7312345678901234567?lang=en": "7312345678901234567",
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=5": "dQw4w9WgXcQ",
+            "https://youtu.be/dQw4w9WgXcQ": "dQw4w9WgXcQ",
+            "https://youtube.com/shorts/aSCz2JvMhck?si=RgZR6_GivuQWukcm": "aSCz2JvMhck",
+            "https://www.instagram.com/reel/DaFy7GYIKI5/?igsh=abc": "DaFy7GYIKI5",
+            "https://www.kkclip.com/reel/DaFy7GYIKI5/": "DaFy7GYIKI5",
+            "https://v.redd.it/zv89llsvexdz": "zv89llsvexdz",
+        }
+        for url, expected in cases.items():
+            with self.subTest(url=url):
+                self.assertEqual(downloader_module.resolve_video_id(url), expected)
+
+    def test_resolve_video_id_returns_none_for_unparseable_urls(self):
+        self.assertIsNone(downloader_module.resolve_video_id("https://vt.tiktok.com/ZSCDC8bDV/"))
+        self.assertIsNone(downloader_module.resolve_video_id("https://example.com/video/123"))
+
+    def test_download_detects_repost_before_downloading(self):
+        from datetime import datetime, timezone
+
+        self.mock_find_latest_post.return_value = ("someone", datetime(2024, 1, 2, tzinfo=timezone.utc), "999")
+        with mock.patch("downloader._attempt_download") as mock_attempt:
+            response = downloader_module.download("https://www.tiktok.com/@test/video/123")
+
+        mock_attempt.assert_not_called()
+        self.assertTrue(response["repost"])
+        self.assertEqual(response["videoId"], "123")
+        self.assertEqual(response["repostOriginalMesssageId"], "999")
+        self.mock_find_latest_post.assert_called_once_with("123", ["tiktok", "MattIsLazy"])
+
+    def test_resolve_video_id_follows_tiktok_short_links(self):
+        with mock.patch(
+            "downloader.get_tiktok_video_page_url",
+            return_value="https://www.tiktok.com/@test/video/456",
+        ):
+            self.assertEqual(
+                downloader_module.resolve_video_id("https://vt.tiktok.com/ZSCDC8bDV/", allow_network=True),
+                "456",
+            )
+
+    def test_resolve_video_id_falls_back_to_metadata_extraction(self):
+        ydl = mock.MagicMock()
+        ydl.extract_info.return_value = {"id": "abc123", "title": "clip"}
+        with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl):
+            video_id = downloader_module.resolve_video_id(
+                "https://www.reddit.com/r/test/comments/abc/title/",
+                allow_network=True,
+            )
+
+        self.assertEqual(video_id, "abc123")
+        ydl.extract_info.assert_called_once_with(
+            "https://www.reddit.com/r/test/comments/abc/title/", download=False, process=False
+        )
+        ydl.close.assert_called_once()
+
+    def test_download_with_retries_async_retries_only_the_failed_stage(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        video_file = os.path.join(tmpdir, "clip.mp4")
+        calls = []
+        notices = []
+
+        def flaky_stage(state):
+            calls.append("flaky")
+            if len(calls) == 1:
+                state.last_exception = TimeoutError("The read operation timed out")
+                return
+            with open(video_file, "wb") as fp:
+                fp.write(b"video")
+            state.result = {"id": "clip", "_filename": video_file, "duration": 5}
+
+        def fallback_stage(state):
+            calls.append("fallback")
+
+        async def on_retry(attempt, error):
+            notices.append((attempt, str(error)))
+
+        io_calls = []
+
+        async def run_io(func, *args, **kwargs):
+            io_calls.append(func.__name__)
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+        stages = [("flaky", flaky_stage), ("fallback", fallback_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages):
+            response = asyncio.run(
+                downloader_module.download_with_retries_async(
+                    "https://www.youtube.com/shorts/abc",
+                    retries=3,
+                    retry_multiplier=0,
+                    on_retry=on_retry,
+                    detect_repost=False,
+                    run_io=run_io,
+                )
+            )
+
+        self.assertEqual(response["fileName"], video_file)
+        self.assertEqual(calls, ["flaky", "flaky"])
+        self.assertEqual(notices, [(1, "The read operation timed out")])
+        # Partial-file cleanup runs on the I/O runner rather than on the event loop.
+        self.assertEqual(io_calls, ["cleanup"])
+
+    def test_download_with_retries_fails_fast_on_permanent_errors(self):
+        from yt_dlp.utils import DownloadError
+
+        calls = []
+
+        def private_stage(state):
+            calls.append("direct")
+            state.last_exception = DownloadError("ERROR: [youtube] abc: Private video. Sign in if you've been granted access")
+
+        def fallback_stage(state):
+            calls.append("fallback")
+
+        stages = [("direct", private_stage), ("fallback", fallback_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages):
+            with mock.patch("downloader.asyncio.sleep", new_callable=mock.AsyncMock) as mock_sleep:
+                response = download_with_retries("https://www.youtube.com/shorts/abc", retries=4, detect_repost=False)
+
+        self.assertEqual(calls, ["direct"])
+        self.assertEqual(response["messages"], "Error: Download Failed")
+        self.assertEqual(response["errorKind"], "unavailable")
+        mock_sleep.assert_not_called()
+
+    def test_download_moves_on_to_fallbacks_after_a_permanent_stage_error(self):
+        from yt_dlp.utils import DownloadError
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        video_file = os.path.join(tmpdir, "clip.mp4")
+        calls = []
+
+        def unsupported_stage(state):
+            calls.append("direct")
+            state.last_exception = DownloadError("ERROR: Unsupported URL: https://kkclip.com/v/123")
+
+        def embed_stage(state):
+            calls.append("kkclip-embed")
+            with open(video_file, "wb") as fp:
+                fp.write(b"video")
+            state.result = {"id": "123", "_filename": video_file, "duration": 5}
+
+        stages = [("direct", unsupported_stage), ("kkclip-embed", embed_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages):
+            with mock.patch("downloader.asyncio.sleep", new_callable=mock.AsyncMock) as mock_sleep:
+                response = download_with_retries("https://kkclip.com/v/123", retries=4, detect_repost=False)
+
+        # The permanent error isn't retried, but the next stage still gets its turn.
+        self.assertEqual(calls, ["direct", "kkclip-embed"])
+        self.assertEqual(response["fileName"], video_file)
+        mock_sleep.assert_not_called()
+
+    def test_playwright_failure_is_classified_by_its_own_error(self):
+        from yt_dlp.utils import DownloadError
+
+        def not_found_stage(state):
+            state.last_exception = DownloadError("ERROR: Unable to download webpage: HTTP Error 404: Not Found")
+
+        stages = [("direct", not_found_stage), ("playwright", downloader_module._playwright_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages), \
+                mock.patch("downloader.download_tiktok_embed_video_playwright", return_value=None) as mock_playwright, \
+                mock.patch("downloader.asyncio.sleep", new_callable=mock.AsyncMock):
+            response = downloader_module.download(
+                "https://www.tiktok.com/@test/video/123", detect_repost=False, retries=2, retry_multiplier=0
+            )
+
+        # The direct stage's 404 doesn't make the Playwright failure permanent, so it gets its retry.
+        self.assertEqual(mock_playwright.call_count, 2)
+        self.assertEqual(response["errorKind"], "unknown")
+        self.assertIn("Playwright embed download failed", response["lastError"])
+        self.assertIn("HTTP Error 404", response["lastError"])
+
+    def test_download_retries_unclassified_errors_on_the_last_stage_that_ran(self):
+        from yt_dlp.utils import DownloadError
+
+        calls = []
+
+        def direct_stage(state):
+            calls.append("direct")
+            state.last_exception = DownloadError("ERROR: Unable to extract video data")
+
+        def alternate_urls_stage(state):
+            # No alternate URLs for this platform, so the stage doesn't run anything.
+            calls.append("alternate-urls")
+
+        stages = [("direct", direct_stage), ("alternate-urls", alternate_urls_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages):
+            with mock.patch("downloader.asyncio.sleep", new_callable=mock.AsyncMock) as mock_sleep:
+                response = downloader_module.download(
+                    "https://www.youtube.com/shorts/abc", detect_repost=False, retries=3, retry_multiplier=0
+                )
+
+        self.assertEqual(calls, ["direct", "alternate-urls", "direct", "direct"])
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertEqual(response["errorKind"], "unknown")
+
+    def test_download_waits_for_retry_after_and_skips_unclassified_retries_before_fallbacks(self):
+        import io
+
+        from yt_dlp.networking.common import Response
+        from yt_dlp.networking.exceptions import HTTPError
+        from yt_dlp.utils import DownloadError
+
+        def rate_limited_error():
+            response = Response(io.BytesIO(b""), "https://example.com", {"Retry-After": "7"}, status=429, reason="Too Many Requests")
+            cause = HTTPError(response)
+            return DownloadError(f"ERROR: {cause}", exc_info=(type(cause), cause, None))
+
+        calls = []
+
+        def rate_limited_stage(state):
+            calls.append("direct")
+            state.last_exception = rate_limited_error()
+
+        def unparsed_stage(state):
+            calls.append("embed")
+            state.last_exception = DownloadError("ERROR: Unable to extract universal data for rehydration")
+
+        def last_stage(state):
+            calls.append("playwright")
+            state.last_exception = Exception("Playwright embed download failed")
+
+        stages = [("direct", rate_limited_stage), ("embed", unparsed_stage), ("playwright", last_stage)]
+        with mock.patch("downloader._get_download_stages", return_value=stages):
+            with mock.patch("downloader.asyncio.sleep", new_callable=mock.AsyncMock) as mock_sleep:
+                response = downloader_module.download(
+                    "https://www.tiktok.com/@test/video/123", detect_repost=False, retries=2, retry_multiplier=1
+                )
+
+        # The unclassified error only gets a retry on the last stage.
+        self.assertEqual(calls, ["direct", "direct", "embed", "playwright", "playwright"])
+        self.assertEqual(mock_sleep.call_count, 2)
+        self.assertGreaterEqual(mock_sleep.call_args_list[0].args[0], 7)
+        self.assertEqual(response["errorKind"], "unknown")
+
+    def test_download_with_retries_keeps_partials_until_the_job_ends(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        partial_file = os.path.join(tmpdir, "clip.mp4.part")
+        final_file = os.path.join(tmpdir, "clip.mp4")
+        seen_partials = []
+
+        def resumable_stage(state):
+            seen_partials.append(state.partials)
+            if len(seen_partials) == 1:
+                with open(partial_file, "wb") as fp:
+                    fp.write(b"half")
+                state.partials.add(partial_file)
+                state.last_exception = ConnectionResetError("Connection reset by peer")
+                return
+            # The retry resumes where the first attempt stopped.
+            self.assertTrue(os.path.exists(partial_file))
+            os.replace(partial_file, final_file)
+            state.partials.add(partial_file, final_file)
+            state.result = {"id": "clip", "_filename": final_file, "duration": 5}
+
+        with mock.patch("downloader._get_download_stages", return_value=[("direct", resumable_stage)]):
+            response = download_with_retries(
+                "https://www.youtube.com/shorts/abc", retries=3, retry_multiplier=0, detect_repost=False
+            )
+
+        self.assertEqual(response["fileName"], final_file)
+        self.assertIs(seen_partials[0], seen_partials[1])
+        self.assertEqual(os.listdir(tmpdir), ["clip.mp4"])
+
+    def test_download_stops_a_stage_that_exceeds_timeout_before_moving_on(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        fast_file = os.path.join(tmpdir, "fast.mp4")
+        events = []
+
+        def slow_stage(state):
+            # Stands in for an attempt whose worker is killed once the stage is told to stop.
+            events.append(("slow exited", state.cancelled.wait(5)))
+
+        def fast_stage(state):
+            events.append(("fast", None))
+            with open(fast_file, "wb") as fp:
+                fp.write(b"video")
+            state.result = {"id": "fast", "_filename": fast_file, "duration": 5}
+
+        with mock.patch("downloader._get_download_stages", return_value=[("slow", slow_stage), ("fast", fast_stage)]):
+            with mock.patch("downloader.get_download_stage_timeout", return_value=0.05):
+                response = downloader_module.download("https://www.youtube.com/shorts/abc", detect_repost=False)
+
+        # The next stage only starts once the timed-out one has exited.
+        self.assertEqual(events, [("slow exited", True), ("fast", None)])
+        self.assertEqual(response["videoId"], "fast")
+        self.assertEqual(response["fileName"], fast_file)
+
+    def test_cancelled_download_async_waits_for_its_stage_to_stop(self):
+        events = []
+        started = threading.Event()
+
+        def slow_stage(state):
+            started.set()
+            events.append(("slow exited", state.cancelled.wait(5)))
+
+        async def run_scenario():
+            task = asyncio.ensure_future(
+                downloader_module.download_async("https://www.youtube.com/shorts/abc", detect_repost=False)
+            )
+            await asyncio.to_thread(started.wait, 5)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return list(events)
+
+        with mock.patch("downloader._get_download_stages", return_value=[("slow", slow_stage)]):
+            events_at_cancel = asyncio.run(run_scenario())
+
+        self.assertEqual(events_at_cancel, [("slow exited", True)])
+
+    def test_attempt_download_extracts_once_across_format_candidates(self):
+        from yt_dlp.utils import DownloadError
+
+        ydl = mock.MagicMock()
+        instance = ydl.__enter__.return_value
+        instance.params = {}
+        instance.extract_info.return_value = {"id": "abc", "formats": [{"format_id": "1"}]}
+        instance.process_ie_result.side_effect = [DownloadError("format 1 failed"), {"id": "abc", "_filename": "abc.mp4"}]
+
+        attempted_formats = []
+        with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl):
+            result, selected_format, last_exception = downloader_module._attempt_download(
+                "https://www.reddit.com/r/test/comments/abc/title/",
+                attempted_formats,
+            )
+
+        self.assertEqual(result["_filename"], "abc.mp4")
+        self.assertEqual(selected_format, "bv*+ba/b")
+        self.assertIsNone(last_exception)
+        instance.extract_info.assert_called_once_with(
+            "https://www.reddit.com/r/test/comments/abc/title/", download=False, process=False
+        )
+        self.assertEqual(instance.process_ie_result.call_count, 2)
+        self.assertEqual(instance.params["format"], "bv*+ba/b")
+        instance.build_format_selector.assert_called_with("bv*+ba/b")
+        # Each candidate processes its own copy of the extracted metadata.
+        first_info = instance.process_ie_result.call_args_list[0].args[0]
+        self.assertIsNot(first_info, instance.extract_info.return_value)
+
+    def test_download_reuses_metadata_extracted_for_the_repost_check(self):
+        url = "https://www.reddit.com/r/test/comments/abc/title/"
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        video_file = os.path.join(tmpdir, "abc.mp4")
+        with open(video_file, "wb") as fp:
+            fp.write(b"video")
+
+        ydl = mock.MagicMock()
+        ydl.params = {}
+        ydl.extract_info.return_value = {"id": "abc", "formats": [{"format_id": "1"}]}
+        ydl.process_ie_result.return_value = {"id": "abc", "_filename": video_file, "duration": 5}
+        with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl) as ydl_class:
+            response = downloader_module.download(url)
+
+        self.assertEqual(response["fileName"], video_file)
+        self.mock_find_latest_post.assert_any_call("abc", ["reddit", "MattIsLazy"])
+        # The download goes through the YoutubeDL that did the extraction, and closes it after.
+        ydl_class.assert_called_once()
+        ydl.extract_info.assert_called_once_with(url, download=False, process=False)
+        self.assertEqual(ydl.process_ie_result.call_args.args[0]["id"], "abc")
+        ydl.close.assert_called_once()
+
+    def test_download_extracts_again_in_the_worker_after_a_worker_repost_check(self):
+        url = "https://www.reddit.com/r/test/comments/abc/title/"
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        video_file = os.path.join(tmpdir, "abc.mp4")
+        with open(video_file, "wb") as fp:
+            fp.write(b"video")
+
+        pool = mock.Mock()
+        pool.extract.return_value = {"id": "abc"}
+        pool.run.return_value = {
+            "result": {"id": "abc", "_filename": video_file, "duration": 5},
+            "selected_format": "b",
+            "attempted_formats": ["b"],
+            "error": None,
+            "partial_paths": [],
+        }
+        with mock.patch("downloader.get_ytdlp_worker_pool", return_value=pool):
+            response = downloader_module.download(url)
+
+        self.assertEqual(response["fileName"], video_file)
+        pool.extract.assert_called_once()
+        # Only the video ID comes back from the worker; the download job extracts for itself.
+        pool.run.assert_called_once()
+        self.assertNotIn("raw_info", pool.run.call_args.kwargs)
+
+    def test_download_window_covers_only_what_survives_truncation(self):
+        with mock.patch("downloader.FFmpegFD.available", return_value=True):
+            self.assertEqual(downloader_module._get_download_window({"duration": 2400}), 183)
+            self.assertIsNone(downloader_module._get_download_window({"duration": 120}))
+            self.assertIsNone(downloader_module._get_download_window({"duration": 2400, "is_live": True}))
+        with mock.patch("downloader.FFmpegFD.available", return_value=False):
+            self.assertIsNone(downloader_module._get_download_window({"duration": 2400}))
+
+    def test_long_video_downloads_leading_window_and_reports_it(self):
+        ydl = mock.MagicMock()
+        instance = ydl.__enter__.return_value
+        instance.params = {}
+        instance.extract_info.return_value = {"id": "long", "duration": 2400, "formats": []}
+        downloaded = {"id": "long", "duration": 2400, "requested_downloads": [
+            {"filepath": "long.mp4", "section_start": 0, "section_end": 183}
+        ]}
+        instance.process_ie_result.return_value = downloaded
+
+        with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl):
+            with mock.patch("downloader.FFmpegFD.available", return_value=True):
+                with mock.patch("downloader.os.path.exists", return_value=True):
+                    response = downloader_module.download("https://www.twitch.tv/videos/123", detect_repost=False)
+
+        ranges = instance.params["download_ranges"]
+        self.assertEqual(list(ranges({"duration": 2400}, instance)), [{"start_time": 0, "end_time": 183}])
+        self.assertEqual(response["duration"], 2400)
+        self.assertEqual(response["downloadedDuration"], 183)
+
+    def test_split_streams_are_left_unmerged_only_when_they_will_be_transcoded(self):
+        def merged(video_format, audio_format):
+            return lambda _ctx: iter([{"format_id": "merged", "requested_formats": [video_format, audio_format]}])
+
+        audio = {"format_id": "a", "vcodec": "none", "acodec": "mp4a.40.2", "filesize": 500_000}
+        vp9 = {"format_id": "v", "vcodec": "vp9", "acodec": "none", "filesize": 2_000_000}
+        big_h264 = {"format_id": "v", "vcodec": "avc1.64001F", "acodec": "none", "filesize": 9_000_000}
+        small_h264 = {"format_id": "v", "vcodec": "avc1.64001F", "acodec": "none", "filesize": 2_000_000}
+        unknown_size_h264 = {"format_id": "v", "vcodec": "avc1.64001F", "acodec": "none"}
+
+        for video_format, split in ((vp9, True), (big_h264, True), (small_h264, False), (unknown_size_h264, False)):
+            with self.subTest(video_format=video_format):
+                selector = downloader_module._split_streams_for_transcode(merged(audio, video_format), 60, 8_000_000)
+                selected = list(selector({}))
+                if split:
+                    self.assertEqual([fmt["split_stream"] for fmt in selected], ["video", "audio"])
+                    self.assertEqual([fmt["format_id"] for fmt in selected], ["v", "a"])
+                else:
+                    self.assertEqual([fmt["format_id"] for fmt in selected], ["merged"])
+
+        ydl = mock.MagicMock()
+        instance = ydl.__enter__.return_value
+        instance.params = {}
+        instance.extract_info.return_value = {"id": "abc", "duration": 60, "formats": []}
+        instance.process_ie_result.return_value = {
+            "id": "abc",
+            "duration": 60,
+            "vcodec": "none",
+            "acodec": "mp4a.40.2",
+            "requested_downloads": [
+                {"filepath": "abc.video.mp4", "split_stream": "video", "vcodec": "vp9", "acodec": "none", "height": 720},
+                {"filepath": "abc.audio.m4a", "split_stream": "audio", "vcodec": "none", "acodec": "mp4a.40.2"},
+            ],
+        }
+        with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl):
+            with mock.patch("downloader.os.path.exists", return_value=True):
+                response = downloader_module.download("https://www.reddit.com/r/test/comments/abc/title/", detect_repost=False)
+
+        self.assertEqual(response["fileName"], "abc.video.mp4")
+        self.assertEqual(response["audioFileName"], "abc.audio.m4a")
+        self.assertEqual(response["mediaInfo"].audio_path, "abc.audio.m4a")
+        self.assertEqual(response["mediaInfo"].video_codec, "vp9")
+        self.assertTrue(response["mediaInfo"].has_audio)
+
+    def test_plan_audio_format_prefers_copyable_audio_then_smallest_sufficient(self):
+        info = {
+            "duration": 300,
+            "formats": [
+                {"format_id": "18", "vcodec": "avc1", "acodec": "mp4a.40.2", "ext": "mp4", "filesize": 20_000_000},
+                {"format_id": "139", "vcodec": "none", "acodec": "mp4a.40.5", "ext": "m4a", "abr": 48, "filesize": 1_800_000},
+                {"format_id": "140", "vcodec": "none", "acodec": "mp4a.40.2", "ext": "m4a", "abr": 129, "filesize": 4_900_000},
+                {"format_id": "251", "vcodec": "none", "acodec": "opus", "ext": "webm", "abr": 160, "filesize": 6_000_000},
+            ],
+        }
+        self.assertEqual(downloader_module._plan_audio_format(info, 8_000_000), "140")
+
+        # Nothing copyable fits: the smallest format at or above the MP3 bitrate, or the best one below it.
+        self.assertEqual(downloader_module._plan_audio_format(info, 1_000_000), "251")
+        info["formats"].append({"format_id": "250", "vcodec": "none", "acodec": "opus", "ext": "webm", "abr": 70})
+        info["duration"] = 600
+        self.assertEqual(downloader_module._plan_audio_format(info, 1_000_000), "140")
+        self.assertIsNone(downloader_module._plan_audio_format({"formats": [info["formats"][0]]}, 8_000_000))
+
+        self.assertEqual(downloader_module._get_audio_format_candidates(8_000_000), ["bestaudio[filesize<8M]/bestaudio/best", "best"])
+
+    def test_fragment_options_follow_platform_and_connection_budget(self):
+        from fragment_downloads import ConnectionBudget, get_fragment_concurrency, get_fragment_ydl_opts
+
+        with mock.patch.dict(os.environ, {"TIKBOT_MAX_DOWNLOAD_CONNECTIONS": "10"}):
+            with mock.patch("fragment_downloads._connection_budget", None):
+                ydl = mock.MagicMock()
+                instance = ydl.__enter__.return_value
+                instance.params = {}
+                instance.extract_info.return_value = {"id": "clip", "formats": []}
+                instance.process_ie_result.return_value = {"id": "clip", "_filename": "clip.mp4"}
+                with mock.patch("downloader.yt_dlp.YoutubeDL", return_value=ydl) as mock_ydl:
+                    downloader_module._run_download_attempt("https://clips.twitch.tv/SomeClip", [])
+                ydl_opts = mock_ydl.call_args.args[0]
+                self.assertEqual(ydl_opts["concurrent_fragment_downloads"], 8)
+                self.assertNotIn("http_chunk_size", ydl_opts)
+                self.assertEqual(downloader_module.get_connection_budget().in_use, 0)
+
+        self.assertEqual(get_fragment_ydl_opts("youtube")["http_chunk_size"], 10 * 1024 * 1024)
+        self.assertEqual(get_fragment_concurrency("tiktok"), 1)
+        with mock.patch.dict(os.environ, {"TIKBOT_FRAGMENT_CONCURRENCY": "3", "TIKBOT_FRAGMENT_CONCURRENCY_TWITCH": "12"}):
+            self.assertEqual(get_fragment_concurrency("reddit"), 3)
+            self.assertEqual(get_fragment_concurrency("twitch"), 12)
+        with mock.patch.dict(os.environ, {"TIKBOT_HTTP_CHUNK_SIZE_MB": "0"}):
+            self.assertNotIn("http_chunk_size", get_fragment_ydl_opts("youtube"))
+
+        budget = ConnectionBudget(10)
+        self.assertEqual(budget.acquire(8), 8)
+        self.assertEqual(budget.acquire(8), 2)
+        waiter = threading.Thread(target=lambda: budget.release(budget.acquire(4)))
+        waiter.start()
+        waiter.join(0.2)
+        self.assertTrue(waiter.is_alive())
+        budget.release(2)
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        budget.release(8)
+        self.assertEqual(budget.in_use, 0)
+
     def test_get_alternate_urls_maps_kkclip_reels_to_instagram(self):
         alternates = downloader_module._get_alternate_urls(
             "https://www.kkclip.com/reel/DaFy7GYIKI5/?utm_source=ig_web_copy_link",
@@ -732,6 +2403,41 @@ class TestDownloaderFormatSelection(DownloaderTestCase):
             )
         )
 
+    def test_media_info_prefers_probe_and_uses_section_duration(self):
+        from media_info import MediaInfo
+
+        mediaInfo = MediaInfo.from_ytdlp(
+            "video.mp4",
+            {
+                "duration": 600,
+                "requested_formats": [
+                    {"vcodec": "avc1.64001F", "acodec": "none", "width": 1280, "height": 720, "vbr": 900},
+                    {"vcodec": "none", "acodec": "mp4a.40.2", "abr": 128},
+                ],
+                "requested_downloads": [{"section_start": 0, "section_end": 183}],
+            },
+        )
+        self.assertTrue(mediaInfo.has_video)
+        self.assertEqual(mediaInfo.video_codec, "h264")
+        self.assertEqual(mediaInfo.duration, 183)
+        self.assertEqual((mediaInfo.width, mediaInfo.height), (1280, 720))
+        self.assertEqual(mediaInfo.audio_bitrate, 128_000)
+
+        probe = {"format": {"format_name": "mov,mp4,m4a", "duration": "182.9"}, "streams": [{"codec_type": "video", "codec_name": "h264"}]}
+        with mock.patch("media_info.ffmpeg.probe", return_value=probe) as mock_probe:
+            mediaInfo.load()
+            mediaInfo.load()
+        mock_probe.assert_called_once()
+        self.assertEqual(mediaInfo.duration, 182.9)
+        self.assertFalse(mediaInfo.has_audio)
+        self.assertEqual((mediaInfo.width, mediaInfo.height), (1280, 720))
+
+    def test_parse_ffmpeg_output_duration_uses_last_stats_line(self):
+        from media_info import parse_ffmpeg_output_duration
+
+        self.assertEqual(parse_ffmpeg_output_duration(b"time=00:00:01.50 ...\rtime=01:02:03.25 bitrate=N/A\n"), 3723.25)
+        self.assertIsNone(parse_ffmpeg_output_duration(""))
+
     def test_downloaded_file_has_video_rejects_audio_only_metadata(self):
         self.assertFalse(
             downloader_module._downloaded_file_has_video(
@@ -743,6 +2449,50 @@ class TestDownloaderFormatSelection(DownloaderTestCase):
 
 class TestTikTokPlaywrightFallback(unittest.TestCase):
 
+    def test_candidate_download_resumes_partial_file_with_range_request(self):
+        import http.server
+
+        body = b"\x00\x00\x00\x20ftypisom" + bytes(range(256)) * 64
+        requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *_args):
+                pass
+
+            def do_GET(self):
+                requests.append((self.headers.get("Range"), self.headers.get("If-Range")))
+                start = int(self.headers["Range"][len("bytes="):-1]) if self.headers.get("Range") else 0
+                self.send_response(206 if start else 200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body) - start))
+                if start:
+                    self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+                self.end_headers()
+                self.wfile.write(body[start:])
+
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        output_path = os.path.join(tmpdir, "123.mp4")
+        # What an attempt killed partway through the body leaves behind.
+        with open(output_path + ".part", "wb") as fp:
+            fp.write(body[:5000])
+        with open(output_path + ".part.json", "w") as fp:
+            fp.write(f'{{"total": {len(body)}, "etag": "\\"v1\\""}}')
+
+        url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4?signature=new"
+        self.assertTrue(tiktok_fallback_module._download_candidate_url(url, output_path, "https://www.tiktok.com/"))
+
+        self.assertEqual(requests, [("bytes=5000-", '"v1"')])
+        with open(output_path, "rb") as fp:
+            self.assertEqual(fp.read(), body)
+        self.assertEqual(os.listdir(tmpdir), ["123.mp4"])
+
     def test_rejects_webvtt_payload_signature(self):
         self.assertTrue(
             tiktok_fallback_module._looks_like_webvtt_payload(
@@ -861,14 +2611,173 @@ class TestTikTokPlaywrightFallback(unittest.TestCase):
                 "partial.mp4",
                 20000,
                 0.01,
+                page_url="https://www.tiktok.com/@test/video/123",
             )
 
         self.assertIsNone(result)
         self.assertTrue(fake_context.process.terminated)
         self.assertFalse(fake_context.process.killed)
-        self.assertEqual(fake_context.process.join_calls, [0.01, 5])
+        self.assertEqual(fake_context.process.join_calls[-1], 5)
+        self.assertTrue(all(timeout <= 0.01 for timeout in fake_context.process.join_calls[:-1]))
         self.assertTrue(fake_context.queue.closed)
         self.assertTrue(fake_context.queue.joined)
 
+    def test_short_link_is_resolved_once_across_stages(self):
+        for cache in (tiktok_fallback_module._short_url_cache, downloader_module._video_id_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+        short_url = "https://vt.tiktok.com/ZSCDC8bDV/"
+
+        with mock.patch(
+            "tiktok_embed_fallback._fetch_tiktok_short_url",
+            return_value="https://www.tiktok.com/@test/video/456?is_from_webapp=1",
+        ) as mock_fetch:
+            self.assertEqual(tiktok_fallback_module.get_tiktok_embed_url(short_url), "https://www.tiktok.com/embed/v2/456")
+            self.assertEqual(
+                tiktok_fallback_module.get_tiktok_page_url(short_url),
+                "https://www.tiktok.com/@test/video/456?is_from_webapp=1",
+            )
+            self.assertEqual(downloader_module.resolve_video_id(short_url, allow_network=True), "456")
+
+        mock_fetch.assert_called_once_with(short_url)
+
+    def test_blocks_page_assets_and_trackers_but_not_media(self):
+        should_block = tiktok_fallback_module._should_block_playwright_request
+        self.assertTrue(should_block("https://p16-sign.tiktokcdn.com/avatar.jpeg", "image"))
+        self.assertTrue(should_block("https://sf16-website.tiktokcdn.com/font.woff2", "font"))
+        self.assertTrue(should_block("https://mon.tiktokv.com/monitor_browser/collect/batch/", "xhr"))
+        self.assertFalse(should_block("https://v16-webapp-prime.tiktokcdn.com/video/tos/o8.mp4", "media"))
+        self.assertFalse(should_block("https://www.tiktok.com/embed/v2/123", "document"))
+
+    def test_playwright_job_exits_early_on_first_media_response(self):
+        media_url = "https://v16-webapp-prime.tiktokcdn.com/video/tos/useast5/o8.mp4?item_id=123"
+
+        class FakeResponse:
+            url = media_url
+            headers = {"content-type": "video/mp4"}
+            request = mock.Mock(resource_type="media")
+
+        page = mock.MagicMock()
+        handlers = {}
+        page.on.side_effect = lambda event, handler: handlers.__setitem__(event, handler)
+        page.goto.side_effect = lambda *_args, **_kwargs: handlers["response"](FakeResponse())
+        browser = mock.MagicMock()
+        browser.new_context.return_value.new_page.return_value = page
+
+        with mock.patch("tiktok_embed_fallback._download_candidate_url", return_value=True) as mock_download:
+            result = tiktok_fallback_module._run_tiktok_playwright_job(
+                browser, "https://www.tiktok.com/embed/v2/123", "out.mp4", 20000
+            )
+
+        self.assertEqual(result["download_url"], media_url)
+        self.assertEqual(set(result["timings"]), {"navigate", "first_media_response", "download"})
+        mock_download.assert_called_once_with(media_url, "out.mp4", "https://www.tiktok.com/embed/v2/123")
+        self.assertEqual(page.goto.call_args.kwargs["wait_until"], "domcontentloaded")
+        browser.new_context.return_value.route.assert_called_once()
+        page.wait_for_response.assert_not_called()
+        page.content.assert_not_called()
+
+    def _fake_worker_context(self, handle_job):
+        """Multiprocessing stand-in whose processes are threads running a fake browser loop."""
+        import queue
+
+        class FakeProcess:
+            def __init__(self, target, args, daemon=None):
+                self.args = args
+                self.pid = None
+                self.exitcode = None
+                self.terminated = False
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+
+            def _loop(self):
+                job_queue, result_queue = self.args
+                while True:
+                    job = job_queue.get()
+                    if job is None:
+                        return
+                    result = handle_job(job)
+                    if result is not None:
+                        result_queue.put({"job_id": job["job_id"], "result": result, "error": None})
+
+            def start(self):
+                self._thread.start()
+
+            def join(self, timeout=None):
+                if not self.terminated:
+                    self._thread.join(timeout)
+
+            def is_alive(self):
+                return self._thread.is_alive() and not self.terminated
+
+            def terminate(self):
+                self.terminated = True
+
+            def kill(self):
+                self.terminated = True
+
+        class FakeContext:
+            def __init__(self):
+                self.processes = []
+
+            def Queue(self, maxsize=0):
+                return queue.Queue(maxsize)
+
+            def Process(self, target, args, daemon=None):
+                process = FakeProcess(target, args, daemon)
+                self.processes.append(process)
+                return process
+
+        return FakeContext()
+
+    def test_warm_worker_reuses_process_and_recycles_after_max_jobs(self):
+        fake_context = self._fake_worker_context(lambda job: {"file_path": job["page_url"]})
+        worker = tiktok_fallback_module.PlaywrightBrowserWorker(max_jobs=2, max_rss_bytes=0)
+
+        with mock.patch("tiktok_embed_fallback._get_multiprocessing_context", return_value=fake_context):
+            results = [
+                worker.run(f"https://www.tiktok.com/embed/v2/{video_id}", None, 20000, 5)
+                for video_id in ("1", "2", "3")
+            ]
+            worker.stop()
+
+        self.assertEqual([result["file_path"] for result in results], [
+            "https://www.tiktok.com/embed/v2/1",
+            "https://www.tiktok.com/embed/v2/2",
+            "https://www.tiktok.com/embed/v2/3",
+        ])
+        # Recycled after two jobs, with the replacement started straight away.
+        self.assertEqual(len(fake_context.processes), 2)
+        self.assertEqual(worker.jobs_done, 1)
+
+    def test_warm_worker_hard_timeout_terminates_process(self):
+        fake_context = self._fake_worker_context(lambda job: None)
+        worker = tiktok_fallback_module.PlaywrightBrowserWorker(max_jobs=0, max_rss_bytes=0)
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, True)
+        partial = os.path.join(tmpdir, "partial.mp4")
+        with open(partial, "wb") as fp:
+            fp.write(b"partial")
+
+        with mock.patch("tiktok_embed_fallback._get_multiprocessing_context", return_value=fake_context):
+            result = worker.run("https://www.tiktok.com/embed/v2/1", partial, 20000, 0.05)
+
+        self.assertIsNone(result)
+        self.assertTrue(fake_context.processes[0].terminated)
+        self.assertFalse(os.path.exists(partial))
+
+    def test_warm_worker_pool_kills_a_cancelled_job(self):
+        fake_context = self._fake_worker_context(lambda job: None)
+        pool = tiktok_fallback_module.PlaywrightWorkerPool(1, max_jobs=0, max_rss_bytes=0)
+        cancel = threading.Event()
+        threading.Timer(0.1, cancel.set).start()
+
+        with mock.patch("tiktok_embed_fallback._get_multiprocessing_context", return_value=fake_context):
+            started = time.monotonic()
+            result = pool.run("https://www.tiktok.com/embed/v2/1", None, 20000, 30, cancelled=cancel.is_set)
+
+        self.assertIsNone(result)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(fake_context.processes[0].terminated)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,19 @@
+import itertools
 import json
 import logging
 import multiprocessing
 import os
+import queue
 import re
+import threading
 import time
+import urllib.error
 import urllib.request
 from urllib.parse import urlparse
 
+from partial_downloads import PartialDownloads, remove_partial_files
+from ttl_cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
 _TIKTOK_VIDEO_ID_RE = re.compile(r"/(?:video|photo)/(?P<id>\d+)")
@@ -21,6 +28,20 @@ _SUBTITLE_CONTENT_TYPES = (
     "application/cea-708",
 )
 _HTML_URL_RE = re.compile(r'https://[^"\'<>\s]+')
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(?P<start>\d+)-\d+/(?P<total>\d+)")
+# Requests the scraper never needs: page assets and analytics/telemetry endpoints.
+_BLOCKED_RESOURCE_TYPES = ("image", "font", "stylesheet")
+_TRACKER_HOSTS = (
+    "analytics.tiktok.com",
+    "mon.tiktokv.com",
+    "mcs.tiktokv.com",
+    "log.tiktokv.com",
+    "mon-va.byteoversea.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "connect.facebook.net",
+)
 
 
 def _extract_host(url: str) -> str:
@@ -38,7 +59,28 @@ def _extract_tiktok_video_id(url: str) -> str | None:
     return None
 
 
+def get_resolve_cache_ttl() -> float:
+    try:
+        return max(0.0, float(os.getenv("TIKBOT_RESOLVE_CACHE_TTL", "3600")))
+    except ValueError:
+        return 3600.0
+
+
+# Every fallback stage resolves short links through here; forked Playwright workers inherit it.
+# Failures aren't cached so a retry can resolve the link again.
+_short_url_cache = TTLCache(max_entries=2048, ttl_seconds=get_resolve_cache_ttl(), negative_ttl_seconds=0)
+
+
 def _resolve_tiktok_short_url(url: str) -> str | None:
+    hit, resolved_url = _short_url_cache.get(url)
+    if hit:
+        return resolved_url
+    resolved_url = _fetch_tiktok_short_url(url)
+    _short_url_cache.put(url, resolved_url)
+    return resolved_url
+
+
+def _fetch_tiktok_short_url(url: str) -> str | None:
     try:
         request = urllib.request.Request(
             url,
@@ -174,49 +216,115 @@ def _extract_tiktok_media_urls_from_html(html: str, video_id: str | None) -> lis
     return candidates
 
 
+def _load_resume_state(part_path: str) -> dict | None:
+    """Return how far an earlier fetch of `part_path` got, or None if it cannot be resumed."""
+    try:
+        offset = os.path.getsize(part_path)
+        with open(part_path + ".json") as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    total = state.get("total")
+    if not offset or not isinstance(total, int) or offset >= total:
+        return None
+    return {"offset": offset, "total": total, "etag": state.get("etag")}
+
+
+def _discard_resume_files(part_path: str):
+    remove_partial_files([part_path, part_path + ".json"])
+
+
+def _get_resumed_offset(response, resume: dict | None) -> int | None:
+    """The offset a 206 response continues from, 0 when the body starts from the beginning,
+    or None when it is a range of some other file."""
+    if not resume or response.status != 206:
+        return 0
+    match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+    if match and int(match.group("start")) == resume["offset"] and int(match.group("total")) == resume["total"]:
+        return resume["offset"]
+    return None
+
+
 def _download_candidate_url(
     download_url: str,
     output_path: str,
     referer: str,
 ) -> bool:
+    """Fetch a candidate into `output_path`, resuming the .part file an earlier attempt left.
+
+    The candidate URL is re-signed on every scrape, so a resume is checked against the total size
+    and ETag recorded in the .part.json sidecar instead of the URL.
+    """
+    part_path = output_path + ".part"
+    resume = _load_resume_state(part_path)
+    headers = {
+        "User-Agent": "Mozilla/5.0",
+        "Referer": referer,
+        "Accept": "*/*",
+    }
+    if resume:
+        headers["Range"] = f"bytes={resume['offset']}-"
+        if resume["etag"]:
+            headers["If-Range"] = resume["etag"]
     try:
-        request = urllib.request.Request(
-            download_url,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Referer": referer,
-                "Accept": "*/*",
-            },
-        )
+        request = urllib.request.Request(download_url, headers=headers)
         with urllib.request.urlopen(request, timeout=30) as response:
-            first_chunk = response.read(4096)
-            content_type = response.headers.get("Content-Type", "")
-            if not first_chunk:
-                logger.info("TikTok candidate returned no body bytes: %s", download_url)
-                return False
-            if _looks_like_webvtt_payload(first_chunk):
-                logger.info(
-                    "Rejected TikTok candidate with WEBVTT payload (content_type=%s): %s",
-                    content_type,
-                    download_url,
-                )
-                return False
-            if not _looks_like_video_payload(first_chunk):
+            offset = _get_resumed_offset(response, resume)
+            if offset is None:
                 logger.info(
-                    "Rejected TikTok candidate that did not look like media bytes (content_type=%s): %s",
-                    content_type,
+                    "Discarding partial TikTok download; %s does not continue it: %s",
+                    response.headers.get("Content-Range"),
                     download_url,
                 )
+                _discard_resume_files(part_path)
                 return False
-
-            with open(output_path, "wb") as handle:
+            total = resume["total"] if offset else None
+            if offset:
+                logger.info("Resuming TikTok candidate at byte %s of %s: %s", offset, total, download_url)
+                first_chunk = b""
+            else:
+                first_chunk = response.read(4096)
+                content_type = response.headers.get("Content-Type", "")
+                if not first_chunk:
+                    logger.info("TikTok candidate returned no body bytes: %s", download_url)
+                    return False
+                if _looks_like_webvtt_payload(first_chunk):
+                    logger.info(
+                        "Rejected TikTok candidate with WEBVTT payload (content_type=%s): %s",
+                        content_type,
+                        download_url,
+                    )
+                    return False
+                if not _looks_like_video_payload(first_chunk):
+                    logger.info(
+                        "Rejected TikTok candidate that did not look like media bytes (content_type=%s): %s",
+                        content_type,
+                        download_url,
+                    )
+                    return False
+                if response.headers.get("Content-Length", "").isdigit():
+                    total = int(response.headers["Content-Length"])
+                    with open(part_path + ".json", "w") as handle:
+                        json.dump({"total": total, "etag": response.headers.get("ETag")}, handle)
+
+            with open(part_path, "ab" if offset else "wb") as handle:
                 handle.write(first_chunk)
                 while True:
                     chunk = response.read(65536)
                     if not chunk:
                         break
                     handle.write(chunk)
+        if total and os.path.getsize(part_path) < total:
+            logger.info("TikTok candidate ended after %s of %s bytes: %s", os.path.getsize(part_path), total, download_url)
+            return False
+        os.replace(part_path, output_path)
+        _discard_resume_files(part_path)
         return True
+    except urllib.error.HTTPError as exc:
+        logger.info("Failed to fetch TikTok candidate %s: %s", download_url, exc)
+        if exc.code == 416:
+            _discard_resume_files(part_path)
+        return False
     except Exception as exc:
         logger.info("Failed to fetch TikTok candidate %s: %s", download_url, exc)
         return False
@@ -237,24 +345,49 @@ def download_tiktok_embed_video_playwright(
     video_url: str,
     output_path: str | None = None,
     timeout_ms: int = 20000,
+    partials: PartialDownloads | None = None,
+    cancelled=None,
 ) -> dict | None:
+    """Download a TikTok video by scraping its page in a browser.
+
+    With `partials`, an unfinished download is left in place and registered there for the next
+    attempt to resume; otherwise it is deleted. The browser is killed once `cancelled()` returns
+    true.
+    """
     hard_timeout_seconds = _get_playwright_hard_timeout_seconds(timeout_ms)
-    return _download_tiktok_playwright_with_hard_timeout(
-        video_url,
-        output_path,
-        timeout_ms,
-        hard_timeout_seconds,
-    )
+    # Resolve once here; workers get the page URL rather than resolving it again.
+    page_url = get_tiktok_page_url(video_url)
+    if not page_url:
+        return None
 
+    keep_partial = partials is not None
+    output_name = _get_tiktok_output_name_for_page_url(page_url, output_path)
+    if keep_partial:
+        partials.add(output_name)
+    pool = get_playwright_worker_pool()
+    if pool is None:
+        result = _download_tiktok_playwright_with_hard_timeout(
+            video_url,
+            output_path,
+            timeout_ms,
+            hard_timeout_seconds,
+            page_url=page_url,
+            keep_partial=keep_partial,
+            cancelled=cancelled,
+        )
+    else:
+        result = pool.run(
+            page_url, output_path, timeout_ms, hard_timeout_seconds, keep_partial=keep_partial, cancelled=cancelled
+        )
+    if result is None and not keep_partial:
+        # Only the resume files; output_name itself may be a finished download of another job.
+        _discard_resume_files(output_name + ".part")
+    return result
 
-def _get_tiktok_output_name(video_url: str, output_path: str | None) -> str:
-    if output_path:
-        return output_path
-    page_url = get_tiktok_video_page_url(video_url) or get_tiktok_embed_url(video_url)
-    video_id = None
-    if page_url:
-        video_id = _extract_tiktok_embed_id(page_url) or _extract_tiktok_video_id(page_url)
-    return f"{video_id}.mp4" if video_id else "tiktok.mp4"
+
+def get_tiktok_page_url(video_url: str) -> str | None:
+    """Return the page the Playwright fallback should load: the video page, else the embed page."""
+    return get_tiktok_video_page_url(video_url) or get_tiktok_embed_url(video_url)
 
 
 def _get_playwright_hard_timeout_seconds(timeout_ms: int) -> float:
@@ -274,9 +407,15 @@ def _get_multiprocessing_context():
         return multiprocessing.get_context()
 
 
-def _download_tiktok_playwright_worker(queue, video_url: str, output_path: str | None, timeout_ms: int):
+def _download_tiktok_playwright_worker(
+    queue,
+    video_url: str,
+    output_path: str | None,
+    timeout_ms: int,
+    page_url: str | None = None,
+):
     try:
-        result = _download_tiktok_playwright_sync(video_url, output_path, timeout_ms)
+        result = _download_tiktok_playwright_sync(video_url, output_path, timeout_ms, page_url)
         queue.put({"result": result, "error": None})
     except BaseException as exc:
         logger.exception("Playwright worker crashed")
@@ -288,31 +427,42 @@ def _download_tiktok_playwright_with_hard_timeout(
     output_path: str | None,
     timeout_ms: int,
     hard_timeout_seconds: float,
+    page_url: str | None = None,
+    keep_partial: bool = False,
+    cancelled=None,
 ) -> dict | None:
-    output_name = _get_tiktok_output_name(video_url, output_path)
+    page_url = page_url or get_tiktok_page_url(video_url)
+    if not page_url:
+        return None
+    output_name = _get_tiktok_output_name_for_page_url(page_url, output_path)
     context = _get_multiprocessing_context()
     queue = context.Queue(maxsize=1)
     process = context.Process(
         target=_download_tiktok_playwright_worker,
-        args=(queue, video_url, output_path, timeout_ms),
+        args=(queue, video_url, output_path, timeout_ms, page_url),
     )
 
     process.start()
-    process.join(hard_timeout_seconds)
+    deadline = time.monotonic() + hard_timeout_seconds
+    while process.is_alive() and time.monotonic() < deadline and not (cancelled is not None and cancelled()):
+        process.join(min(0.5, max(0.0, deadline - time.monotonic())))
 
     if process.is_alive():
-        logger.warning(
-            "Playwright fallback exceeded hard timeout of %.1fs for %s; terminating worker",
-            hard_timeout_seconds,
-            video_url,
-        )
+        if cancelled is not None and cancelled():
+            logger.warning("Playwright fallback cancelled for %s; terminating worker", video_url)
+        else:
+            logger.warning(
+                "Playwright fallback exceeded hard timeout of %.1fs for %s; terminating worker",
+                hard_timeout_seconds,
+                video_url,
+            )
         process.terminate()
         process.join(5)
         if process.is_alive():
             logger.warning("Playwright fallback worker did not terminate; killing worker")
             process.kill()
             process.join(5)
-        _remove_partial_download(output_name)
+        _remove_partial_download(output_name, keep_partial)
         _close_queue(queue)
         return None
 
@@ -321,13 +471,13 @@ def _download_tiktok_playwright_with_hard_timeout(
     except Exception:
         if process.exitcode not in (0, None):
             logger.warning("Playwright fallback worker exited with code %s", process.exitcode)
-        _remove_partial_download(output_name)
+        _remove_partial_download(output_name, keep_partial)
         _close_queue(queue)
         return None
 
     if payload.get("error"):
         logger.warning("Playwright fallback worker failed: %s", payload["error"])
-        _remove_partial_download(output_name)
+        _remove_partial_download(output_name, keep_partial)
         _close_queue(queue)
         return None
 
@@ -336,12 +486,10 @@ def _download_tiktok_playwright_with_hard_timeout(
     return result
 
 
-def _remove_partial_download(file_path: str):
-    try:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-    except OSError:
-        logger.warning("Failed to remove partial Playwright download %s", file_path, exc_info=True)
+def _remove_partial_download(file_path: str, keep_partial: bool = False):
+    """Delete an unfinished Playwright download and its .part resume files, unless they are kept."""
+    if file_path and not keep_partial:
+        remove_partial_files([file_path])
 
 
 def _close_queue(queue):
@@ -355,10 +503,278 @@ def _close_queue(queue):
         pass
 
 
+def _get_playwright_int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _get_process_tree_rss_bytes(root_pid: int) -> int | None:
+    """Sum the resident memory of a process and its descendants (Linux only)."""
+    try:
+        children: dict[int, list[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat", "r", encoding="utf-8") as handle:
+                    stat = handle.read()
+            except OSError:
+                continue
+            parent_pid = int(stat.rsplit(")", 1)[1].split()[1])
+            children.setdefault(parent_pid, []).append(int(entry))
+
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        total = 0
+        pending = [root_pid]
+        while pending:
+            pid = pending.pop()
+            try:
+                with open(f"/proc/{pid}/statm", "r", encoding="utf-8") as handle:
+                    total += int(handle.read().split()[1]) * page_size
+            except OSError:
+                continue
+            pending.extend(children.get(pid, []))
+        return total
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _playwright_browser_worker_main(job_queue, result_queue):
+    try:
+        from playwright.sync_api import sync_playwright
+    except Exception as exc:
+        logger.info("Playwright not available for TikTok download: %s", exc)
+        job = job_queue.get()
+        if job is not None:
+            result_queue.put({"job_id": job["job_id"], "result": None, "error": None})
+        return
+
+    with sync_playwright() as playwright:
+        browser = None
+        try:
+            while True:
+                if browser is None or not browser.is_connected():
+                    browser = playwright.chromium.launch(headless=True)
+                job = job_queue.get()
+                if job is None:
+                    break
+                try:
+                    result = _run_tiktok_playwright_job(browser, job["page_url"], job["output_path"], job["timeout_ms"])
+                    result_queue.put({"job_id": job["job_id"], "result": result, "error": None})
+                except Exception as exc:
+                    logger.exception("Warm Playwright worker failed a job")
+                    result_queue.put({"job_id": job["job_id"], "result": None, "error": repr(exc)})
+        except Exception:
+            logger.exception("Warm Playwright worker crashed")
+        finally:
+            if browser is not None:
+                try:
+                    browser.close()
+                except Exception:
+                    pass
+
+
+class PlaywrightBrowserWorker:
+    """A long-lived process that keeps Chromium running and scrapes each job in a fresh context.
+
+    A job that overruns its hard timeout gets the whole process terminated (then killed), the same
+    as the one-shot worker. The process is also recycled after `max_jobs` jobs or once the process
+    tree's RSS passes `max_rss_bytes`; a value of 0 disables either limit.
+    """
+
+    def __init__(self, max_jobs: int, max_rss_bytes: int):
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_bytes
+        self.jobs_done = 0
+        self._process = None
+        self._job_queue = None
+        self._result_queue = None
+        self._job_ids = itertools.count(1)
+
+    def _start(self):
+        context = _get_multiprocessing_context()
+        self._job_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._process = context.Process(
+            target=_playwright_browser_worker_main,
+            args=(self._job_queue, self._result_queue),
+            daemon=True,
+        )
+        self._process.start()
+        self.jobs_done = 0
+        logger.info("Started warm Playwright worker (pid=%s)", self._process.pid)
+
+    def stop(self, graceful: bool = True):
+        process = self._process
+        if process is None:
+            return
+        self._process = None
+        if graceful and process.is_alive():
+            try:
+                self._job_queue.put(None)
+            except Exception:
+                pass
+            process.join(5)
+        if process.is_alive():
+            process.terminate()
+            process.join(5)
+            if process.is_alive():
+                logger.warning("Warm Playwright worker did not terminate; killing worker")
+                process.kill()
+                process.join(5)
+        _close_queue(self._job_queue)
+        _close_queue(self._result_queue)
+
+    def _wait_for_result(self, job_id: int, hard_timeout_seconds: float, cancelled=None) -> dict | None:
+        deadline = time.monotonic() + hard_timeout_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancelled is not None and cancelled()):
+                return None
+            try:
+                payload = self._result_queue.get(timeout=min(0.5, remaining))
+            except queue.Empty:
+                if not self._process.is_alive():
+                    return None
+                continue
+            if payload.get("job_id") == job_id:
+                return payload
+
+    def _recycle_reason(self) -> str | None:
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            return f"{self.jobs_done} jobs"
+        if self.max_rss_bytes:
+            rss = _get_process_tree_rss_bytes(self._process.pid)
+            if rss and rss > self.max_rss_bytes:
+                return f"RSS reached {rss // 1_000_000}MB"
+        return None
+
+    def run(
+        self,
+        page_url: str,
+        output_path: str | None,
+        timeout_ms: int,
+        hard_timeout_seconds: float,
+        keep_partial: bool = False,
+        cancelled=None,
+    ) -> dict | None:
+        if self._process is None or not self._process.is_alive():
+            self.stop(graceful=False)
+            self._start()
+
+        output_name = _get_tiktok_output_name_for_page_url(page_url, output_path)
+        job_id = next(self._job_ids)
+        self._job_queue.put({"job_id": job_id, "page_url": page_url, "output_path": output_path, "timeout_ms": timeout_ms})
+        payload = self._wait_for_result(job_id, hard_timeout_seconds, cancelled)
+
+        if payload is None:
+            if cancelled is not None and cancelled():
+                logger.warning("Playwright fallback cancelled for %s; terminating worker", page_url)
+            elif self._process.is_alive():
+                logger.warning(
+                    "Playwright fallback exceeded hard timeout of %.1fs for %s; terminating worker",
+                    hard_timeout_seconds,
+                    page_url,
+                )
+            else:
+                logger.warning("Warm Playwright worker exited with code %s", self._process.exitcode)
+            self.stop(graceful=False)
+            _remove_partial_download(output_name, keep_partial)
+            return None
+
+        self.jobs_done += 1
+        recycle_reason = self._recycle_reason()
+        if recycle_reason:
+            logger.info("Recycling warm Playwright worker after %s", recycle_reason)
+            self.stop()
+            # Start the replacement now so Chromium is already up for the next job.
+            self._start()
+
+        if payload.get("error"):
+            logger.warning("Playwright fallback worker failed: %s", payload["error"])
+            _remove_partial_download(output_name, keep_partial)
+            return None
+        return payload.get("result")
+
+
+class PlaywrightWorkerPool:
+    """Hands each job to an idle warm worker, waiting for one if they are all busy.
+
+    The wait counts against the job's hard timeout.
+    """
+
+    def __init__(self, size: int, max_jobs: int, max_rss_bytes: int):
+        self.size = size
+        self._idle: queue.Queue[PlaywrightBrowserWorker] = queue.Queue()
+        for _ in range(size):
+            self._idle.put(PlaywrightBrowserWorker(max_jobs, max_rss_bytes))
+
+    def run(
+        self,
+        page_url: str,
+        output_path: str | None,
+        timeout_ms: int,
+        hard_timeout_seconds: float,
+        keep_partial: bool = False,
+        cancelled=None,
+    ) -> dict | None:
+        deadline = time.monotonic() + hard_timeout_seconds
+        worker = self._acquire(deadline, cancelled)
+        if worker is None:
+            if cancelled is None or not cancelled():
+                logger.warning("No warm Playwright worker became free in time for %s", page_url)
+            return None
+        try:
+            return worker.run(
+                page_url, output_path, timeout_ms, deadline - time.monotonic(), keep_partial, cancelled
+            )
+        finally:
+            self._idle.put(worker)
+
+    def _acquire(self, deadline: float, cancelled=None) -> PlaywrightBrowserWorker | None:
+        """Wait for an idle worker until `deadline` (time.monotonic()); None if the job is cancelled first."""
+        while cancelled is None or not cancelled():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return self._idle.get(timeout=min(0.5, remaining))
+            except queue.Empty:
+                continue
+        return None
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().stop()
+
+
+_playwright_worker_pool: PlaywrightWorkerPool | None = None
+_playwright_worker_pool_lock = threading.Lock()
+
+
+def get_playwright_worker_pool() -> PlaywrightWorkerPool | None:
+    """Return the shared warm browser pool, or None when TIKBOT_PLAYWRIGHT_WORKERS=0."""
+    global _playwright_worker_pool
+    size = _get_playwright_int_env("TIKBOT_PLAYWRIGHT_WORKERS", 1)
+    if size <= 0:
+        return None
+    with _playwright_worker_pool_lock:
+        if _playwright_worker_pool is None:
+            _playwright_worker_pool = PlaywrightWorkerPool(
+                size,
+                _get_playwright_int_env("TIKBOT_PLAYWRIGHT_MAX_JOBS", 50),
+                _get_playwright_int_env("TIKBOT_PLAYWRIGHT_MAX_RSS_MB", 1024) * 1_000_000,
+            )
+        return _playwright_worker_pool
+
+
 def _download_tiktok_playwright_sync(
     video_url: str,
     output_path: str | None,
     timeout_ms: int,
+    page_url: str | None = None,
 ) -> dict | None:
     try:
         from playwright.sync_api import sync_playwright
@@ -366,61 +782,130 @@ def _download_tiktok_playwright_sync(
         logger.info("Playwright not available for TikTok download: %s", exc)
         return None
 
-    page_url = get_tiktok_video_page_url(video_url) or get_tiktok_embed_url(video_url)
+    page_url = page_url or get_tiktok_page_url(video_url)
     if not page_url:
         return None
 
+    with sync_playwright() as playwright:
+        try:
+            browser = playwright.chromium.launch(headless=True)
+        except Exception as exc:
+            logger.warning("Playwright Chromium launch failed: %s", exc)
+            return None
+        try:
+            return _run_tiktok_playwright_job(browser, page_url, output_path, timeout_ms)
+        finally:
+            browser.close()
+
+
+def _get_tiktok_output_name_for_page_url(page_url: str, output_path: str | None) -> str:
+    if output_path:
+        return output_path
+    video_id = _extract_tiktok_embed_id(page_url) or _extract_tiktok_video_id(page_url)
+    return f"{video_id}.mp4" if video_id else "tiktok.mp4"
+
+
+def _is_playwright_request_blocking_enabled() -> bool:
+    return (os.getenv("TIKBOT_PLAYWRIGHT_BLOCK_RESOURCES") or "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _should_block_playwright_request(url: str, resource_type: str | None) -> bool:
+    if (resource_type or "").lower() in _BLOCKED_RESOURCE_TYPES:
+        return True
+    host = _extract_host(url)
+    return any(host == tracker or host.endswith(f".{tracker}") for tracker in _TRACKER_HOSTS)
+
+
+def _download_first_tiktok_candidate(
+    candidate_urls: list[str],
+    tried_urls: set[str],
+    video_id: str | None,
+    output_name: str,
+    page_url: str,
+) -> dict | None:
+    for candidate_url in candidate_urls:
+        if not isinstance(candidate_url, str) or candidate_url in tried_urls:
+            continue
+        tried_urls.add(candidate_url)
+        if _is_subtitle_like_url(candidate_url):
+            logger.info("Skipping subtitle-like TikTok candidate url: %s", candidate_url)
+            continue
+        if _download_candidate_url(candidate_url, output_name, page_url):
+            return {
+                "video_id": video_id or "",
+                "download_url": candidate_url,
+                "embed_url": page_url,
+                "file_path": output_name,
+            }
+    return None
+
+
+def _run_tiktok_playwright_job(browser, page_url: str, output_path: str | None, timeout_ms: int) -> dict | None:
+    """Scrape one TikTok page in a fresh context of an already running browser."""
     video_id = _extract_tiktok_embed_id(page_url) or _extract_tiktok_video_id(page_url)
-    output_name = output_path or (f"{video_id}.mp4" if video_id else "tiktok.mp4")
+    output_name = _get_tiktok_output_name_for_page_url(page_url, output_path)
     logger.info("Attempting TikTok download via Playwright at %s", page_url)
 
     media_response = {"response": None, "count": 0}
     response_samples: list[tuple[str, str, str]] = []
     html_snapshot = None
     download_result = None
-    with sync_playwright() as playwright:
+    context = browser.new_context()
+    page = context.new_page()
+
+    def handle_response(response):
+        media_response["count"] += 1
+        if media_response["response"] is not None:
+            return
         try:
-            browser = playwright.chromium.launch(headless=True)
-        except Exception as exc:
-            logger.warning("Playwright Chromium launch failed: %s", exc)
-            return None
-        context = browser.new_context()
-        page = context.new_page()
+            resource_type = response.request.resource_type
+            content_type = response.headers.get("content-type", "")
+            url = response.url
+            if _is_downloadable_tiktok_video_response(url, content_type, resource_type, video_id):
+                media_response["response"] = response
+            elif len(response_samples) < 15:
+                response_samples.append((resource_type, content_type, url))
+        except Exception:
+            return
 
-        def handle_response(response):
-            media_response["count"] += 1
-            if media_response["response"] is not None:
-                return
-            try:
-                resource_type = response.request.resource_type
-                content_type = response.headers.get("content-type", "")
-                url = response.url
-                if _is_downloadable_tiktok_video_response(url, content_type, resource_type, video_id):
-                    media_response["response"] = response
-                elif len(response_samples) < 15:
-                    response_samples.append((resource_type, content_type, url))
-            except Exception:
-                return
+    page.on("response", handle_response)
+
+    blocked_requests = {"count": 0}
+
+    def handle_route(route):
+        request = route.request
+        if _should_block_playwright_request(request.url, request.resource_type):
+            blocked_requests["count"] += 1
+            route.abort()
+        else:
+            route.continue_()
 
-        page.on("response", handle_response)
+    block_resources = _is_playwright_request_blocking_enabled()
+    if block_resources:
+        context.route("**/*", handle_route)
 
+    timings: dict[str, float] = {}
+    started = time.monotonic()
+    try:
+        logger.info("Playwright navigating to %s", page_url)
+        # With page assets blocked, networkidle only adds waiting; the media request starts after DOM load.
+        page.goto(page_url, wait_until="domcontentloaded" if block_resources else "networkidle", timeout=timeout_ms)
+        timings["navigate"] = time.monotonic() - started
         try:
-            logger.info("Playwright navigating to %s", page_url)
-            page.goto(page_url, wait_until="networkidle", timeout=timeout_ms)
-            try:
-                played = page.evaluate(
-                    """() => {
-                        const video = document.querySelector('video');
-                        if (!video) return false;
-                        video.muted = true;
-                        return video.play().then(() => true).catch(() => false);
-                    }"""
-                )
-                logger.info("Playwright attempted video.play()=%s", played)
-            except Exception as exc:
-                logger.info("Playwright could not start video playback: %s", exc)
+            played = page.evaluate(
+                """() => {
+                    const video = document.querySelector('video');
+                    if (!video) return false;
+                    video.muted = true;
+                    return video.play().then(() => true).catch(() => false);
+                }"""
+            )
+            logger.info("Playwright attempted video.play()=%s", played)
+        except Exception as exc:
+            logger.info("Playwright could not start video playback: %s", exc)
+        if media_response["response"] is None:
             try:
-                response = page.wait_for_response(
+                media_response["response"] = page.wait_for_response(
                     lambda resp: (
                         _is_downloadable_tiktok_video_response(
                             resp.url,
@@ -431,16 +916,19 @@ def _download_tiktok_playwright_sync(
                     ),
                     timeout=timeout_ms,
                 )
-                media_response["response"] = response
             except Exception:
                 pass
-            deadline = time.time() + (timeout_ms / 1000.0)
-            while media_response["response"] is None and time.time() < deadline:
-                page.wait_for_timeout(250)
-            candidate_urls: list[str] = []
-            if media_response["response"] is not None:
-                candidate_urls.append(media_response["response"].url)
 
+        tried_urls: set[str] = set()
+        if media_response["response"] is not None:
+            timings["first_media_response"] = time.monotonic() - started
+            # Exit early: the first matching media response is almost always the video itself.
+            download_result = _download_first_tiktok_candidate(
+                [media_response["response"].url], tried_urls, video_id, output_name, page_url
+            )
+
+        if download_result is None:
+            candidate_urls: list[str] = []
             try:
                 dom_urls = page.evaluate(
                     """() => {
@@ -466,35 +954,24 @@ def _download_tiktok_playwright_sync(
 
             html_snapshot = page.content()
             candidate_urls.extend(_extract_tiktok_media_urls_from_html(html_snapshot, video_id))
+            download_result = _download_first_tiktok_candidate(candidate_urls, tried_urls, video_id, output_name, page_url)
 
-            deduped_candidate_urls: list[str] = []
-            seen_urls: set[str] = set()
-            for candidate_url in candidate_urls:
-                if not isinstance(candidate_url, str):
-                    continue
-                if candidate_url in seen_urls:
-                    continue
-                seen_urls.add(candidate_url)
-                deduped_candidate_urls.append(candidate_url)
-
-            for candidate_url in deduped_candidate_urls:
-                if _is_subtitle_like_url(candidate_url):
-                    logger.info("Skipping subtitle-like TikTok candidate url: %s", candidate_url)
-                    continue
-                if _download_candidate_url(candidate_url, output_name, page_url):
-                    download_result = {
-                        "video_id": video_id or "",
-                        "download_url": candidate_url,
-                        "embed_url": page_url,
-                        "file_path": output_name,
-                    }
-                    break
-        except Exception as exc:
-            logger.warning("Playwright failed to load TikTok embed page: %s", exc)
-        finally:
-            page.close()
-            context.close()
-            browser.close()
+        timings["download"] = time.monotonic() - started
+        logger.info(
+            "Playwright timings for %s: navigate=%.2fs first_media_response=%s download=%.2fs blocked_requests=%s",
+            page_url,
+            timings.get("navigate", 0.0),
+            f"{timings['first_media_response']:.2f}s" if "first_media_response" in timings else "none",
+            timings["download"],
+            blocked_requests["count"],
+        )
+        if download_result is not None:
+            download_result["timings"] = timings
+    except Exception as exc:
+        logger.warning("Playwright failed to load TikTok embed page: %s", exc)
+    finally:
+        page.close()
+        context.close()
 
     if download_result:
         return download_result
@@ -0,0 +1,53 @@
+import os
+
+from worker_pools import get_env_worker_count
+
+
+def get_transcode_worker_count():
+    return get_env_worker_count('TIKBOT_TRANSCODE_WORKERS', 1)
+
+
+def get_ffmpeg_thread_count():
+    """Threads each encode may use, so concurrent transcodes don't oversubscribe the host."""
+    default_threads = max(1, (os.cpu_count() or 1) // get_transcode_worker_count())
+    return get_env_worker_count('TIKBOT_FFMPEG_THREADS', default_threads)
+
+
+def get_transcode_max_height(video_bitrate_kbps):
+    # Drop long low-bitrate videos to 480p for better visual quality.
+    return 480 if video_bitrate_kbps <= 320 else 720
+
+
+def get_transcode_scale_filter(video_bitrate_kbps):
+    # Avoid upscaling.
+    return f"scale=-2:min({get_transcode_max_height(video_bitrate_kbps)}\\,ih)"
+
+
+def get_transcode_output_kwargs(calcResult, file_size_limit, encoder='libx265', preset='medium'):
+    # Target HEVC-in-MP4 for better compression while keeping Discord-friendly playback flags.
+    output_kwargs = {
+        'c:v': encoder,
+        'b:v': f"{calcResult.videoBitrate}k",
+        'maxrate': f"{calcResult.videoBitrate}k",
+        'c:a': 'aac',
+        'b:a': f"{calcResult.audioBitrate}k",
+        'bufsize': f"{2 * calcResult.videoBitrate}k",
+        'vf': get_transcode_scale_filter(calcResult.videoBitrate),
+        'pix_fmt': 'yuv420p',
+        'profile:v': 'main',
+        'tag:v': 'hvc1',
+        'preset': preset,
+        'threads': str(get_ffmpeg_thread_count()),
+        'x265-params': f"pools={get_ffmpeg_thread_count()}",
+        'fs': int(file_size_limit),
+        'movflags': '+faststart',
+        'f': 'mp4',
+    }
+    if encoder == 'libx264':
+        # H.264 when the time budget is too tight for HEVC.
+        output_kwargs['profile:v'] = 'high'
+        del output_kwargs['tag:v']
+        del output_kwargs['x265-params']
+    if calcResult.maxDuration:
+        output_kwargs['t'] = calcResult.maxDuration
+    return output_kwargs
@@ -0,0 +1,74 @@
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def get_env_worker_count(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+class WorkerLane:
+    """A bounded thread pool for one class of blocking work, with queue depth accounting."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=f"tikbot-{name}",
+        )
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+    def _call(self, state, func):
+        with self._lock:
+            if not state['started']:
+                state['started'] = True
+                self._queued -= 1
+            self._running += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _forget_cancelled(self, state, _future):
+        with self._lock:
+            if not state['started']:
+                state['started'] = True
+                self._queued -= 1
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        state = {'started': False}
+        with self._lock:
+            self._queued += 1
+            busy = self._running >= self.max_workers
+            queued = self._queued
+        if busy:
+            logger.info("%s lane busy; %s job(s) waiting for %s worker(s)", self.name, queued, self.max_workers)
+
+        future = loop.run_in_executor(
+            self._executor,
+            functools.partial(self._call, state, functools.partial(func, *args, **kwargs)),
+        )
+        future.add_done_callback(functools.partial(self._forget_cancelled, state))
+        return await future
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'maxWorkers': self.max_workers,
+                'queued': self._queued,
+                'running': self._running,
+            }
@@ -0,0 +1,412 @@
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+
+from download_errors import get_http_status, get_retry_after
+from partial_downloads import remove_partial_files
+
+logger = logging.getLogger(__name__)
+
+
+class YtdlpAttemptTimeout(Exception):
+    """A yt-dlp attempt ran past its wall-clock limit and its worker process was killed.
+
+    The limit covers waiting for an idle worker, and a caller cancelling the attempt ends it the
+    same way.
+    """
+
+
+class YtdlpWorkerError(Exception):
+    """An error raised inside a yt-dlp worker process, carried back by type name and message.
+
+    The HTTP status and Retry-After of the original error come along for retry decisions.
+    """
+
+    def __init__(self, error_type: str, message: str, status: int | None = None, retry_after: float | None = None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _get_int_env(name: str, default: int) -> int:
+    try:
+        return max(0, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def get_ytdlp_attempt_timeout() -> float:
+    try:
+        return max(1.0, float(os.getenv('TIKBOT_YTDLP_ATTEMPT_TIMEOUT', '150')))
+    except ValueError:
+        return 150.0
+
+
+def _get_multiprocessing_context():
+    try:
+        return multiprocessing.get_context(os.getenv('TIKBOT_YTDLP_MP_CONTEXT') or 'spawn')
+    except ValueError:
+        return multiprocessing.get_context()
+
+
+# Workers start lazily from the download-lane threads; one swap of __main__ at a time.
+_spawn_main_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _as_spawn_main():
+    """Make processes started inside this block import this module as their __main__.
+
+    A spawned child re-imports the parent's __main__, which for the bot is main.py: discord.py,
+    the client and its settings, all over again in every worker and on every recycle. This module
+    only needs the standard library until a job imports downloader.
+    """
+    with _spawn_main_lock:
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = sys.modules[__name__]
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main_module
+
+
+def _describe_error(exc: BaseException | None):
+    if exc is None:
+        return None
+    return {
+        'type': type(exc).__name__,
+        'message': str(exc),
+        'status': get_http_status(exc),
+        'retry_after': get_retry_after(exc),
+    }
+
+
+def _ytdlp_worker_main(job_queue, result_queue):
+    logging.basicConfig(
+        level=os.getenv("TIKBOT_LOG_LEVEL", "INFO"),
+        format="%(asctime)s %(levelname)s %(name)s[ytdlp-worker]: %(message)s",
+    )
+    import yt_dlp
+
+    import downloader
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+        job_id = job['job_id']
+        # Jobs follow the parent's current directory and environment, which may have changed
+        # since this process was started.
+        os.environ.clear()
+        os.environ.update(job['env'])
+        os.chdir(job['cwd'])
+        if job['kind'] == 'extract':
+            try:
+                info = downloader._extract_video_info(job['video_url'])
+                payload = {'job_id': job_id, 'info': downloader._portable_info(info) if info else None, 'error': None}
+            except BaseException as exc:
+                logger.exception("yt-dlp worker failed an extraction")
+                payload = {'job_id': job_id, 'info': None, 'error': _describe_error(exc)}
+            result_queue.put(payload)
+            continue
+
+        reported = set()
+
+        def report_partial(status):
+            for key in ('tmpfilename', 'filename'):
+                path = status.get(key)
+                if path and path not in reported:
+                    reported.add(path)
+                    result_queue.put({'job_id': job_id, 'partial': os.path.abspath(path)})
+
+        attempted_formats = []
+        try:
+            result, selected_format, last_exception = downloader._attempt_download(
+                job['video_url'],
+                attempted_formats,
+                label=job['label'],
+                size_limit=job['size_limit'],
+                progress_hooks=[report_partial],
+                audio_only=job['audio_only'],
+                concurrent_fragments=job['concurrent_fragments'],
+            )
+            payload = {
+                'job_id': job_id,
+                'result': yt_dlp.YoutubeDL.sanitize_info(result) if result is not None else None,
+                'selected_format': selected_format,
+                'attempted_formats': attempted_formats,
+                'error': _describe_error(last_exception),
+            }
+        except BaseException as exc:
+            logger.exception("yt-dlp worker failed a job")
+            payload = {
+                'job_id': job_id,
+                'result': None,
+                'selected_format': None,
+                'attempted_formats': attempted_formats,
+                'error': _describe_error(exc),
+            }
+        result_queue.put(payload)
+
+
+def _close_queue(job_queue):
+    try:
+        job_queue.close()
+    except Exception:
+        pass
+    try:
+        job_queue.join_thread()
+    except Exception:
+        pass
+
+
+def _failed_attempt(error: Exception, partial_paths: list) -> dict:
+    return {
+        'result': None,
+        'selected_format': None,
+        'attempted_formats': [],
+        'error': error,
+        'partial_paths': partial_paths,
+    }
+
+
+class YtdlpWorker:
+    """A reusable process that runs `_attempt_download` jobs, killed if one overruns its time limit.
+
+    Running yt-dlp here rather than on a thread means a hung extractor or stalled connection
+    can actually be stopped; the files it was writing are removed when that happens. The process
+    is recycled after `max_jobs` jobs (0 for never) to bound memory growth.
+    """
+
+    def __init__(self, max_jobs: int):
+        self.max_jobs = max_jobs
+        self.jobs_done = 0
+        self._process = None
+        self._job_queue = None
+        self._result_queue = None
+        self._job_ids = itertools.count(1)
+
+    def _start(self):
+        context = _get_multiprocessing_context()
+        self._job_queue = context.Queue()
+        self._result_queue = context.Queue()
+        self._process = context.Process(
+            target=_ytdlp_worker_main,
+            args=(self._job_queue, self._result_queue),
+            daemon=True,
+        )
+        with _as_spawn_main():
+            self._process.start()
+        self.jobs_done = 0
+        logger.info("Started yt-dlp worker (pid=%s)", self._process.pid)
+
+    def stop(self, graceful: bool = True):
+        process = self._process
+        if process is None:
+            return
+        self._process = None
+        if graceful and process.is_alive():
+            try:
+                self._job_queue.put(None)
+            except Exception:
+                pass
+            process.join(5)
+        if process.is_alive():
+            process.terminate()
+            process.join(5)
+            if process.is_alive():
+                logger.warning("yt-dlp worker did not terminate; killing worker")
+                process.kill()
+                process.join(5)
+        _close_queue(self._job_queue)
+        _close_queue(self._result_queue)
+
+    def _wait_for_result(self, job_id: int, timeout: float, partial_paths: list, cancelled=None) -> dict | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancelled is not None and cancelled()):
+                return None
+            try:
+                payload = self._result_queue.get(timeout=min(0.5, remaining))
+            except queue.Empty:
+                if not self._process.is_alive():
+                    return None
+                continue
+            if payload.get('job_id') != job_id:
+                continue
+            if 'partial' in payload:
+                partial_paths.append(payload['partial'])
+                continue
+            return payload
+
+    def run(
+        self,
+        video_url: str,
+        label: str | None,
+        size_limit: float | None,
+        timeout: float,
+        audio_only: bool = False,
+        concurrent_fragments: int | None = None,
+        keep_partials: bool = False,
+        cancelled=None,
+    ) -> dict:
+        """Run one attempt, killed once `cancelled()` returns true. The outcome's `partial_paths` lists
+        the files it wrote to; when it is killed they are deleted, unless `keep_partials` is set so a
+        retry can resume them."""
+        partial_paths = []
+        payload, error = self._submit(
+            {
+                'kind': 'download',
+                'video_url': video_url,
+                'label': label,
+                'size_limit': size_limit,
+                'audio_only': audio_only,
+                'concurrent_fragments': concurrent_fragments,
+            },
+            timeout,
+            partial_paths,
+            cancelled,
+        )
+        if payload is None:
+            if not keep_partials:
+                remove_partial_files(partial_paths)
+            return _failed_attempt(error, partial_paths)
+        return {**payload, 'error': error, 'partial_paths': partial_paths}
+
+    def extract(self, video_url: str, timeout: float) -> dict | None:
+        """Extract the metadata of `video_url` (see downloader._extract_video_info), or None."""
+        payload, error = self._submit({'kind': 'extract', 'video_url': video_url}, timeout, [])
+        if error is not None:
+            logger.info("Could not resolve video id for %s before download: %s", video_url, error)
+        return payload['info'] if payload else None
+
+    def _submit(
+        self, job: dict, timeout: float, partial_paths: list, cancelled=None
+    ) -> tuple[dict | None, Exception | None]:
+        """Run a job, returning its payload (None if the worker was killed or died) and error."""
+        if self._process is None or not self._process.is_alive():
+            self.stop(graceful=False)
+            self._start()
+
+        job_id = next(self._job_ids)
+        self._job_queue.put({**job, 'job_id': job_id, 'cwd': os.getcwd(), 'env': dict(os.environ)})
+        payload = self._wait_for_result(job_id, timeout, partial_paths, cancelled)
+
+        if payload is None:
+            if cancelled is not None and cancelled():
+                logger.warning("yt-dlp %s cancelled for %s; killing worker", job['kind'], job['video_url'])
+                error = YtdlpAttemptTimeout(f"yt-dlp {job['kind']} was cancelled")
+            elif self._process.is_alive():
+                logger.warning("yt-dlp %s exceeded %.0fs for %s; killing worker", job['kind'], timeout, job['video_url'])
+                error = YtdlpAttemptTimeout(f"yt-dlp {job['kind']} timed out after {timeout:.0f}s")
+            else:
+                logger.warning("yt-dlp worker exited with code %s", self._process.exitcode)
+                error = YtdlpWorkerError('WorkerExited', f"yt-dlp worker exited with code {self._process.exitcode}")
+            self.stop(graceful=False)
+            return None, error
+
+        self.jobs_done += 1
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            logger.info("Recycling yt-dlp worker after %s jobs", self.jobs_done)
+            self.stop()
+
+        error = payload.get('error')
+        if error is not None:
+            error = YtdlpWorkerError(error['type'], error['message'], error.get('status'), error.get('retry_after'))
+        return payload, error
+
+
+class YtdlpWorkerPool:
+    """Hands each attempt to an idle worker, waiting for one if they are all busy.
+
+    The wait counts against the attempt's time limit.
+    """
+
+    def __init__(self, size: int, max_jobs: int):
+        self.size = size
+        self._idle: queue.Queue[YtdlpWorker] = queue.Queue()
+        for _ in range(size):
+            self._idle.put(YtdlpWorker(max_jobs))
+
+    def run(
+        self,
+        video_url: str,
+        label: str | None,
+        size_limit: float | None,
+        timeout: float,
+        audio_only: bool = False,
+        concurrent_fragments: int | None = None,
+        keep_partials: bool = False,
+        cancelled=None,
+    ) -> dict:
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(deadline, cancelled)
+        if worker is None:
+            if cancelled is not None and cancelled():
+                return _failed_attempt(YtdlpAttemptTimeout("yt-dlp download was cancelled"), [])
+            logger.warning("No yt-dlp worker became free within %.0fs for %s", timeout, video_url)
+            return _failed_attempt(YtdlpAttemptTimeout(f"No yt-dlp worker became free within {timeout:.0f}s"), [])
+        try:
+            return worker.run(
+                video_url,
+                label,
+                size_limit,
+                deadline - time.monotonic(),
+                audio_only,
+                concurrent_fragments,
+                keep_partials,
+                cancelled,
+            )
+        finally:
+            self._idle.put(worker)
+
+    def extract(self, video_url: str, timeout: float) -> dict | None:
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(deadline)
+        if worker is None:
+            logger.info("Could not resolve video id for %s before download: no yt-dlp worker became free", video_url)
+            return None
+        try:
+            return worker.extract(video_url, deadline - time.monotonic())
+        finally:
+            self._idle.put(worker)
+
+    def _acquire(self, deadline: float, cancelled=None) -> YtdlpWorker | None:
+        """Wait for an idle worker until `deadline` (time.monotonic()); None if the job is cancelled first."""
+        while cancelled is None or not cancelled():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return self._idle.get(timeout=min(0.5, remaining))
+            except queue.Empty:
+                continue
+        return None
+
+    def close(self):
+        for _ in range(self.size):
+            self._idle.get().stop()
+
+
+_ytdlp_worker_pool: YtdlpWorkerPool | None = None
+_ytdlp_worker_pool_lock = threading.Lock()
+
+
+def get_ytdlp_worker_pool() -> YtdlpWorkerPool | None:
+    """Return the shared yt-dlp worker pool, or None when TIKBOT_YTDLP_WORKERS=0 (run in-process)."""
+    global _ytdlp_worker_pool
+    size = _get_int_env('TIKBOT_YTDLP_WORKERS', 2)
+    if size <= 0:
+        return None
+    with _ytdlp_worker_pool_lock:
+        if _ytdlp_worker_pool is None:
+            _ytdlp_worker_pool = YtdlpWorkerPool(size, _get_int_env('TIKBOT_YTDLP_MAX_JOBS', 100))
+        return _ytdlp_worker_pool